@@ -0,0 +1,40 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wireCodec import encode, decodeBinary, decodeCSV, decodeSpeed, decodeFlow, encodeSpeed, encodeFlow, encodeDPTemp, TYPE_DP_TEMP, TYPE_CONFIG
+
+"""
+Encode and decode cost per message of the CSV and binary wire formats, and their payload sizes.
+Run with 'python benchmarks/benchCodec.py'.
+"""
+
+NUMBER = 100000
+
+def nsPerCall(function) -> float:
+    return min(timeit.repeat(function, number=NUMBER, repeat=5)) / NUMBER * 1e9
+
+"""
+Each case: the values, and the encoder and decoder of each format as the publishers and subscribers call them.
+The topic has already told the subscriber the format, so the decoders don't look at it.
+"""
+CASES = [
+    ("speed", (1750,), lambda: str(1750), lambda payload: (float(payload),), lambda: encodeSpeed(1750), lambda payload: (decodeSpeed(payload),)),
+    ("flow", (12.34,), lambda: str(12.34), lambda payload: (float(payload),), lambda: encodeFlow(12.34), lambda payload: (decodeFlow(payload),)),
+    ("dpTemp", (3.21, 23.45), lambda: encode(TYPE_DP_TEMP, (3.21, 23.45), False), lambda payload: decodeCSV(payload, TYPE_DP_TEMP),
+        lambda: encodeDPTemp(3.21, 23.45), lambda payload: decodeBinary(payload, TYPE_DP_TEMP)),
+    ("config", (1, 1500, 1300, 1999, 8.0, 0.4), lambda: encode(TYPE_CONFIG, (1, 1500, 1300, 1999, 8.0, 0.4), False), lambda payload: decodeCSV(payload, TYPE_CONFIG),
+        lambda: encode(TYPE_CONFIG, (1, 1500, 1300, 1999, 8.0, 0.4), True), lambda payload: decodeBinary(payload, TYPE_CONFIG)),
+]
+
+if __name__ == "__main__":
+    print(f"{'message':<8} {'format':<7} {'bytes':>5} {'encode ns':>10} {'decode ns':>10}")
+    for name, values, encodeCSV, decodeCSVPayload, encodeBinary, decodeBinaryPayload in CASES:
+        for formatName, encoder, decoder in (("csv", encodeCSV, decodeCSVPayload), ("binary", encodeBinary, decodeBinaryPayload)):
+            payload = encoder()
+            if isinstance(payload, str):
+                payload = payload.encode()
+            # float32 fields round-trip to the nearest float32
+            assert all(abs(decoded - value) < 1e-5 for decoded, value in zip(decoder(payload), values)), (name, formatName)
+            print(f"{name:<8} {formatName:<7} {len(payload):>5} {nsPerCall(encoder):>10.0f} {nsPerCall(lambda: decoder(payload)):>10.0f}")
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import threading
+import benchEnv
+import motorControl
+from loopScheduler import RollingHistogram
+from consoleLog import ConsoleLog
+
+"""
+The motor loop's body time with the speed bar printed every tick, 'TICK_INTERVAL' apart for 'DURATION' seconds each:
+- 'print, /dev/null':   the original synchronous print() into DEVNULL, as startup.py runs the processes
+- 'print, slow pipe':   synchronous print() into a pipe drained slower than it's written, like a slow terminal or SSH session
+- 'console, slow pipe': consoleLog at CONSOLE_SAMPLE_HZ, into the same pipe
+- 'console, /dev/null': consoleLog turning itself off
+Run with 'python benchmarks/benchConsole.py'.
+"""
+
+TICK_INTERVAL = 0.001
+DURATION = 3.0
+DRAIN_BYTES_PER_SECOND = 20000
+
+"""
+A line buffered pipe whose reader only takes DRAIN_BYTES_PER_SECOND; once its buffer is full, writes block.
+"""
+def slowPipe():
+    read, write = os.pipe()
+    def drain():
+        while True:
+            try:
+                if not os.read(read, 200):
+                    return
+            except OSError:
+                return
+            time.sleep(200 / DRAIN_BYTES_PER_SECOND)
+    threading.Thread(target=drain, daemon=True).start()
+    return os.fdopen(write, "w", buffering=1)
+
+def runTicks(show) -> RollingHistogram:
+    body = RollingHistogram(window=int(DURATION / TICK_INTERVAL))
+    cfg = motorControl.config
+    end = time.monotonic() + DURATION
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        speed = motorControl.getNextSpeed(cfg, 0)
+        motorControl.previousSpeed = speed
+        show(speed)
+        body.add(time.perf_counter() - start)
+        time.sleep(TICK_INTERVAL)
+    return body
+
+if __name__ == "__main__":
+    devnull = open(os.devnull, "w")
+    pipe = slowPipe()
+    cases = (
+        ("print, /dev/null", lambda speed: print(motorControl.formatMotorSpeed(speed), file=devnull)),
+        ("print, slow pipe", lambda speed: print(motorControl.formatMotorSpeed(speed), file=pipe)),
+    )
+    for name, show in cases:
+        print(f"{name:<20} body {runTicks(show).summary()}", file=sys.stderr)
+
+    for name, stream in (("console, slow pipe", pipe), ("console, /dev/null", devnull)):
+        console = ConsoleLog(stream)
+        body = runTicks(lambda speed: console.sample("speed", motorControl.formatMotorSpeed, speed))
+        print(f"{name:<20} body {body.summary()}  console {console.summary()}", file=sys.stderr)
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import random
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from topicDispatcher import TopicDispatcher
+
+"""
+Dispatch cost per message with 1k and 10k distinct topics, fe. many boxes with a few sensors each:
+- 'filters':  the client's message_callback_add filters, as displayManager had them, with the callback splitting the topic again
+- 'dispatch': topicDispatcher with a cache big enough for every topic
+- 'thrash':   topicDispatcher with a cache of a tenth of the topics, so most messages parse their topic again
+Messages arrive on randomly chosen topics. Run with 'python benchmarks/benchDispatch.py'.
+"""
+
+MESSAGES = 200000
+DATA_TYPES = ("inflowRate", "outflowRate", "diffPressure", "temperature")
+
+def makeTopics(count: int) -> list:
+    return [f"box{i // 4:05d}/sensor{i:05d}/{DATA_TYPES[i % 4]}/out/" for i in range(count)]
+
+def nsPerMessage(handle, messages) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        handle(message)
+    return (time.perf_counter() - start) / len(messages) * 1e9
+
+def filtersCase(topics: list, order: list) -> float:
+    def flowMessage(client, userdata, message):
+        fields = message.topic.split("/")
+        return fields[2]
+    def valueMessage(client, userdata, message):
+        return message.payload
+
+    client = mqtt.Client()
+    client.message_callback_add("+/+/inflowRate/out/", flowMessage)
+    client.message_callback_add("+/+/outflowRate/out/", flowMessage)
+    client.message_callback_add("+/+/diffPressure/out/", valueMessage)
+    client.message_callback_add("+/+/temperature/out/", valueMessage)
+    client.message_callback_add("+/motor/speed/out/", valueMessage)
+    client.message_callback_add("+/motor/speed/frame/", valueMessage)
+    client.message_callback_add("+/+/inflowRate/bin/", flowMessage)
+    client.message_callback_add("+/+/outflowRate/bin/", flowMessage)
+    client.message_callback_add("+/+/diffPressure/bin/", valueMessage)
+    client.message_callback_add("+/motor/speed/bin/", valueMessage)
+
+    messages = []
+    for topic in topics:
+        message = mqtt.MQTTMessage(topic=topic.encode())
+        message.payload = b"12.5"
+        messages.append(message)
+    return nsPerMessage(client._handle_on_message, [messages[i] for i in order])
+
+def dispatchCase(topics: list, order: list, maxTopics: int) -> tuple:
+    def handler(fields, payload):
+        return fields.dataType
+
+    dispatcher = TopicDispatcher(maxTopics)
+    for dataType in DATA_TYPES:
+        dispatcher.add(handler, dataType=dataType)
+    messages = [(topics[i], b"12.5") for i in order]
+    ns = nsPerMessage(lambda message: dispatcher.dispatch(*message), messages)
+    return ns, dispatcher.summary()
+
+if __name__ == "__main__":
+    random.seed(1)
+    for count in (1000, 10000):
+        topics = makeTopics(count)
+        order = [random.randrange(count) for _ in range(MESSAGES)]
+        print(f"{count} topics:")
+        print(f"  filters:  {filtersCase(topics, order):7.0f} ns/message")
+        ns, summary = dispatchCase(topics, order, 2 * count)
+        print(f"  dispatch: {ns:7.0f} ns/message  {summary}")
+        ns, summary = dispatchCase(topics, order, count // 10)
+        print(f"  thrash:   {ns:7.0f} ns/message  {summary}")
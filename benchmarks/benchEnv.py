@@ -0,0 +1,15 @@
+import os
+import sys
+from dotenv import load_dotenv
+
+"""
+Common setup of the benchmarks: makes the project's modules importable and loads their configuration.
+The project's .env is used if there is one, otherwise .env.example, so the benchmarks also run on a fresh checkout.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, "sensors"))
+
+envFile = os.path.join(ROOT, ".env")
+load_dotenv(envFile if os.path.exists(envFile) else os.path.join(ROOT, ".env.example"))
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import MetricsRegistry, instrumentClient
+from loopScheduler import LoopScheduler
+
+"""
+The metrics' cost on the hot path, per call:
+- 'counter' and 'histogram': one update of each kind
+- 'publish': a QoS 0 publish on a disconnected client, bare and counted by instrumentClient
+- 'tick':    a control loop tick of the scheduler with a zero-length deadline, bare and with the motor's three histograms on onTick
+and the cost of a scrape of a registry about the size of the motor's. Run with 'python benchmarks/benchMetrics.py'.
+"""
+
+CALLS = 200000
+
+def nsPerCall(function, calls: int = CALLS) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+def tickNs(onTick) -> float:
+    # A fake clock that moves a microsecond per reading keeps every tick late, so wait() never sleeps
+    now = [0.0]
+    def clock():
+        now[0] += 1e-6
+        return now[0]
+    scheduler = LoopScheduler(1e-9, clock=clock, sleep=lambda delay: None, onTick=onTick)
+    return nsPerCall(scheduler.wait)
+
+if __name__ == "__main__":
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "A counter.")
+    histogram = registry.histogram("bench_seconds", "A histogram.")
+    print(f"counter:    {nsPerCall(counter.inc):7.0f} ns/call")
+    print(f"histogram:  {nsPerCall(lambda: histogram.observe(0.003)):7.0f} ns/call")
+
+    client = mqtt.Client()
+    bare = nsPerCall(lambda: client.publish("box01/motor/speed/out/", "1500"), CALLS // 10)
+    instrumentClient(client, registry)
+    counted = nsPerCall(lambda: client.publish("box01/motor/speed/out/", "1500"), CALLS // 10)
+    print(f"publish:    {bare:7.0f} ns/call bare, {counted:.0f} ns/call counted (+{counted - bare:.0f})")
+
+    period = registry.histogram("motor_loop_period_seconds", "Period.")
+    lateness = registry.histogram("motor_loop_lateness_seconds", "Lateness.")
+    body = registry.histogram("motor_loop_body_seconds", "Body.")
+    def observeTick(tickPeriod, tickLateness, tickBody):
+        period.observe(tickPeriod)
+        lateness.observe(tickLateness)
+        body.observe(tickBody)
+    bare = tickNs(None)
+    observed = tickNs(observeTick)
+    print(f"tick:       {bare:7.0f} ns/call bare, {observed:.0f} ns/call with metrics (+{observed - bare:.0f}), {(observed - bare) * 1e-9 / 250e-3 * 100:.4f}% of a 250 ms period")
+
+    for i in range(20):
+        registry.counter("bench_function_total", "Function counters.", {"index": i}, function=lambda: i)
+    start = time.perf_counter()
+    for _ in range(100):
+        text = registry.exposition()
+    print(f"scrape:     {(time.perf_counter() - start) / 100 * 1e6:7.0f} us/scrape, {len(text)} bytes")
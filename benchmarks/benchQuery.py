@@ -0,0 +1,68 @@
+import time
+import tempfile
+import numpy as np
+import benchEnv
+from telemetryRecorder import TelemetryRecorder, INFLOW_TYPE
+from telemetryQuery import TelemetryStore, downsample
+
+"""
+Time-range queries of telemetryQuery over 'HOURS' hours of one series sampled at 'RATE' Hz, recorded first:
+- 'record':              TelemetryRecorder.record() with the rollups built as the samples arrive
+- 'rollups, 6 h @ 1 s':  TelemetryStore.query() from the 1 s tier
+- 'raw, 6 h @ 1 s':      the same buckets computed from the raw samples, as without the rollups
+- 'rollups, 6 h @ 9 m':  displayManager's zoomed-out history of 40 points, from the 1 min tier
+- 'raw, last 10 min':    TelemetryStore.raw() of the newest samples, a binary search into the last segment
+- 'raw, 10 s chunk':     TelemetryStore.raw() of 10 s in the middle, what replay.py reads at a time
+The rollup and raw means are checked to match. Each query is the best of 'REPEATS' runs.
+Run with 'python benchmarks/benchQuery.py'.
+"""
+
+HOURS = 6
+RATE = 50
+REPEATS = 5
+SERIES = f"box07/inflow01/{INFLOW_TYPE}"
+
+def best(function) -> tuple:
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        count = HOURS * 3600 * RATE
+        end = time.time() // 60 * 60
+        start = end - HOURS * 3600
+        timestamps = (start + np.arange(count) / RATE).tolist()
+        values = (10.0 + np.sin(np.arange(count) / 1000.0)).tolist()
+
+        recorder = TelemetryRecorder(directory, segmentRecords=65536, segmentSeconds=0)
+        began = time.perf_counter()
+        for timestamp, value in zip(timestamps, values):
+            recorder.record(SERIES, timestamp, value)
+        elapsed = time.perf_counter() - began
+        recorder.close()
+        print(f"{'record:':<22} {count / elapsed:9.0f} samples/s  {recorder.summary()}")
+
+        store = TelemetryStore(directory)
+        def fromRaw():
+            samples = store.raw(SERIES, start, end)
+            return downsample(samples["time"], samples["value"], samples["value"], samples["value"], np.ones(len(samples)), 1.0)
+        cases = (
+            ("rollups, 6 h @ 1 s", lambda: store.query(SERIES, start, end, 1.0)),
+            ("raw, 6 h @ 1 s", fromRaw),
+            ("rollups, 6 h @ 9 m", lambda: store.history(SERIES, HOURS * 3600, 40)),
+            ("raw, last 10 min", lambda: store.raw(SERIES, end - 600, end)),
+            ("raw, 10 s chunk", lambda: store.raw(SERIES, start + 3600, start + 3610)),
+        )
+        results = {}
+        for name, function in cases:
+            elapsed, results[name] = best(function)
+            print(f"{name + ':':<22} {elapsed * 1000:9.2f} ms  {len(results[name])} rows")
+
+        rollups, raw = results["rollups, 6 h @ 1 s"], results["raw, 6 h @ 1 s"]
+        assert np.array_equal(rollups["time"], raw["time"]) and np.allclose(rollups["mean"], raw["mean"])
+        assert np.array_equal(rollups["min"], raw["min"]) and np.array_equal(rollups["max"], raw["max"])
+        store.close()
@@ -0,0 +1,64 @@
+import os
+import time
+import tempfile
+import benchEnv
+from telemetryRecorder import TelemetryRecorder, INFLOW_TYPE, DP_TYPE
+from telemetrySegments import SegmentReader, listSegments
+from topicDispatcher import TopicDispatcher
+from wireCodec import encodeFlow, encodeDPTemp
+
+"""
+Recording rate of telemetryRecorder, in samples a second:
+- 'record':   TelemetryRecorder.record() alone, samples spread over 8 series
+- 'csv':      whole messages through the dispatcher, decoded from text as they arrive from MQTT
+- 'binary':   the same in the binary wire format; a pressure message is two samples
+and a reader mapping a segment while it's written. Segments are small enough to rotate during the run.
+Run with 'python benchmarks/benchRecorder.py'.
+"""
+
+SAMPLES = 400000
+SERIES = [f"box01/sensor{i:02d}/{INFLOW_TYPE}" for i in range(8)]
+
+def rate(function, count: int) -> float:
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = TelemetryRecorder(os.path.join(directory, "record"), segmentRecords=65536, segmentSeconds=0)
+        def recordAll():
+            now = time.time()
+            for i in range(SAMPLES):
+                recorder.record(SERIES[i & 7], now, float(i))
+        print(f"record:  {rate(recordAll, SAMPLES):9.0f} samples/s  {recorder.summary()}")
+
+        for name, messages, samplesPerMessage in (
+            ("csv", [(f"box01/inflow{i % 8:02d}/{INFLOW_TYPE}/out", b"12.5") for i in range(SAMPLES)], 1),
+            ("binary", [(f"box01/dp{i % 8:02d}/{DP_TYPE}/bin", encodeDPTemp(1.5, 21.0)) if i & 1 else (f"box01/inflow{i % 8:02d}/{INFLOW_TYPE}/bin", encodeFlow(12.5)) for i in range(SAMPLES)], 1.5),
+        ):
+            recorder = TelemetryRecorder(os.path.join(directory, name), segmentRecords=65536, segmentSeconds=0)
+            dispatcher = TopicDispatcher()
+            dispatcher.add(recorder.recordMessage)
+            def dispatchAll():
+                for topic, payload in messages:
+                    dispatcher.dispatch(topic, payload)
+            print(f"{name + ':':<8} {rate(dispatchAll, int(SAMPLES * samplesPerMessage)):9.0f} samples/s  {recorder.summary()}")
+
+        # A reader follows the segment being written, without copying it
+        recorder = TelemetryRecorder(os.path.join(directory, "follow"), segmentRecords=SAMPLES, segmentSeconds=0)
+        recorder.record(SERIES[0], time.time(), 0.0)
+        reader = SegmentReader(listSegments(recorder.directory, SERIES[0])[-1])
+        seen = 0
+        start = time.perf_counter()
+        for i in range(1, SAMPLES):
+            recorder.record(SERIES[0], time.time(), float(i))
+            if i % 10000 == 0:
+                records = reader.records()
+                seen = len(records)
+                assert records["value"][-1] == seen - 1
+        elapsed = time.perf_counter() - start
+        records = None
+        print(f"follow:  {SAMPLES / elapsed:9.0f} samples/s written while the reader saw {seen} of them, shares memory: {not reader.records().flags.owndata}")
+        reader.close()
+        recorder.close()
@@ -0,0 +1,94 @@
+import os
+import time
+import tempfile
+import benchEnv
+import matplotlib
+matplotlib.use("Agg")
+import displayManager
+from displayHeadless import HeadlessRenderer, RawRGBSink
+
+"""
+Frame time of displayManager's two renderers, drawn off screen with the Agg backend:
+'redraw' clears and rebuilds every graph each frame, 'blit' updates the lines and texts and redraws only them,
+'headless' is displayHeadless.py's renderer writing each frame to a memory-mapped raw RGB file.
+Each frame gets one new sample per series, then a series of frames without new data shows the cost of a skipped frame.
+Run with 'python benchmarks/benchRender.py'.
+"""
+
+FRAMES = 100
+
+def fillHistory():
+    for i in range(displayManager.max_size):
+        addSample(i)
+
+def addSample(i):
+    displayManager.appendToList(displayManager.flowInList, (i * 7) % 300 - 150)
+    displayManager.appendToList(displayManager.flowOutList, (i * 5) % 300 - 150)
+    displayManager.appendToList(displayManager.pressureList, (i * 3) % 200 - 100)
+    displayManager.appendToList(displayManager.speedList, 1300 + i % 700)
+    displayManager.temperatureValue = 22.5
+
+"""
+The full redraw, as FuncAnimation does it without blitting: the animation function, then a draw of the whole canvas.
+"""
+def redrawFrame(fig, i):
+    displayManager.animateGraphs(i)
+    fig.canvas.draw()
+
+"""
+What FuncAnimation does with blit=True: restore the saved background, draw the changed artists and blit their axes.
+"""
+def blitFrame(fig, backgrounds, i):
+    artists = displayManager.updateGraphs(i)
+    for ax, background in backgrounds.items():
+        if any(artist.axes is ax for artist in artists):
+            fig.canvas.restore_region(background)
+    for artist in artists:
+        artist.axes.draw_artist(artist)
+    for ax in {artist.axes for artist in artists}:
+        fig.canvas.blit(ax.bbox)
+
+def measure(frame) -> float:
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    for i in range(FRAMES):
+        addSample(i)
+        frame(i)
+    wall = (time.perf_counter() - start) / FRAMES
+    cpu = (time.process_time() - cpuStart) / FRAMES
+    return wall, cpu
+
+def measureIdle(frame) -> float:
+    start = time.perf_counter()
+    for i in range(FRAMES):
+        frame(i)
+    return (time.perf_counter() - start) / FRAMES
+
+if __name__ == "__main__":
+    displayManager.STATS_INTERVAL = 0
+    fillHistory()
+
+    fig = displayManager.createFigure()
+    redraw = lambda i: redrawFrame(fig, i)
+    wall, cpu = measure(redraw)
+    print(f"redraw: {wall * 1e3:7.2f} ms/frame, {cpu * 1e3:7.2f} ms CPU/frame, {measureIdle(redraw) * 1e3:7.2f} ms/frame without new data")
+
+    fig = displayManager.createFigure()
+    displayManager.createArtists()
+    for artist in displayManager.initGraphs():
+        artist.set_animated(True)
+    fig.canvas.draw()
+    backgrounds = {ax: fig.canvas.copy_from_bbox(ax.bbox) for ax in (displayManager.ax1, displayManager.ax2, displayManager.ax3)}
+    blit = lambda i: blitFrame(fig, backgrounds, i)
+    wall, cpu = measure(blit)
+    print(f"blit:   {wall * 1e3:7.2f} ms/frame, {cpu * 1e3:7.2f} ms CPU/frame, {measureIdle(blit) * 1e3:7.2f} ms/frame without new data")
+
+    renderer = HeadlessRenderer(800, 480, 100)
+    sink = RawRGBSink(os.path.join(tempfile.gettempdir(), "benchRender.rgb"), 800, 480)
+    def headlessFrame(i):
+        frame = renderer.render()
+        if frame is not None:
+            sink.write(frame)
+    wall, cpu = measure(headlessFrame)
+    print(f"headless: {wall * 1e3:5.2f} ms/frame, {cpu * 1e3:7.2f} ms CPU/frame, {measureIdle(headlessFrame) * 1e3:7.2f} ms/frame without new data")
+    sink.close()
@@ -0,0 +1,68 @@
+import time
+import timeit
+import numpy as np
+import benchEnv
+import motorControl
+from waveform import DifferentialWaveform
+
+"""
+Micro-benchmark of the differential mode speed: the original per-tick np.sin implementation against
+motorControl.getMotorSpeed(), the control loop's entry point, which plays the precomputed table in waveform.py.
+Run with 'python benchmarks/benchWaveform.py'.
+"""
+
+class Settings:
+	def __init__(self, minSpeed=1300, maxSpeed=1999, period=10.0, ratio=0.5):
+		self.min = minSpeed
+		self.max = maxSpeed
+		self.period = period
+		self.ratio = ratio
+
+"""
+The implementation of getDifferentialSpeed before the lookup tables, kept here as the reference.
+"""
+def legacyDifferentialSpeed(settings, now) -> int:
+	timeWithinPeriod = now % settings.period
+	risingDuration = settings.period * settings.ratio
+	fallingDuration = settings.period - risingDuration
+
+	if timeWithinPeriod < risingDuration:
+		if risingDuration == 0:
+			sinValue = 0
+		else:
+			sinValue = np.sin(np.pi * 0.5 * timeWithinPeriod / risingDuration)
+	else:
+		if fallingDuration == 0:
+			sinValue = 0
+		else:
+			sinValue = np.sin(np.pi + np.pi * 0.5 * (timeWithinPeriod - risingDuration) / fallingDuration) + 1.0
+
+	scaledValue = settings.min + sinValue * (settings.max - settings.min)
+	return int(scaledValue)
+
+def bench(label, function, number):
+	seconds = min(timeit.repeat(function, number=number, repeat=5))
+	print(f"{label:<40} {seconds / number * 1e9:10.0f} ns/call")
+	return seconds / number
+
+if __name__ == "__main__":
+	settings = Settings()
+	config = motorControl.configFromValues(motorControl.validateConfig(f"1,{settings.min},{settings.min},{settings.max},{settings.period},{settings.ratio}"))
+	waveform = DifferentialWaveform(settings.min, settings.max, settings.period, settings.ratio)
+	number = 200000
+
+	legacy = bench("legacy np.sin per tick", lambda: legacyDifferentialSpeed(settings, time.time()), number)
+	table = bench("getMotorSpeed, differential mode", lambda: motorControl.getMotorSpeed(config), number)
+	bench("of which the table lookup", lambda: waveform.speedAt(time.time()), number)
+	bench("table build (once per config)", lambda: DifferentialWaveform(1300, 1999, 10.0, 0.5), 200)
+	bench("whole period at 100 Hz", lambda: waveform.trajectory(100.0), 2000)
+	print(f"Speedup per tick: {legacy / table:.1f}x")
+
+	# Largest difference to the reference over a dense grid of times and a few ratios
+	worst = 0
+	for ratio in (0.0, 0.2, 0.5, 0.8, 1.0):
+		reference = Settings(ratio=ratio)
+		engine = DifferentialWaveform(1300, 1999, 10.0, ratio)
+		for t in np.linspace(0.0, 20.0, 20011):
+			worst = max(worst, abs(engine.speedAt(t) - legacyDifferentialSpeed(reference, t)))
+	print(f"Largest difference to the reference: {worst}")
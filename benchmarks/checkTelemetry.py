@@ -0,0 +1,140 @@
+import os
+import tempfile
+import numpy as np
+import benchEnv
+from telemetrySegments import SegmentWriter, SegmentReader, COUNT, COUNT_OFFSET, CLOSED_OFFSET
+from telemetryRecorder import TelemetryRecorder, INFLOW_TYPE
+from telemetryQuery import TelemetryStore, downsample
+
+"""
+Deterministic checks of the telemetry segments and rollups for the cases that are hard to hit with a live recorder,
+without a broker; each prints 'ok' or fails an assert:
+- 'truncated segment':  a segment whose count is ahead of its records, as a crash or a reader on another core sees it
+- 'search':             SegmentReader.search() at, between and beyond the records' times, and raw() at segment boundaries
+- 'rollups':            the 1 s, 10 s and 1 min tiers against a downsample of the raw samples, with speed frames
+                        arriving out of order within a second, and with a frame arriving after its second has closed
+Run with 'python benchmarks/checkTelemetry.py'.
+"""
+
+SERIES = f"box01/inflow01/{INFLOW_TYPE}"
+FRAME_SAMPLES = 10
+RATE = 50
+
+def checkTruncatedSegment(directory: str):
+    path = os.path.join(directory, "truncated.seg")
+    writer = SegmentWriter(path, seriesID=1, capacity=8)
+    for i in range(5):
+        writer.append(100.0 + i, float(i))
+    # The count of two more records got to the file, their records didn't
+    COUNT.pack_into(writer.map, COUNT_OFFSET, 7)
+    reader = SegmentReader(path)
+    assert reader.count() == 5, reader.count()
+    assert reader.records()["value"].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert reader.first() == 100.0
+    # A closed segment with records missing isn't taken as final: they may still land
+    COUNT.pack_into(writer.map, CLOSED_OFFSET, 1)
+    assert reader.count() == 5 and reader.finalCount is None
+    writer.count = 5
+    writer.append(105.0, 5.0)
+    writer.append(106.0, 6.0)
+    assert reader.count() == 7 and reader.finalCount == 7
+    # A count past the capacity is cut at it
+    COUNT.pack_into(writer.map, COUNT_OFFSET, 1000)
+    reader.finalCount = None
+    assert reader.count() == 7
+    reader.close()
+    writer.close()
+
+    # An empty segment has no first time
+    writer = SegmentWriter(os.path.join(directory, "empty.seg"), seriesID=1, capacity=4)
+    reader = SegmentReader(writer.path)
+    assert reader.count() == 0 and reader.first() == float("inf") and len(reader.records()) == 0
+    reader.close()
+    writer.close()
+
+def checkSearch(directory: str):
+    path = os.path.join(directory, "search.seg")
+    times = [10.0, 11.0, 11.0, 11.0, 12.0, 13.0, 14.0, 14.0]
+    writer = SegmentWriter(path, seriesID=1, capacity=len(times))
+    for timestamp in times:
+        writer.append(timestamp, 0.0)
+    reader = SegmentReader(path)
+    for timestamp in (9.0, 10.0, 10.5, 11.0, 11.5, 12.0, 14.0, 14.5, 100.0):
+        for count in range(len(times) + 1):
+            expected = int(np.searchsorted(times[:count], timestamp, "left"))
+            assert reader.search(timestamp, count) == expected, (timestamp, count)
+    reader.close()
+    writer.close()
+
+    # raw() across segments of 4 records: a range starting or ending on a segment's first time, or on the one before it
+    recording = os.path.join(directory, "recording")
+    recorder = TelemetryRecorder(recording, segmentRecords=4, segmentSeconds=0)
+    times = np.arange(20, dtype=np.float64) + 1000.0
+    for timestamp in times:
+        recorder.record(SERIES, timestamp, timestamp - 1000.0)
+    recorder.close()
+    store = TelemetryStore(recording)
+    edges = [times[0] - 1, times[-1] + 1] + [times[i] + offset for i in (0, 3, 4, 8, 19) for offset in (-0.5, 0.0, 0.5)]
+    for start in edges:
+        for end in edges:
+            raw = store.raw(SERIES, start, end)
+            expected = times[(times >= start) & (times < end)]
+            assert raw["time"].tolist() == expected.tolist(), (start, end)
+    store.close()
+
+"""
+Records 'frames' of FRAME_SAMPLES samples each, in the given order, and compares every tier with the raw samples.
+"""
+def recordFrames(directory: str, frames: list, start: float):
+    recorder = TelemetryRecorder(directory, segmentRecords=65536, segmentSeconds=0)
+    for frame in frames:
+        for i in range(FRAME_SAMPLES):
+            timestamp = start + (frame * FRAME_SAMPLES + i) / RATE
+            recorder.record(SERIES, timestamp, 10.0 + np.sin(frame * FRAME_SAMPLES + i))
+    recorder.close()
+    return TelemetryStore(directory)
+
+def compare(store: TelemetryStore, start: float, end: float, resolution: float):
+    samples = store.raw(SERIES, start, end)
+    order = np.argsort(samples["time"], kind="stable")
+    times, values = samples["time"][order], samples["value"][order]
+    expected = downsample(times, values, values, values, np.ones(len(times), dtype=np.uint64), resolution)
+    rolled = store.query(SERIES, start, end, resolution)
+    assert rolled["time"].tolist() == expected["time"].tolist(), resolution
+    assert rolled["count"].tolist() == expected["count"].tolist(), resolution
+    assert np.allclose(rolled["min"], expected["min"]) and np.allclose(rolled["max"], expected["max"]), resolution
+    assert np.allclose(rolled["mean"], expected["mean"]), resolution
+
+def checkRollups(directory: str):
+    start = 1_700_000_040.0     # on a minute's edge, so the tiers' buckets line up with the samples
+    seconds = 150
+    perSecond = RATE // FRAME_SAMPLES
+    # Each second's frames arrive in reverse: out of order, but the rollups see them while the second is open
+    frames = [second * perSecond + frame for second in range(seconds) for frame in reversed(range(perSecond))]
+    store = recordFrames(os.path.join(directory, "reversed"), frames, start)
+    for resolution in (1.0, 10.0, 60.0):
+        compare(store, start - 60, start + seconds + 60, resolution)
+    store.close()
+
+    # The last frame of second 5 arrives after second 6 has begun: it goes into second 6's bucket, nothing is lost
+    late = 5 * perSecond + perSecond - 1
+    frames = list(range(seconds * perSecond))
+    frames.remove(late)
+    frames.insert(frames.index(6 * perSecond) + 1, late)
+    store = recordFrames(os.path.join(directory, "late"), frames, start)
+    rolled = store.query(SERIES, start - 60, start + seconds + 60, 1.0)
+    counts = dict(zip(rolled["time"].tolist(), rolled["count"].tolist()))
+    assert counts[start + 5] == RATE - FRAME_SAMPLES and counts[start + 6] == RATE + FRAME_SAMPLES
+    samples = store.raw(SERIES, start - 60, start + seconds + 60)
+    for resolution in (1.0, 10.0, 60.0):
+        rolled = store.query(SERIES, start - 60, start + seconds + 60, resolution)
+        assert int(rolled["count"].sum()) == len(samples)
+        assert np.isclose((rolled["mean"] * rolled["count"]).sum(), samples["value"].sum())
+        assert rolled["min"].min() == samples["value"].min() and rolled["max"].max() == samples["value"].max()
+    store.close()
+
+if __name__ == "__main__":
+    for name, check in (("truncated segment", checkTruncatedSegment), ("search", checkSearch), ("rollups", checkRollups)):
+        with tempfile.TemporaryDirectory() as directory:
+            check(directory)
+        print(f"{name + ':':<19} ok")
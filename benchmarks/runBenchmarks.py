@@ -0,0 +1,243 @@
+import io
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import subprocess
+import statistics
+import contextlib
+
+# The ventilator's PWM goes to the fake pigpio; before benchEnv, as the .env files don't override the environment
+os.environ["MOTOR_PWM_BACKEND"] = "fake"
+import benchEnv
+import matplotlib
+matplotlib.use("Agg")
+from loopScheduler import LoopScheduler, POLICY_CATCHUP
+from metrics import MetricsRegistry, instrumentClient
+import consoleLog
+
+"""
+The project's hot paths, timed without hardware or a broker, written as JSON and compared against a stored baseline:
+- 'motor.*':   getMotorSpeed in differential mode, limitAcceleration, validateConfig, getMotorConfigMQTTString and formatMotorConfig,
+               and the np.sin differential speed getMotorSpeed replaced, see benchWaveform.py, as the reference
+- 'sensor.*':  flowDPSensors.publishFlow and publishDP parsing a line, into an MQTT client that drops the messages
+- 'display.*': displayManager.appendToList, and a frame of animateGraphs drawn with the Agg backend
+- 'tick.*':    whole ticks of motorControl's controlLoop(), driving nothing as motorController.py does, and driving
+               motorControllerVentilator's ESC with the fake pigpio; with the client that drops the messages,
+               and a scheduler that never sleeps
+Every case is timed 'repeats' times, each run long enough to take 0.2 s, with the garbage collector off; the best and
+the median run are recorded. The console is off, as it is under startup.py. Cases filtered out with '-k' aren't built.
+
+A case whose median is slower than the baseline's by more than the tolerance is a regression, and the exit status is 1.
+The baseline's medians are first scaled by how much slower or faster the reference case is in this run than in the
+baseline: its code never changes, so that is the machine's speed, and a baseline saved elsewhere still compares.
+A scaled median is only an estimate, as not every case gains or loses the same on another CPU; a baseline saved on the
+machine that runs the comparison is still the most exact. The median moves less than the best run between identical
+runs, but on a busy machine still by tens of percent, so the default tolerance is 50%.
+getMotorSpeed is also compared with the reference directly: being slower than the code it replaced is a regression too.
+Run with 'python benchmarks/runBenchmarks.py'; '--save-baseline' replaces the baseline with the results.
+"""
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+REFERENCE = "motor.legacyDifferentialSpeed"     # always run, the others are compared relative to it
+TICKS = 1000    # control loop ticks per timed call
+
+parser = argparse.ArgumentParser(description="Times the project's hot paths and compares them against a baseline.")
+parser.add_argument("-o", "--output", help="Where to write the results as JSON.")
+parser.add_argument("-b", "--baseline", default=BASELINE_FILE, help="The baseline to compare against. Defaults to benchmarks/baseline.json.")
+parser.add_argument("--save-baseline", action="store_true", help="Writes the results as the new baseline.")
+parser.add_argument("-t", "--tolerance", type=float, default=0.5, help="Slowdown of the median against the baseline that counts as a regression, 0.5 for 50%%.")
+parser.add_argument("-r", "--repeats", type=int, default=7, help="Timed runs per case.")
+parser.add_argument("-k", "--filter", default="", help="Runs only the cases whose name contains this.")
+
+"""
+Stands in for the paho client: counts the messages instead of sending them.
+"""
+class NullClient:
+    def __init__(self):
+        self.messages = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.messages += 1
+
+    def disconnect(self):
+        pass
+
+"""
+Runs the control loop for 'ticks' ticks without sleeping, then stops it the way Ctrl-C does.
+"""
+class TickLimit(LoopScheduler):
+    def __init__(self, ticks: int):
+        super().__init__(1e-9, POLICY_CATCHUP, sleep=lambda delay: None)
+        self.remaining = ticks
+
+    def wait(self) -> int:
+        self.remaining -= 1
+        if self.remaining < 0:
+            raise KeyboardInterrupt
+        return super().wait()
+
+"""
+Returns a function running 'ticks' ticks of motorControl's controlLoop() with the given drive, running in differential mode.
+"""
+def controlLoopTicks(drive, ticks: int = TICKS):
+    import motorControl as motor
+    motor.client = instrumentClient(NullClient(), MetricsRegistry())
+    motor.changePublisher.client = motor.client
+    motor.LOOP_STATS_INTERVAL = 0
+    motor.config = motor.configFromValues(motor.validateConfig(f"1,{motor.MIN_SPEED},{motor.MIN_SPEED},{motor.MAX_SPEED},3.0,0.5"))
+    motor.status.running = True
+    def run():
+        motor.scheduler = TickLimit(ticks)
+        with contextlib.redirect_stdout(io.StringIO()):
+            motor.controlLoop(drive)
+    return run
+
+"""
+The cases of each part of the project, by name, as the function to time and the operations per call.
+'selected' tells whether a case is to be run; the ones that are costly to set up are only built if it is.
+"""
+def motorCases(selected):
+    import motorControl as motor
+    from benchWaveform import legacyDifferentialSpeed
+    settings = motor.DifferentialSettings(motor.MIN_SPEED, motor.MAX_SPEED, 3.0, 0.5)
+    config = motor.configFromValues(motor.validateConfig(f"1,{motor.MIN_SPEED},{motor.MIN_SPEED},{motor.MAX_SPEED},3.0,0.5"))
+    configString = motor.formatMotorConfig(config)
+    return {
+        "motor.getMotorSpeed": (lambda: motor.getMotorSpeed(config), 1),
+        REFERENCE: (lambda: legacyDifferentialSpeed(settings, time.time()), 1),
+        "motor.limitAcceleration": (lambda: motor.limitAcceleration(motor.MAX_SPEED, motor.MIN_SPEED), 1),
+        "motor.validateConfig": (lambda: motor.validateConfig(configString), 1),
+        "motor.getMotorConfigMQTTString": (lambda: motor.getMotorConfigMQTTString(config), 1),
+        "motor.formatMotorConfig": (lambda: motor.formatMotorConfig(config), 1),
+    }
+
+def sensorCases(selected):
+    import flowDPSensors
+    client = NullClient()
+    return {
+        "sensor.publishFlow": (lambda: flowDPSensors.publishFlow(client, "box01/flowIn01/inflowRate/out", b"23.45F\r\n"), 1),
+        "sensor.publishDP": (lambda: flowDPSensors.publishDP(client, "box01/diffPressure01", b"1.234,22.50\r\n"), 1),
+    }
+
+def displayCases(selected):
+    import displayManager
+    displayManager.STATS_INTERVAL = 0
+    for i in range(displayManager.max_size):
+        displayManager.appendToList(displayManager.flowInList, i)
+        displayManager.appendToList(displayManager.flowOutList, -i)
+        displayManager.appendToList(displayManager.pressureList, i % 7)
+        displayManager.appendToList(displayManager.speedList, 1300 + i)
+    displayManager.temperatureValue = 22.5
+    cases = {"display.appendToList": (lambda: displayManager.appendToList(displayManager.flowInList, 12.5), 1)}
+    if selected("display.animateGraphs"):
+        fig = displayManager.createFigure()
+        def frame():
+            displayManager.appendToList(displayManager.flowInList, 12.5)
+            displayManager.animateGraphs(0)
+            fig.canvas.draw()
+        cases["display.animateGraphs"] = (frame, 1)
+    return cases
+
+def tickCases(selected):
+    import motorControl
+    import motorControllerVentilator
+    return {
+        "tick.motorController": (controlLoopTicks(motorControl.Drive()), TICKS),
+        "tick.motorControllerVentilator": (controlLoopTicks(motorControllerVentilator.ESCDrive()), TICKS),
+    }
+
+CASES = (motorCases, sensorCases, displayCases, tickCases)
+
+"""
+Times a function doing 'operations' operations per call. Returns the best and the median time per operation, in ns.
+"""
+def measure(function, operations: int, repeats: int) -> dict:
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(number, 1)
+    perOperation = [total / number / operations * 1e9 for total in timer.repeat(repeats, number)]
+    return {"ns": min(perOperation), "median_ns": statistics.median(perOperation), "repeats": repeats, "calls": number, "operations": operations}
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=benchEnv.ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(), "machine": platform.machine(), "platform": platform.platform(),
+        "cpus": os.cpu_count(), "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+"""
+Prints the medians of the results against the baseline's, scaled by the reference case. Returns the names of the cases that regressed.
+"""
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    scale = 1.0
+    if REFERENCE in results and REFERENCE in baseline:
+        scale = results[REFERENCE]["median_ns"] / baseline[REFERENCE]["median_ns"]
+        print(f"The reference takes {scale:.2f}x its baseline time, the baseline is scaled by that")
+    elif baseline:
+        print("The baseline has no reference case; its times are compared as they are, which only holds on the machine it was saved on")
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<32} {result['median_ns']:12.1f} ns/op   (not in the baseline)")
+            continue
+        expected = before["median_ns"] * scale
+        change = result["median_ns"] / expected - 1.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -tolerance:
+            flag = "  faster"
+        print(f"{name:<32} {result['median_ns']:12.1f} ns/op   baseline {expected:12.1f}   {change * 100:+7.1f}%{flag}")
+    return regressions
+
+"""
+Prints how getMotorSpeed compares with the np.sin speed it replaced, timed in the same run. Returns False if it's slower.
+"""
+def compareLegacy(results: dict) -> bool:
+    new, legacy = results.get("motor.getMotorSpeed"), results.get(REFERENCE)
+    if new is None or legacy is None:
+        return True
+    speedup = legacy["median_ns"] / new["median_ns"]
+    print(f"motor.getMotorSpeed is {speedup:.2f}x as fast as the np.sin speed it replaced{'' if speedup >= 1.0 else '  REGRESSION'}")
+    return speedup >= 1.0
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    consoleLog.console.enabled = False
+
+    selected = lambda name: args.filter in name or name == REFERENCE
+    results = {}
+    for cases in CASES:
+        for name, (function, operations) in cases(selected).items():
+            if selected(name):
+                results[name] = measure(function, operations, args.repeats)
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            saved = json.load(file)
+        baseline = saved["results"]
+        print(f"Baseline of {saved['environment']['commit'] or 'unknown commit'}, Python {saved['environment']['python']} on {saved['environment']['machine']}")
+    regressions = compare(results, baseline, args.tolerance)
+    if not compareLegacy(results):
+        regressions.append("motor.getMotorSpeed against the legacy speed")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Saved as the baseline: {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regressions beyond {args.tolerance * 100:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
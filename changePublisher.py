@@ -0,0 +1,72 @@
+import time
+
+'''
+Publish-on-change for slowly changing topics, such as the motor's config and status.
+
+A message is published retained when its value changes, and again every 'heartbeat' seconds
+so that a lost message is eventually corrected. Everything in between is skipped and counted, as long as
+'counting' is on; the motor controllers turn it off while the motor is stopped, as publishing every tick doesn't
+publish anything then either.
+'''
+
+"""
+Counts published and avoided messages. Shared by all the topics of a ChangePublisher.
+"""
+class PublishCounters:
+	def __init__(self):
+		self.sent: int = 0
+		self.bytesSent: int = 0
+		self.avoided: int = 0
+		self.bytesAvoided: int = 0
+
+	def summary(self) -> str:
+		return f"sent={self.sent} ({self.bytesSent} B) avoided={self.avoided} ({self.bytesAvoided} B)"
+
+"""
+Wraps an MQTT client; publish() sends a topic's payload only when it differs from the last one sent, or when the heartbeat is due.
+A heartbeat of 0 disables the heartbeat.
+"""
+class ChangePublisher:
+	def __init__(self, client, heartbeat: float = 5.0, retain: bool = True, qos: int = 1, clock=time.monotonic):
+		self.client = client
+		self.heartbeat = heartbeat
+		self.retain = retain
+		self.qos = qos
+		self.clock = clock
+		self.last = {}		# topic -> (change key, time published, payload size)
+		self.counters = PublishCounters()
+		self.counting = True	# whether skipped messages are counted as avoided
+
+	"""
+	Publishes the payload if it has changed. 'key' is what is compared to detect a change and defaults to the payload itself;
+	pass something narrower when the payload carries values that change every time.
+	'payload' may also be a function returning the payload, so it's only built when it's actually sent.
+	A skipped message is counted, while 'counting' is on, as the size of the last one sent on the topic.
+	Returns True if the message was published.
+	"""
+	def publish(self, topic: str, payload, key=None) -> bool:
+		now = self.clock()
+		if key is None:
+			if callable(payload):
+				payload = payload()
+			key = payload
+		previous = self.last.get(topic)
+		if previous is not None and previous[0] == key and (self.heartbeat <= 0 or now - previous[1] < self.heartbeat):
+			if self.counting:
+				self.counters.avoided += 1
+				self.counters.bytesAvoided += previous[2]
+			return False
+
+		if callable(payload):
+			payload = payload()
+		self.client.publish(topic, payload, qos=self.qos, retain=self.retain)
+		self.last[topic] = (key, now, len(payload))
+		self.counters.sent += 1
+		self.counters.bytesSent += len(payload)
+		return True
+
+	"""
+	Forgets what has been published, so every topic is sent again on its next publish(). Used after a reconnect.
+	"""
+	def reset(self):
+		self.last.clear()
@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
 import tkinter as tk
+import profiling
 
 load_dotenv()
 
@@ -255,6 +256,7 @@ def onClosing():
     root.quit()
 
 if __name__ == "__main__":
+    profiling.start("commandManagerUi")
     client.on_connect = onConnect
     client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 0)
 
@@ -0,0 +1,98 @@
+import time
+import threading
+from loopScheduler import RollingHistogram
+
+'''
+Immutable config snapshots shared between the MQTT thread and the control loop.
+
+A new config is never written into the config the loop is reading. The MQTT thread builds a complete new snapshot
+and rebinds the module's 'config' to it; rebinding a name is atomic, so the loop sees either the old config or the new one,
+never half of each. The loop reads 'config' once per tick and uses that snapshot for the whole tick, without taking a lock.
+Since every change makes a new object, "has the config changed" is an identity check.
+'''
+
+"""
+Base class of the snapshots: the values are given to the constructor and can't be changed afterwards.
+Subclasses list their fields in __slots__.
+"""
+class Snapshot:
+	__slots__ = ()
+
+	def __init__(self, **values):
+		for name in self.__slots__:
+			object.__setattr__(self, name, values[name])
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f"{type(self).__name__} is immutable, make a new one with replace()")
+
+	def __delattr__(self, name):
+		raise AttributeError(f"{type(self).__name__} is immutable")
+
+	"""
+	Returns a copy with the given fields changed.
+	"""
+	def replace(self, **changes):
+		values = {name: getattr(self, name) for name in self.__slots__}
+		values.update(changes)
+		copy = object.__new__(type(self))
+		for name, value in values.items():
+			object.__setattr__(copy, name, value)
+		return copy
+
+	def values(self) -> tuple:
+		return tuple(getattr(self, name) for name in self.__slots__)
+
+	def __eq__(self, other):
+		return type(other) is type(self) and other.values() == self.values()
+
+	def __hash__(self):
+		return hash(self.values())
+
+	def __repr__(self):
+		return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+"""
+Receipt and first use of configs: the time from a config arriving on the MQTT thread to the control loop using it.
+A config replaced by a newer one before the loop got to it is counted as superseded.
+The lock is only taken when a config arrives and on the first tick that uses it, never on other ticks.
+"""
+class ConfigEvents:
+	def __init__(self, window: int = 100, clock=time.monotonic):
+		self.clock = clock
+		self.latency = RollingHistogram(window=window)
+		self.received = 0
+		self.applied = 0
+		self.superseded = 0
+		self.pending = None		# (snapshot, time received)
+		self.last = None		# (time received, time applied) of the last config applied
+		self.lock = threading.Lock()
+
+	"""
+	Called on the MQTT thread right before the new snapshot is swapped in.
+	"""
+	def receive(self, snapshot):
+		now = self.clock()
+		with self.lock:
+			if self.pending is not None:
+				self.superseded += 1
+			self.pending = (snapshot, now)
+			self.received += 1
+
+	"""
+	Called by the control loop when it first uses a snapshot. Returns the time from its receipt in seconds,
+	or None if it wasn't a received config, fe. the defaults.
+	"""
+	def apply(self, snapshot):
+		now = self.clock()
+		with self.lock:
+			if self.pending is None or self.pending[0] is not snapshot:
+				return None
+			receivedAt = self.pending[1]
+			self.pending = None
+			self.applied += 1
+		self.last = (receivedAt, now)
+		self.latency.add(now - receivedAt)
+		return now - receivedAt
+
+	def summary(self) -> str:
+		return f"received={self.received} applied={self.applied} superseded={self.superseded} receipt to use {self.latency.summary()}"
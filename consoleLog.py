@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+'''
+Console output that can't stall the control loops.
+
+print() writes synchronously: a slow terminal or a full pipe blocks the loop until the line is out, and with the output
+sent to DEVNULL (see startup.py) every line is still formatted for nothing. ConsoleLog instead
+- formats lazily: the loop queues the message and its arguments, the writer thread formats them
+- writes from a background thread, every 'interval' seconds, all the queued lines in one write
+- rate-limits the per-sample lines to CONSOLE_SAMPLE_HZ lines a second per key; the rest are counted and dropped
+- turns itself off when there's nowhere to write: with CONSOLE_MODE="auto", when stdout is missing or /dev/null
+The hot path of an enabled log is a clock read, a dictionary lookup and a deque append; of a disabled one, an attribute check.
+
+Lines written through ConsoleLog may come out after print()s made after them; rare messages, like the loop statistics,
+still use print().
+'''
+
+CONSOLE_MODE = os.getenv("CONSOLE_MODE", "auto")      # 'auto' is off when stdout goes nowhere, 'on' or 'off' force it
+CONSOLE_SAMPLE_HZ = float(os.getenv("CONSOLE_SAMPLE_HZ", "4"))    # per-sample lines a second per key, 0 for every one
+
+"""
+Returns True if the stream goes somewhere: it exists and isn't /dev/null.
+"""
+def hasSink(stream) -> bool:
+    if stream is None:
+        return False
+    try:
+        status = os.fstat(stream.fileno())
+        null = os.stat(os.devnull)
+    except (AttributeError, OSError, ValueError):
+        # Not a file, fe. a StringIO; someone reads it
+        return True
+    return (status.st_dev, status.st_ino) != (null.st_dev, null.st_ino)
+
+"""
+Returns the text of a queued message: a function called with the arguments, or a str.format() template.
+"""
+def render(message, args: tuple) -> str:
+    if callable(message):
+        return message(*args)
+    return message.format(*args) if args else message
+
+class ConsoleLog:
+    def __init__(self, stream=None, rate: float = CONSOLE_SAMPLE_HZ, mode: str = CONSOLE_MODE, interval: float = 0.05, maxPending: int = 10000):
+        if mode not in ("auto", "on", "off"):
+            raise ValueError(f"Unknown console mode: {mode}")
+        self.stream = stream if stream is not None else sys.stdout
+        self.enabled = mode == "on" or (mode == "auto" and hasSink(self.stream))
+        self.spacing = 1.0 / rate if rate > 0 else 0.0
+        self.interval = interval
+        self.maxPending = maxPending
+        self.pending = deque()
+        self.nextAllowed = {}     # key -> monotonic time its next line is allowed
+        self.written = 0
+        self.limited = 0          # lines dropped by the rate limit
+        self.overflowed = 0       # lines dropped because the writer fell behind
+        self.thread = None
+        self.lock = threading.Lock()
+
+    """
+    Queues a per-sample line, unless a line of the same key was queued less than 1 / rate seconds ago.
+    'message' is a str.format() template or a function returning the line, called with 'args' on the writer thread.
+    """
+    def sample(self, key, message, *args):
+        if not self.enabled:
+            return
+        if self.spacing:
+            now = time.monotonic()
+            if now < self.nextAllowed.get(key, 0.0):
+                self.limited += 1
+                return
+            self.nextAllowed[key] = now + self.spacing
+        self.enqueue(message, args)
+
+    """
+    Queues a line that isn't rate-limited.
+    """
+    def line(self, message, *args):
+        if self.enabled:
+            self.enqueue(message, args)
+
+    def enqueue(self, message, args: tuple):
+        if len(self.pending) >= self.maxPending:
+            self.overflowed += 1
+            return
+        self.pending.append((message, args))
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name="console", daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def run(self):
+        while self.enabled:
+            time.sleep(self.interval)
+            self.flush()
+
+    """
+    Formats and writes everything queued so far. A stream that fails, fe. a closed pipe, turns the log off.
+    """
+    def flush(self):
+        with self.lock:
+            lines = []
+            while self.pending:
+                message, args = self.pending.popleft()
+                try:
+                    lines.append(render(message, args))
+                except Exception as error:
+                    lines.append(f"Something went wrong :: formatting {message!r} :: {error}")
+            if not lines:
+                return
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+                self.written += len(lines)
+            except (OSError, ValueError):
+                self.enabled = False
+                self.pending.clear()
+
+    def summary(self) -> str:
+        return f"{'on' if self.enabled else 'off'}: written={self.written} rate limited={self.limited} overflowed={self.overflowed}"
+
+# The process' console
+console = ConsoleLog()
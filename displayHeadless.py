@@ -0,0 +1,233 @@
+import os
+import time
+import mmap
+import shutil
+import argparse
+import numpy as np
+import matplotlib
+
+# Agg renders into memory; it must be chosen before displayManager imports pyplot
+matplotlib.use("Agg")
+import matplotlib.image
+import displayManager
+from loopScheduler import LoopScheduler, RollingHistogram
+from metrics import startMetrics
+import profiling
+
+'''
+Headless display: renders the same flow, pressure, temperature and speed panels as 'displayManager.py'
+without a window, a GUI toolkit or an event loop, and writes every frame to one of:
+- png:  a rotating set of PNG files, 'frame-0.png' .. 'frame-<N-1>.png', plus 'latest.png' replaced atomically
+- rgb:  a raw frame file of height * width * 3 bytes (RGB888, rows top to bottom), memory-mapped and overwritten in place
+- fb:   a Linux framebuffer device such as /dev/fb0, memory-mapped; the figure is sized to the screen
+
+Frames are rendered at a fixed rate, and only when new data has arrived since the last one. The axes are drawn once and
+each frame only redraws the lines and texts over the saved background, like the blitting renderer of the window.
+A frame that takes longer than the budget is counted; when frames keep taking longer than the interval,
+ticks are skipped rather than queued up.
+'''
+
+parser = argparse.ArgumentParser(description="Renders the box's graphs without a window, to PNG files, a raw RGB file or a framebuffer.")
+parser.add_argument("-o", "--output", choices=["png", "rgb", "fb"], default="png", help="Where the frames go.")
+parser.add_argument("-p", "--path", type=str, help="Directory of the PNG files, the raw RGB file or the framebuffer device. Defaults to 'frames', 'frame.rgb' and '/dev/fb0'.")
+parser.add_argument("-f", "--fps", type=float, default=float(os.getenv("DISPLAY_HEADLESS_FPS", "10")), help="Frames per second.")
+parser.add_argument("-b", "--budget", type=float, help="Frame time budget in milliseconds. Defaults to the frame interval.")
+parser.add_argument("-r", "--rotate", type=int, default=10, help="Number of PNG files to rotate through.")
+parser.add_argument("-W", "--width", type=int, default=800, help="Width of the frames in pixels; a framebuffer's own size is used instead.")
+parser.add_argument("-H", "--height", type=int, default=480, help="Height of the frames in pixels; a framebuffer's own size is used instead.")
+parser.add_argument("--dpi", type=int, default=100, help="Resolution of the figure, which sets the size of the texts relative to the frame.")
+profiling.addArguments(parser)
+
+# Hot-path sections, see profiling.py; 'render' is the animation function within the draw
+DRAW_SECTION = profiling.section("draw")
+WRITE_SECTION = profiling.section("write")
+
+"""
+Writes frames as PNG files, rotating through 'count' of them so a viewer always finds a complete recent one.
+"""
+class PNGSink:
+    def __init__(self, directory: str, count: int):
+        if count <= 0:
+            raise ValueError(f"Non-positive number of PNG files: {count}")
+        self.directory = directory
+        self.count = count
+        self.index = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, rgba: np.ndarray):
+        # Encoded once under a temporary name, then renamed into place and hard-linked as 'latest.png';
+        # renames are atomic, so a viewer never finds a half-written file
+        temporary = os.path.join(self.directory, ".frame.png")
+        matplotlib.image.imsave(temporary, rgba)
+        path = os.path.join(self.directory, f"frame-{self.index}.png")
+        os.replace(temporary, path)
+        self.index = (self.index + 1) % self.count
+        try:
+            os.link(path, temporary)
+        except OSError:
+            # No hard links on this file system, or a temporary file left by a crash
+            shutil.copyfile(path, temporary)
+        os.replace(temporary, os.path.join(self.directory, "latest.png"))
+
+    def close(self):
+        pass
+
+"""
+Writes frames into a memory-mapped raw RGB888 file of a fixed size, overwritten in place every frame.
+"""
+class RawRGBSink:
+    def __init__(self, path: str, width: int, height: int):
+        self.file = open(path, "w+b")
+        self.file.truncate(width * height * 3)
+        self.map = mmap.mmap(self.file.fileno(), width * height * 3)
+        self.frame = np.frombuffer(self.map, dtype=np.uint8).reshape(height, width, 3)
+
+    def write(self, rgba: np.ndarray):
+        self.frame[...] = rgba[:, :, :3]
+
+    def close(self):
+        del self.frame
+        self.map.close()
+        self.file.close()
+
+"""
+Writes frames straight into a Linux framebuffer. The size and pixel format are read from sysfs;
+32 bits per pixel is taken to be BGRX and 16 bits RGB565, the formats of the Raspberry Pi's framebuffers.
+"""
+class FramebufferSink:
+    def __init__(self, device: str):
+        name = os.path.basename(device)
+        self.width, self.height = readSysfs(name, "virtual_size", int, ",")
+        (self.bitsPerPixel,) = readSysfs(name, "bits_per_pixel", int)
+        (self.stride,) = readSysfs(name, "stride", int)
+        if self.bitsPerPixel not in (16, 32):
+            raise ValueError(f"Unsupported framebuffer format: {self.bitsPerPixel} bits per pixel")
+
+        self.file = open(device, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), self.stride * self.height)
+        dtype = np.uint16 if self.bitsPerPixel == 16 else np.uint8
+        rows = np.frombuffer(self.map, dtype=np.uint8).reshape(self.height, self.stride)
+        pixels = rows[:, :self.width * self.bitsPerPixel // 8].view(dtype)
+        self.frame = pixels if self.bitsPerPixel == 16 else pixels.reshape(self.height, self.width, 4)
+
+    def write(self, rgba: np.ndarray):
+        if self.bitsPerPixel == 16:
+            red = rgba[:, :, 0].astype(np.uint16) >> 3
+            green = rgba[:, :, 1].astype(np.uint16) >> 2
+            blue = rgba[:, :, 2].astype(np.uint16) >> 3
+            self.frame[...] = (red << 11) | (green << 5) | blue
+        else:
+            self.frame[:, :, 0] = rgba[:, :, 2]
+            self.frame[:, :, 1] = rgba[:, :, 1]
+            self.frame[:, :, 2] = rgba[:, :, 0]
+            self.frame[:, :, 3] = 255
+
+    def close(self):
+        del self.frame
+        self.map.close()
+        self.file.close()
+
+"""
+Reads a value of a framebuffer from /sys/class/graphics, fe. virtual_size "800,480".
+"""
+def readSysfs(name: str, attribute: str, valueType, separator: str = None) -> tuple:
+    with open(f"/sys/class/graphics/{name}/{attribute}") as file:
+        return tuple(valueType(value) for value in file.read().strip().split(separator))
+
+"""
+Draws the graphs into the Agg canvas. The static parts are drawn once and saved,
+every frame restores them and draws the lines and texts that changed.
+"""
+class HeadlessRenderer:
+    def __init__(self, width: int, height: int, dpi: int):
+        self.fig = displayManager.createFigure()
+        self.fig.set_dpi(dpi)
+        self.fig.set_size_inches(width / dpi, height / dpi)
+        self.fig.suptitle(displayManager.BOX_ID, fontsize=24)
+        displayManager.createArtists()
+        self.artists = [displayManager.flowInLine, displayManager.flowOutLine, displayManager.pressureLine,
+                        displayManager.temperatureText, displayManager.speedText]
+        for artist in self.artists:
+            artist.set_animated(True)
+
+        self.canvas = self.fig.canvas
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    """
+    Renders a frame if new data has arrived. Returns the pixels as a height x width x 4 RGBA array
+    sharing memory with the canvas, or None if nothing changed.
+    """
+    def render(self):
+        if not displayManager.updateGraphs(None):
+            return None
+        self.canvas.restore_region(self.background)
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+        return np.asarray(self.canvas.buffer_rgba())
+
+"""
+Renders and writes frames at 'fps' until interrupted.
+"""
+def run(renderer: HeadlessRenderer, sink, fps: float, budget: float):
+    scheduler = LoopScheduler(1.0 / fps)
+    frameTime = RollingHistogram()
+    written = 0
+    overBudget = 0
+    nextReport = time.monotonic() + displayManager.STATS_INTERVAL
+    scheduler.start()
+    while True:
+        start = time.perf_counter()
+        with DRAW_SECTION:
+            frame = renderer.render()
+        if frame is not None:
+            with WRITE_SECTION:
+                sink.write(frame)
+            elapsed = time.perf_counter() - start
+            frameTime.add(elapsed)
+            written += 1
+            if elapsed > budget:
+                overBudget += 1
+
+        if displayManager.STATS_INTERVAL > 0 and time.monotonic() >= nextReport:
+            nextReport += displayManager.STATS_INTERVAL
+            print(f"Output :: written={written} over budget={overBudget} render+write {frameTime.summary()}")
+        scheduler.wait()
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    profiling.start("displayHeadless")
+    if args.fps <= 0:
+        raise ValueError(f"Non-positive frame rate: {args.fps}")
+    budget = (args.budget if args.budget is not None else 1000.0 / args.fps) / 1000.0
+    displayManager.RENDER_MODE = f"headless {args.output}"
+
+    if args.output == "png":
+        sink = PNGSink(args.path or "frames", args.rotate)
+        width, height = args.width, args.height
+    elif args.output == "rgb":
+        sink = RawRGBSink(args.path or "frame.rgb", args.width, args.height)
+        width, height = args.width, args.height
+    else:
+        sink = FramebufferSink(args.path or "/dev/fb0")
+        width, height = sink.width, sink.height
+
+    renderer = HeadlessRenderer(width, height, args.dpi)
+    rendered = renderer.canvas.get_width_height()
+    if rendered != (width, height):
+        raise ValueError(f"Rendered frames are {rendered[0]}x{rendered[1]}, not {width}x{height}; try another --dpi")
+
+    client = displayManager.createClient()
+    startMetrics(client, displayManager.BOX_ID, "display", displayManager.METRICS_PORT)
+    print(f"Rendering {displayManager.BOX_ID} at {width}x{height}, {args.fps:g} fps to {args.output} . . . ")
+    try:
+        run(renderer, sink, args.fps, budget)
+    except KeyboardInterrupt:
+        client.disconnect()
+    except Exception as error:
+        print(f"Something went wrong :: {error}")
+        client.disconnect()
+    print(f"Frames :: {displayManager.frameStats.report()}")
+    if displayManager.tracer is not None:
+        displayManager.tracer.close()
+    sink.close()
@@ -1,9 +1,20 @@
 import os
+import time
+import numpy as np
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from matplotlib.widgets import TextBox, Button
+from speedFrames import decodeSpeedFrame
+from ringBuffer import RingBuffer
+from loopScheduler import RollingHistogram
+from wireCodec import decodeBinary, decodeFlow, decodeSpeed, TYPE_DP_TEMP
+from topicDispatcher import TopicDispatcher, boxSubscriptions
+from tracing import TRACE_ENABLED, TRACE_LEVEL, TraceRecorder
+from metrics import METRICS_TYPE, registry, instrumentClient, startMetrics
+from telemetryQuery import TelemetryStore
+import profiling
 
 load_dotenv()
 
@@ -16,63 +27,189 @@ MQTT_TOPIC_SENSOR_INFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_INFLOW_OUT")
 MQTT_TOPIC_SENSOR_DP_OUT = os.getenv("MQTT_TOPIC_SENSOR_DP_OUT")
 MQTT_TOPIC_SENSOR_TEMP_OUT = os.getenv("MQTT_TOPIC_SENSOR_TEMP_OUT")
 
-TEMP_TOPIC = f"{BOX_ID}/+{MQTT_TOPIC_SENSOR_TEMP_OUT}" # Topic for the speed graph
-PRESSURE_TOPIC = f"{BOX_ID}/+{MQTT_TOPIC_SENSOR_DP_OUT}"
-OUTFLOW_TOPIC = f"{BOX_ID}/+{MQTT_TOPIC_SENSOR_OUTFLOW_OUT}"
-INFLOW_TOPIC = f"{BOX_ID}/+{MQTT_TOPIC_SENSOR_INFLOW_OUT}" # Topic for flow numbers
+# The data type level of each sensor's topics; fe. 'inflowRate' of '/inflowRate/out'
+TEMP_TYPE = MQTT_TOPIC_SENSOR_TEMP_OUT.strip("/").split("/")[0]
+PRESSURE_TYPE = MQTT_TOPIC_SENSOR_DP_OUT.strip("/").split("/")[0]
+OUTFLOW_TYPE = MQTT_TOPIC_SENSOR_OUTFLOW_OUT.strip("/").split("/")[0]
+INFLOW_TYPE = MQTT_TOPIC_SENSOR_INFLOW_OUT.strip("/").split("/")[0]
+# The motor's speed: 'out' has one sample per message, 'frame' batches of them and 'bin' is the binary wire format
+SPEED_TYPE = "speed"
 
 plt.rcParams["toolbar"] = "None"
 
-max_size = 40
+RENDER_MODE = os.getenv("DISPLAY_RENDER_MODE", "redraw") # 'redraw' rebuilds the graphs every frame, 'blit' only updates the lines and texts
+FRAME_INTERVAL = 50 # milliseconds
+STATS_INTERVAL = float(os.getenv("DISPLAY_STATS_INTERVAL", "10.0")) # seconds between frame time reports, 0 disables them
+TRACE_FILE = os.getenv("DISPLAY_TRACE_FILE", "trace.csv") # where the latency traces go with MQTT_TRACE, see tracing.py
+METRICS_PORT = int(os.getenv("DISPLAY_METRICS_PORT", "9102")) # port of the metrics endpoint, see metrics.py; 0 disables it
+
+# Number of samples shown on the graphs
+max_size = int(os.getenv("DISPLAY_HISTORY_SIZE", "40"))
+# Seconds of recorded history the graphs start with, in max_size points, read from the rollups of telemetryQuery.py; 0 starts them empty
+HISTORY_SECONDS = float(os.getenv("DISPLAY_HISTORY_SECONDS", "0"))
+xValues = np.arange(max_size)
 
 # Pressure's values
-pressureList = []
+pressureList = RingBuffer(max_size)
 
 # Flow sensor values
-flowInList = []
-flowOutList = []
+flowInList = RingBuffer(max_size)
+flowOutList = RingBuffer(max_size)
+
+# Motor speed
+speedList = RingBuffer(max_size)
 
 # Temperature
 temperatureValue = None
 
+# Incremented whenever new data arrives, so the blitting renderer can skip frames without any
+dataVersion = 0
+renderedVersion = -1
+
+"""
+Frame time and CPU use of the animation, reported every STATS_INTERVAL seconds.
+The frame time is the animation function's; the CPU use covers everything, drawing and MQTT included.
+"""
+class FrameStats:
+    def __init__(self):
+        self.frameTime = RollingHistogram()
+        self.frameMetric = registry.histogram("display_frame_seconds", "Time the animation function takes per frame.")
+        self.skippedMetric = registry.counter("display_skipped_frames_total", "Frames skipped as nothing new had arrived.")
+        self.section = profiling.section("render")
+        self.frames = 0
+        self.skipped = 0
+        self.wallStart = time.monotonic()
+        self.cpuStart = time.process_time()
+
+    def record(self, start: float, skipped: bool = False):
+        elapsed = time.perf_counter() - start
+        self.frameTime.add(elapsed)
+        self.frameMetric.observe(elapsed)
+        self.section.add(elapsed)
+        self.frames += 1
+        if skipped:
+            self.skipped += 1
+            self.skippedMetric.inc()
+        if STATS_INTERVAL > 0 and time.monotonic() - self.wallStart >= STATS_INTERVAL:
+            print(f"Frames :: {self.report()}")
 
-def tempMessage(client, userdata, message):
+    """
+    Returns the summary since the last report.
+    """
+    def report(self) -> str:
+        wall = time.monotonic() - self.wallStart
+        cpu = time.process_time() - self.cpuStart
+        summary = f"{RENDER_MODE}: frames={self.frames} skipped={self.skipped} frame time {self.frameTime.summary()} CPU {100.0 * cpu / wall if wall > 0 else 0.0:.1f}%"
+        self.wallStart = time.monotonic()
+        self.cpuStart = time.process_time()
+        self.frames = 0
+        self.skipped = 0
+        return summary
+
+frameStats = FrameStats()
+tracer = TraceRecorder(TRACE_FILE) if TRACE_ENABLED else None
+
+
+"""
+Message handlers, called by the dispatcher with the fields of the message's topic; see topicDispatcher.py.
+"""
+def tempMessage(fields, payload):
     global temperatureValue
-    temperatureValue = float(message.payload)
-
-def flowMessage(client, userdata, message):
-    fields = message.topic.split("/")[0:]
-    if fields[2] == "inflowRate":
-        appendToList(flowInList, message.payload)
-    elif fields[2] == "outflowRate":
-        appendToList(flowOutList, message.payload)
+    global dataVersion
+    temperatureValue = float(payload)
+    dataVersion += 1
+
+def flowMessage(fields, payload):
+    value = decodeFlow(payload) if fields.binary else float(payload)
+    if fields.dataType == INFLOW_TYPE:
+        appendToList(flowInList, value)
+    else:
+        appendToList(flowOutList, value)
+
+"""
+Binary pressure messages carry the temperature as well.
+"""
+def pressureMessage(fields, payload):
+    global temperatureValue
+    if fields.binary:
+        pressure, temperature = decodeBinary(payload, TYPE_DP_TEMP)
+        temperatureValue = round(temperature, 2)
     else:
-        print(f"Something went wrong.")
-#    appendToList(flowInList, message.payload)
-#    appendToList(flowOutList, message.payload)
+        pressure = payload
+    appendToList(pressureList, pressure)
+
+def speedMessage(fields, payload):
+    appendToList(speedList, decodeSpeed(payload) if fields.binary else payload)
 
-def pressureMessage(client, userdata, message):
-    appendToList(pressureList, message.payload)
+"""
+Unpacks a batched speed frame into the speed history.
+"""
+def speedFrameMessage(fields, payload):
+    try:
+        start, period, samples = decodeSpeedFrame(payload)
+    except ValueError as e:
+        print(f"Invalid speed frame: {e}")
+        return
+    global dataVersion
+    speedList.extend(samples)
+    dataVersion += 1
 
 """
-Adds a value to a list, discards values if over limit. 
+Adds a value to a graph's history; the oldest value is discarded once the history is full. 
 Used by line graphs. 
 """
-def appendToList(listToAdd: list, data):
-    value = float(data)
-    listToAdd.append(value)
-    if len(listToAdd) > max_size:
-        listToAdd.pop(0)
+def appendToList(listToAdd: RingBuffer, data):
+    global dataVersion
+    listToAdd.append(float(data))
+    dataVersion += 1
+
+"""
+Fills the graphs with the last HISTORY_SECONDS of the box from the recorded telemetry, zoomed out to max_size points.
+Only the rollups are read, so an hour of history costs the same as a minute. The live samples carry on from there.
+"""
+def loadHistory(box: str):
+    global temperatureValue
+    global dataVersion
+    if HISTORY_SECONDS <= 0:
+        return
+    store = TelemetryStore()
+    try:
+        for dataType, history in ((INFLOW_TYPE, flowInList), (OUTFLOW_TYPE, flowOutList), (PRESSURE_TYPE, pressureList), (SPEED_TYPE, speedList), (TEMP_TYPE, None)):
+            found = store.find(box, dataType)
+            if not found:
+                continue
+            means = store.history(found[0], HISTORY_SECONDS, max_size)["mean"]
+            if history is not None:
+                history.extend(means[-max_size:])
+            elif len(means):
+                temperatureValue = float(means[-1])
+    except (OSError, ValueError) as e:
+        print(f"Something went wrong :: loading the history of {box} :: {e}")
+    finally:
+        store.close()
+    dataVersion += 1
+
+"""
+Creates the figure and the axes of the graphs.
+"""
+def createFigure():
+    global fig, ax1, ax2, ax3
+    fig = plt.figure()
+    ax1 = fig.add_subplot(2, 1, 1)
+    ax2 = fig.add_subplot(2, 2, 3)
+    ax3 = fig.add_subplot(3, 2, 6, frameon=False)
+    return fig
 
 """
 Creates a matplotlib animation of line graphs and values. Animation function passes one argument. 
 """
 def animateGraphs(i):
+    start = time.perf_counter()
     # Flow i/o graphs
     # Clear and build the graphs
     ax1.clear()
-    ax1.plot(range(len(flowInList)), flowInList, marker="", label="Flow in", color="blue")
-    ax1.plot(range(len(flowOutList)), flowOutList, marker="", label="Flow out", color="red")
+    ax1.plot(xValues[:len(flowInList)], flowInList.view(), marker="", label="Flow in", color="blue")
+    ax1.plot(xValues[:len(flowOutList)], flowOutList.view(), marker="", label="Flow out", color="red")
     
     # Graph configurations
     ax1.set_ylim(-160, 160)
@@ -86,7 +223,7 @@ def animateGraphs(i):
     # Pressure graph
     # Clear and build the graph
     ax2.clear()
-    ax2.plot(range(len(pressureList)), pressureList, marker="")
+    ax2.plot(xValues[:len(pressureList)], pressureList.view(), marker="")
 
     # Graph configurations
     ax2.set_ylim(-100, 100) # Min and max values shown on the graph
@@ -99,23 +236,88 @@ def animateGraphs(i):
     # Temperature number
     ax3.clear()
     ax3.text(0, 1, f"Temp: {temperatureValue}°C", fontsize=24)
+    if len(speedList):
+        ax3.text(0, 0.5, f"Speed: {speedList.last():.0f}", fontsize=24)
+    ax3.set_xticks([])
+    ax3.set_yticks([])
+    frameStats.record(start)
+    if tracer is not None:
+        tracer.rendered()
+
+"""
+Blitting renderer: the axes, labels and legend are drawn once, and the lines and texts are created once.
+Each frame only updates their data, and matplotlib redraws just those artists on top of the saved background.
+"""
+def createArtists():
+    global flowInLine, flowOutLine, pressureLine, temperatureText, speedText
+    (flowInLine,) = ax1.plot([], [], marker="", label="Flow in", color="blue")
+    (flowOutLine,) = ax1.plot([], [], marker="", label="Flow out", color="red")
+    ax1.set_ylim(-160, 160)
+    ax1.set_xlim(0, max_size + (max_size / 4))
+    ax1.set_xlabel("Time")
+    ax1.set_ylabel("Value")
+    ax1.set_xticks([])
+    ax1.set_title("Flow", loc="left")
+    ax1.legend()
+
+    (pressureLine,) = ax2.plot([], [], marker="")
+    ax2.set_ylim(-100, 100) # Min and max values shown on the graph
+    ax2.set_xlim(0, max_size + (max_size / 4))
+    ax2.set_xlabel("Time")
+    ax2.set_ylabel("Value")
+    ax2.set_xticks([])
+    ax2.set_title("Pressure", loc="left")
+
+    temperatureText = ax3.text(0, 1, "", fontsize=24)
+    speedText = ax3.text(0, 0.5, "", fontsize=24)
     ax3.set_xticks([])
     ax3.set_yticks([])
 
+"""
+Called by the animation at the start and after the window is resized; every artist has to be drawn then.
+"""
+def initGraphs():
+    global renderedVersion
+    renderedVersion = -1
+    return updateGraphs(None)
+
+"""
+Animation function of the blitting renderer. Returns the artists that changed, none if no new data has arrived.
+"""
+def updateGraphs(i):
+    global renderedVersion
+    start = time.perf_counter()
+    version = dataVersion
+    if version == renderedVersion:
+        frameStats.record(start, skipped=True)
+        return []
+    renderedVersion = version
+
+    flowInLine.set_data(xValues[:len(flowInList)], flowInList.view())
+    flowOutLine.set_data(xValues[:len(flowOutList)], flowOutList.view())
+    pressureLine.set_data(xValues[:len(pressureList)], pressureList.view())
+    temperatureText.set_text(f"Temp: {temperatureValue}°C")
+    speedText.set_text(f"Speed: {speedList.last():.0f}" if len(speedList) else "")
+    frameStats.record(start)
+    if tracer is not None:
+        tracer.rendered()
+    return [flowInLine, flowOutLine, pressureLine, temperatureText, speedText]
+
 def changeBox(val):
     global BOX_ID
-    global pressureList
-    global flowInList
-    global flowOutList
     global temperatureValue
-    pressureList = []
-    flowInList = []
-    flowOutList = []
+    global dataVersion
+    pressureList.clear()
+    flowInList.clear()
+    flowOutList.clear()
+    speedList.clear()
     temperatureValue = 0
+    dataVersion += 1
 
-    client.unsubscribe(f"{BOX_ID}/+/+/+/")
+    client.unsubscribe([topic for topic, _ in boxSubscriptions(BOX_ID)])
     BOX_ID = val
-    client.subscribe([(f"{BOX_ID}/+/+/+/", 1)])
+    loadHistory(BOX_ID)
+    client.subscribe(boxSubscriptions(BOX_ID))
     client.loop_start()
 
 
@@ -123,36 +325,91 @@ def changeBox(val):
 When figure is closed, gracefully disconnects MQTT
 """
 def onClose(event):
+    print(f"Frames :: {frameStats.report()}")
+    if tracer is not None:
+        print(f"Traced {tracer.rows} samples to {TRACE_FILE}")
+        tracer.close()
     plt.close()
     client.disconnect()
 
-if __name__ == "__main__":
-    global running
-    client = mqtt.Client()
+"""
+Routes the box's messages to the handlers. Any box's: only the current box is subscribed to.
+"""
+def createDispatcher() -> TopicDispatcher:
+    route = traced if tracer is not None else lambda handler: handler
+    dispatcher = TopicDispatcher()
+    # Trace messages share the data type level with their samples, so they go first
+    dispatcher.add(traceMessage if tracer is not None else ignoreMessage, direction=TRACE_LEVEL)
+    dispatcher.add(ignoreMessage, dataType=METRICS_TYPE)
+    dispatcher.add(route(tempMessage), dataType=TEMP_TYPE)
+    dispatcher.add(route(flowMessage), dataType=INFLOW_TYPE)
+    dispatcher.add(route(flowMessage), dataType=OUTFLOW_TYPE)
+    dispatcher.add(route(pressureMessage), dataType=PRESSURE_TYPE)
+    dispatcher.add(speedFrameMessage, sensor="motor", dataType=SPEED_TYPE, direction="frame")
+    dispatcher.add(route(speedMessage), sensor="motor", dataType=SPEED_TYPE)
+    return dispatcher
+
+def ignoreMessage(fields, payload):
+    pass
+
+"""
+Latency tracing, see tracing.py. A series is a topic without its last level, the same for a sample and its trace.
+"""
+def traceSeries(fields) -> str:
+    return f"{fields.box}/{fields.sensor}/{fields.dataType}"
+
+def traceMessage(fields, payload):
+    tracer.trace(traceSeries(fields), payload)
+
+"""
+Wraps a message handler to note the receipt of each sample for the trace.
+"""
+def traced(handler):
+    def tracedHandler(fields, payload):
+        tracer.sample(traceSeries(fields))
+        handler(fields, payload)
+    return tracedHandler
+
+dispatcher = createDispatcher()
+registry.counter("display_messages_received_total", "MQTT messages received.", function=lambda: dispatcher.resolve.cache_info().hits + dispatcher.resolve.cache_info().misses)
+registry.counter("display_messages_unhandled_total", "MQTT messages on topics the display has no use for.", function=lambda: dispatcher.unhandled)
+
+"""
+Connects to the MQTT broker, subscribes to the box's topics and binds them to the functions that store the data.
+"""
+def createClient():
+    global client
+    client = instrumentClient(mqtt.Client())
 
     client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 0)
 
     # Subscribe to the box's topic and bind different topics to functions
-    client.subscribe([(f"{BOX_ID}/+/+/+/", 1)])
-    client.message_callback_add(TEMP_TOPIC, tempMessage)
-    client.message_callback_add(INFLOW_TOPIC, flowMessage)
-    client.message_callback_add(OUTFLOW_TOPIC, flowMessage)
-    client.message_callback_add(PRESSURE_TOPIC, pressureMessage)
+    client.subscribe(boxSubscriptions(BOX_ID))
+    client.on_message = dispatcher.onMessage
 
     client.loop_start()
+    return client
+
+if __name__ == "__main__":
+    global running
+    profiling.start("displayManager")
+    loadHistory(BOX_ID)
+    client = createClient()
+    startMetrics(client, BOX_ID, "display", METRICS_PORT)
 
     # Matplotlib initialization
-    fig = plt.figure()
-    ax1 = fig.add_subplot(2, 1, 1)
-    ax2 = fig.add_subplot(2, 2, 3)
-    ax3 = fig.add_subplot(3, 2, 6, frameon=False)
+    fig = createFigure()
 
     graphBox = fig.add_axes([0.1, 0.025, 0.8, 0.05])
     textbox = TextBox(graphBox, "Box ID:", initial=BOX_ID)
     textbox.on_submit(changeBox)
 
     fig.canvas.mpl_connect('close_event', onClose)
-    ani = FuncAnimation(fig, animateGraphs, interval=50, frames=20)
+    if RENDER_MODE == "blit":
+        createArtists()
+        ani = FuncAnimation(fig, updateGraphs, init_func=initGraphs, interval=FRAME_INTERVAL, blit=True, cache_frame_data=False)
+    else:
+        ani = FuncAnimation(fig, animateGraphs, interval=FRAME_INTERVAL, frames=20)
     fig.suptitle(BOX_ID, fontsize=24)
     try:
         plt.show()
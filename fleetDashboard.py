@@ -0,0 +1,395 @@
+import os
+import math
+import argparse
+from functools import partial
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from dotenv import load_dotenv
+import paho.mqtt.client as mqtt
+import matplotlib.pyplot as plt
+from ringBuffer import RingBuffer
+from speedFrames import decodeSpeedFrame
+from wireCodec import decodeBinary, decodeFlow, decodeSpeed, TYPE_DP_TEMP
+from topicDispatcher import TopicDispatcher, boxSubscriptions
+from tracing import TRACE_LEVEL
+
+load_dotenv()
+
+'''
+Fleet view: the flow, pressure and speed of many boxes at once.
+
+Every box has its own history, kept for as long as the dashboard runs, so the focused box can be switched
+instantly without resubscribing or losing anything. The window shows the focused box large on top and every
+box as a small graph below; click a small graph, or use the arrow keys, to focus it.
+
+With '--workers N' the MQTT subscriptions are split across N processes, each writing the histories of its boxes into
+one shared memory block the window reads from. Decoding and the network then don't compete with drawing for one interpreter.
+'''
+
+# Parameters for the MQTT broker
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT"))
+MQTT_TOPIC_SENSOR_OUTFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_OUTFLOW_OUT")
+MQTT_TOPIC_SENSOR_INFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_INFLOW_OUT")
+MQTT_TOPIC_SENSOR_DP_OUT = os.getenv("MQTT_TOPIC_SENSOR_DP_OUT")
+MQTT_TOPIC_SENSOR_TEMP_OUT = os.getenv("MQTT_TOPIC_SENSOR_TEMP_OUT")
+
+# The data type level of each sensor's topics; fe. 'inflowRate' of '/inflowRate/out'
+INFLOW_TYPE = MQTT_TOPIC_SENSOR_INFLOW_OUT.strip("/").split("/")[0]
+OUTFLOW_TYPE = MQTT_TOPIC_SENSOR_OUTFLOW_OUT.strip("/").split("/")[0]
+DP_TYPE = MQTT_TOPIC_SENSOR_DP_OUT.strip("/").split("/")[0]
+TEMP_TYPE = MQTT_TOPIC_SENSOR_TEMP_OUT.strip("/").split("/")[0]
+
+FLEET_BOXES = os.getenv("FLEET_BOXES", os.getenv("BOX_ID", "box01")) # Comma separated
+max_size = int(os.getenv("DISPLAY_HISTORY_SIZE", "40"))
+xValues = np.arange(max_size)
+FRAME_INTERVAL = 100 # milliseconds
+
+SERIES = ("flowIn", "flowOut", "pressure", "speed")
+
+parser = argparse.ArgumentParser(description="Shows the graphs of many boxes at once.")
+parser.add_argument("-b", "--boxes", nargs="+", default=FLEET_BOXES.split(","), help="The IDs of the boxes; fe. 'box01 box02 box03'. Defaults to FLEET_BOXES.")
+parser.add_argument("-w", "--workers", type=int, default=0, help="Number of processes to spread the subscriptions across; 0 subscribes in the window's process.")
+
+"""
+A RingBuffer whose values and position live in arrays it doesn't own, fe. in a shared memory block,
+so that one process can append while another reads.
+"""
+class SharedRingBuffer(RingBuffer):
+    def __init__(self, data: np.ndarray, position: np.ndarray):
+        self.capacity = len(data) // 2
+        self.data = data
+        self.position = position    # [index, count]
+
+    @property
+    def index(self) -> int:
+        return int(self.position[0])
+
+    @index.setter
+    def index(self, value: int):
+        self.position[0] = value
+
+    @property
+    def count(self) -> int:
+        return int(self.position[1])
+
+    @count.setter
+    def count(self, value: int):
+        self.position[1] = value
+
+"""
+The history of one box. 'version' is incremented after every change, so the window only redraws boxes that changed.
+"""
+class BoxHistory:
+    def __init__(self, boxID: str, series: dict, state: np.ndarray, temperature: np.ndarray):
+        self.boxID = boxID
+        self.flowIn = series["flowIn"]
+        self.flowOut = series["flowOut"]
+        self.pressure = series["pressure"]
+        self.speed = series["speed"]
+        self.state = state                  # [version]
+        self.temperatureValue = temperature # [temperature], NaN until one arrives
+
+    @property
+    def version(self) -> int:
+        return int(self.state[0])
+
+    @property
+    def temperature(self):
+        value = self.temperatureValue[0]
+        return None if math.isnan(value) else round(float(value), 2)
+
+    def setTemperature(self, value: float):
+        self.temperatureValue[0] = value
+
+    def changed(self):
+        self.state[0] += 1
+
+"""
+The histories of the whole fleet in one block of memory: the ring buffers' values and positions, the versions and the temperatures.
+With 'shared' the block is shared memory that processes started with fork can write to.
+"""
+class FleetStorage:
+    def __init__(self, boxIDs: list, capacity: int, shared: bool = False):
+        if len(set(boxIDs)) != len(boxIDs):
+            raise ValueError(f"Duplicate box IDs: {boxIDs}")
+        self.boxIDs = list(boxIDs)
+        boxCount = len(boxIDs)
+        layout = [
+            ("data", np.float64, (boxCount, len(SERIES), 2 * capacity)),
+            ("positions", np.int64, (boxCount, len(SERIES), 2)),
+            ("states", np.int64, (boxCount, 1)),
+            ("temperatures", np.float64, (boxCount, 1)),
+        ]
+        size = sum(np.dtype(dtype).itemsize * math.prod(shape) for _, dtype, shape in layout)
+        self.memory = shared_memory.SharedMemory(create=True, size=size) if shared else None
+        buffer = self.memory.buf if shared else bytearray(size)
+
+        offset = 0
+        arrays = {}
+        for name, dtype, shape in layout:
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            offset += arrays[name].nbytes
+        arrays["data"][...] = 0.0
+        arrays["positions"][...] = 0
+        arrays["states"][...] = 0
+        arrays["temperatures"][...] = np.nan
+
+        self.boxes = {}
+        for i, boxID in enumerate(self.boxIDs):
+            series = {name: SharedRingBuffer(arrays["data"][i, j], arrays["positions"][i, j]) for j, name in enumerate(SERIES)}
+            self.boxes[boxID] = BoxHistory(boxID, series, arrays["states"][i], arrays["temperatures"][i])
+        self.arrays = arrays
+
+    """
+    Releases the shared memory block. The BoxHistories can't be used after this.
+    """
+    def close(self):
+        if self.memory is not None:
+            # The arrays have to go before the block can be closed
+            self.boxes = {}
+            self.arrays = {}
+            self.memory.close()
+            self.memory.unlink()
+
+"""
+Stores a message in the history of its box, given the fields of its topic; see topicDispatcher.py.
+fe. 'box01/inflow01/inflowRate/out/' or 'box01/motor/speed/frame/'. Messages of other boxes are ignored.
+"""
+def storeMessage(boxes: dict, fields, payload: bytes):
+    box = boxes.get(fields.box)
+    if box is None or fields.direction == TRACE_LEVEL:
+        return
+    dataType = fields.dataType
+    try:
+        if fields.sensor == "motor":
+            if dataType != "speed":
+                return
+            if fields.direction == "frame":
+                start, period, samples = decodeSpeedFrame(payload)
+                box.speed.extend(samples)
+            else:
+                box.speed.append(decodeSpeed(payload) if fields.binary else float(payload))
+        elif dataType == INFLOW_TYPE:
+            box.flowIn.append(decodeFlow(payload) if fields.binary else float(payload))
+        elif dataType == OUTFLOW_TYPE:
+            box.flowOut.append(decodeFlow(payload) if fields.binary else float(payload))
+        elif dataType == DP_TYPE:
+            if fields.binary:
+                # Binary pressure messages carry the temperature as well
+                pressure, temperature = decodeBinary(payload, TYPE_DP_TEMP)
+                box.setTemperature(temperature)
+            else:
+                pressure = float(payload)
+            box.pressure.append(pressure)
+        elif dataType == TEMP_TYPE:
+            box.setTemperature(float(payload))
+        else:
+            return
+    except ValueError as e:
+        print(f"Invalid message on {'/'.join(fields[:4])} :: {e}")
+        return
+    box.changed()
+
+"""
+Connects to the broker and subscribes to every topic of the given boxes, storing what arrives.
+"""
+def createClient(boxes: dict, boxIDs: list):
+    dispatcher = TopicDispatcher()
+    dispatcher.add(partial(storeMessage, boxes))
+    client = mqtt.Client()
+    client.on_message = dispatcher.onMessage
+    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+    client.subscribe([subscription for boxID in boxIDs for subscription in boxSubscriptions(boxID)])
+    return client
+
+"""
+Splits the boxes into 'workers' groups of about the same size.
+"""
+def shardBoxes(boxIDs: list, workers: int) -> list:
+    return [shard for shard in (boxIDs[i::workers] for i in range(workers)) if shard]
+
+"""
+A worker process: subscribes to its share of the boxes and writes into the shared histories.
+"""
+def runWorker(storage: FleetStorage, boxIDs: list):
+    client = createClient(storage.boxes, boxIDs)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        client.disconnect()
+
+"""
+The window: the focused box on top, every box as a small graph below.
+Lines and texts are blitted over saved backgrounds, and only for the boxes whose version changed since the last frame.
+"""
+class FleetView:
+    def __init__(self, boxes: dict, focus: str = None):
+        self.boxes = boxes
+        self.boxIDs = list(boxes)
+        self.focus = focus or self.boxIDs[0]
+        self.rendered = {}
+
+        columns = math.ceil(math.sqrt(len(self.boxIDs)))
+        rows = math.ceil(len(self.boxIDs) / columns)
+        self.fig = plt.figure(figsize=(4 + 2 * columns, 6 + 1.5 * rows))
+        grid = self.fig.add_gridspec(2, 1, height_ratios=[3, 1.5 * rows], hspace=0.3)
+        top = grid[0].subgridspec(1, 2, width_ratios=[2, 1])
+        bottom = grid[1].subgridspec(rows, columns, hspace=0.6)
+
+        self.focusFlow = self.fig.add_subplot(top[0])
+        self.focusPressure = self.fig.add_subplot(top[1])
+        self.focusFlow.set_ylim(-160, 160)
+        self.focusFlow.set_title("Flow", loc="left")
+        self.focusPressure.set_ylim(-100, 100)
+        self.focusPressure.set_title("Pressure", loc="left")
+        (self.focusFlowIn,) = self.focusFlow.plot([], [], label="Flow in", color="blue", animated=True)
+        (self.focusFlowOut,) = self.focusFlow.plot([], [], label="Flow out", color="red", animated=True)
+        (self.focusPressureLine,) = self.focusPressure.plot([], [], color="green", animated=True)
+        self.focusFlow.legend(loc="upper right")
+        self.focusText = self.focusFlow.text(0.01, 0.97, "", transform=self.focusFlow.transAxes, va="top", fontsize=14, animated=True)
+
+        # Every small graph: its axes and its lines and text
+        self.small = {}
+        for i, boxID in enumerate(self.boxIDs):
+            ax = self.fig.add_subplot(bottom[i // columns, i % columns])
+            ax.set_ylim(-160, 160)
+            ax.set_title(boxID, fontsize=9, loc="left")
+            artists = [
+                ax.plot([], [], color="blue", linewidth=0.8, animated=True)[0],
+                ax.plot([], [], color="red", linewidth=0.8, animated=True)[0],
+                ax.plot([], [], color="green", linewidth=0.8, animated=True)[0],
+                ax.text(0.98, 0.95, "", transform=ax.transAxes, ha="right", va="top", fontsize=8, animated=True),
+            ]
+            self.small[boxID] = (ax, artists)
+
+        for ax in self.axes():
+            ax.set_xlim(0, max_size)
+            ax.set_xticks([])
+        for ax, _ in self.small.values():
+            ax.set_yticks([])
+        self.highlight()
+
+        self.backgrounds = {}
+        self.fig.canvas.mpl_connect("draw_event", self.onDraw)
+        self.fig.canvas.mpl_connect("button_press_event", self.onClick)
+        self.fig.canvas.mpl_connect("key_press_event", self.onKey)
+
+    """
+    Marks the focused box's small graph.
+    """
+    def highlight(self):
+        for boxID, (ax, _) in self.small.items():
+            color = "orange" if boxID == self.focus else "black"
+            for spine in ax.spines.values():
+                spine.set_color(color)
+                spine.set_linewidth(2 if boxID == self.focus else 0.8)
+        self.fig.suptitle(f"Fleet :: {self.focus}", fontsize=18)
+
+    """
+    Switches the focused box. Only the views change; every box's history is kept.
+    """
+    def setFocus(self, boxID: str):
+        if boxID == self.focus or boxID not in self.boxes:
+            return
+        self.focus = boxID
+        self.highlight()
+        self.fig.canvas.draw_idle()
+
+    def onClick(self, event):
+        for boxID, (ax, _) in self.small.items():
+            if event.inaxes is ax:
+                self.setFocus(boxID)
+                return
+
+    def onKey(self, event):
+        step = {"right": 1, "down": 1, "left": -1, "up": -1}.get(event.key)
+        if step is not None:
+            index = self.boxIDs.index(self.focus)
+            self.setFocus(self.boxIDs[(index + step) % len(self.boxIDs)])
+
+    """
+    After every full draw, fe. after a resize or a focus switch: saves the backgrounds and draws every line and text on them.
+    """
+    def onDraw(self, event):
+        canvas = self.fig.canvas
+        self.backgrounds = {ax: canvas.copy_from_bbox(ax.bbox) for ax in self.axes()}
+        self.rendered = {}
+        self.refresh(blit=False)
+
+    def axes(self) -> list:
+        return [self.focusFlow, self.focusPressure] + [ax for ax, _ in self.small.values()]
+
+    """
+    Draws the boxes that changed since the last frame. Called by the timer.
+    """
+    def refresh(self, blit: bool = True):
+        if not self.backgrounds:
+            return
+        changed = [boxID for boxID in self.boxIDs if self.rendered.get(boxID) != self.boxes[boxID].version]
+        dirty = []
+        for boxID in changed:
+            box = self.boxes[boxID]
+            self.rendered[boxID] = box.version
+            ax, (flowIn, flowOut, pressure, text) = self.small[boxID]
+            flowIn.set_data(xValues[:len(box.flowIn)], box.flowIn.view())
+            flowOut.set_data(xValues[:len(box.flowOut)], box.flowOut.view())
+            pressure.set_data(xValues[:len(box.pressure)], box.pressure.view())
+            text.set_text(f"{box.speed.last():.0f}" if len(box.speed) else "")
+            dirty.append((ax, [flowIn, flowOut, pressure, text]))
+
+            if boxID == self.focus:
+                self.focusFlowIn.set_data(xValues[:len(box.flowIn)], box.flowIn.view())
+                self.focusFlowOut.set_data(xValues[:len(box.flowOut)], box.flowOut.view())
+                self.focusPressureLine.set_data(xValues[:len(box.pressure)], box.pressure.view())
+                temperature = box.temperature
+                speed = f"{box.speed.last():.0f}" if len(box.speed) else "-"
+                self.focusText.set_text(f"Temp: {temperature if temperature is not None else '-'}°C   Speed: {speed}")
+                dirty.append((self.focusFlow, [self.focusFlowIn, self.focusFlowOut, self.focusText]))
+                dirty.append((self.focusPressure, [self.focusPressureLine]))
+
+        canvas = self.fig.canvas
+        for ax, artists in dirty:
+            canvas.restore_region(self.backgrounds[ax])
+            for artist in artists:
+                ax.draw_artist(artist)
+            if blit:
+                canvas.blit(ax.bbox)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    storage = FleetStorage(args.boxes, max_size, shared=args.workers > 0)
+
+    workers = []
+    client = None
+    if args.workers > 0:
+        # Forked, so the workers inherit the shared memory block as it is
+        context = multiprocessing.get_context("fork")
+        for shard in shardBoxes(storage.boxIDs, args.workers):
+            worker = context.Process(target=runWorker, args=(storage, shard), daemon=True)
+            worker.start()
+            workers.append(worker)
+        print(f"Watching {len(storage.boxIDs)} boxes with {len(workers)} worker processes")
+    else:
+        client = createClient(storage.boxes, storage.boxIDs)
+        client.loop_start()
+        print(f"Watching {len(storage.boxIDs)} boxes")
+
+    view = FleetView(storage.boxes)
+    timer = view.fig.canvas.new_timer(interval=FRAME_INTERVAL)
+    timer.add_callback(view.refresh)
+    timer.start()
+    try:
+        plt.show()
+    except KeyboardInterrupt:
+        pass
+
+    if client is not None:
+        client.disconnect()
+    for worker in workers:
+        worker.terminate()
+        worker.join()
+    # Nothing may hold on to the histories when the shared memory block is closed
+    del view, client
+    storage.close()
@@ -0,0 +1,147 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+
+'''
+Deadline based scheduling for the motor control loops.
+
+Sleeping a fixed LOOP_INTERVAL after the work makes the real period interval + work time.
+LoopScheduler instead keeps a grid of deadlines on the monotonic clock, so the period stays fixed
+no matter how long the loop body takes. When the body overruns, the missed ticks are either
+run back to back ('catchup') or dropped ('skip').
+Another thread can end the wait early with wake(), fe. to apply a command right away; the grid stays where it was.
+'''
+
+POLICY_SKIP = "skip"
+POLICY_CATCHUP = "catchup"
+
+# Bucket upper edges in seconds, used for both lateness and loop body duration
+DEFAULT_BUCKETS = (50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2e-3, 5e-3, 10e-3, 20e-3, 50e-3, 100e-3, 250e-3, 1.0)
+
+# Bucket upper edges in seconds of the lag of messages through the broker, fe. of replay.py and random_mqtt.py; it can reach seconds
+LAG_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+"""
+Histogram over the last 'window' samples. Adding a sample is O(1): the oldest sample's bucket is decremented as it falls out.
+"""
+class RollingHistogram:
+	def __init__(self, buckets=DEFAULT_BUCKETS, window: int = 1000):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)	# the last bucket is for values above the largest edge
+		self.samples = deque(maxlen=window)
+		self.total = 0
+
+	def add(self, value: float):
+		if len(self.samples) == self.samples.maxlen:
+			self.counts[bisect_left(self.buckets, self.samples[0])] -= 1
+		self.samples.append(value)
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.total += 1
+
+	"""
+	Returns the p:th percentile (0-100) of the samples in the window, or 0.0 if there are none.
+	"""
+	def percentile(self, p: float) -> float:
+		if not self.samples:
+			return 0.0
+		ordered = sorted(self.samples)
+		index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+		return ordered[index]
+
+	def max(self) -> float:
+		return max(self.samples) if self.samples else 0.0
+
+	"""
+	Returns (upper edge, count) pairs of the current window. The last edge is infinity.
+	"""
+	def histogram(self) -> list:
+		return list(zip(self.buckets + (float("inf"),), self.counts))
+
+	def summary(self) -> str:
+		return f"p50={self.percentile(50) * 1e3:.2f}ms p99={self.percentile(99) * 1e3:.2f}ms max={self.max() * 1e3:.2f}ms"
+
+"""
+Keeps a fixed loop period on the monotonic clock. Call wait() at the end of every loop iteration;
+it sleeps until the next deadline and returns how many ticks were skipped to get there.
+Without a 'sleep' function the wait is on an event, so that wake() can cut it short.
+'onTick', if given, is called after every counted tick with the tick's period, its lateness and the previous tick's body duration,
+all in seconds; fe. to feed them to metrics.py.
+"""
+class LoopScheduler:
+	def __init__(self, interval: float, policy: str = POLICY_SKIP, window: int = 1000, clock=time.monotonic, sleep=None, onTick=None):
+		if interval <= 0:
+			raise ValueError(f"Non-positive loop interval: {interval}")
+		if policy not in (POLICY_SKIP, POLICY_CATCHUP):
+			raise ValueError(f"Unknown loop policy: {policy}")
+		self.interval = interval
+		self.policy = policy
+		self.clock = clock
+		self.sleep = sleep
+		self.onTick = onTick
+		self.deadline = None
+		self.tickStart = None
+		self.lastTick = None		# start of the last counted tick
+		self.wakeup = threading.Event()
+		self.ticks: int = 0
+		self.skipped: int = 0
+		self.woken: int = 0
+		self.lateness = RollingHistogram(window=window)
+		self.bodyDuration = RollingHistogram(window=window)
+
+	"""
+	Starts the deadline grid from the current time. Called automatically by the first wait().
+	"""
+	def start(self):
+		self.deadline = self.clock()
+		self.tickStart = self.deadline
+
+	"""
+	Ends the current or next wait() right away. Can be called from any thread.
+	"""
+	def wake(self):
+		self.wakeup.set()
+
+	"""
+	Returns 0 without counting a tick when woken before the deadline; the next wait() is for the same deadline.
+	"""
+	def wait(self) -> int:
+		now = self.clock()
+		body = 0.0
+		if self.deadline is None:
+			self.deadline = now
+		elif self.tickStart is not None:
+			body = now - self.tickStart
+			self.bodyDuration.add(body)
+
+		self.deadline += self.interval
+		missed = 0
+		if self.policy == POLICY_SKIP and now - self.deadline >= self.interval:
+			# Whole periods have passed, jump to the latest deadline instead of running them all
+			missed = int((now - self.deadline) // self.interval)
+			self.deadline += missed * self.interval
+			self.skipped += missed
+
+		delay = self.deadline - now
+		if delay > 0:
+			if self.sleep is not None:
+				self.sleep(delay)
+			elif self.wakeup.wait(delay):
+				self.wakeup.clear()
+				if self.clock() < self.deadline:
+					self.deadline -= self.interval
+					self.tickStart = self.clock()
+					self.woken += 1
+					return 0
+
+		self.tickStart = self.clock()
+		lateness = max(0.0, self.tickStart - self.deadline)
+		self.lateness.add(lateness)
+		self.ticks += 1
+		if self.onTick is not None and self.lastTick is not None:
+			self.onTick(self.tickStart - self.lastTick, lateness, body)
+		self.lastTick = self.tickStart
+		return missed
+
+	def summary(self) -> str:
+		return f"ticks={self.ticks} skipped={self.skipped} woken={self.woken} lateness {self.lateness.summary()} body {self.bodyDuration.summary()}"
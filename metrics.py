@@ -0,0 +1,307 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+from loopScheduler import DEFAULT_BUCKETS
+
+load_dotenv()
+
+'''
+Runtime metrics of the processes: counters, gauges and histograms, served over HTTP in the Prometheus text format
+and optionally published on MQTT as a periodic summary.
+
+Updating a metric is an attribute increment or a bisect into the histogram's buckets, and nothing is formatted or
+locked on the hot path; all the work happens when the metrics are scraped. Values that a module already keeps,
+fe. the loop scheduler's tick counts, are read by a function at scrape time instead of being counted twice.
+Updates aren't locked: each metric is meant to be updated from one thread, and the scrape may see a histogram
+mid-update, which is off by at most one sample.
+
+Every process has its own port, fe. MOTOR_METRICS_PORT, on METRICS_HOST; 0 disables the endpoint.
+'curl http://127.0.0.1:9101/metrics' shows the motor's metrics.
+'''
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_MQTT_INTERVAL = float(os.getenv("METRICS_MQTT_INTERVAL", "0"))    # seconds between MQTT summaries, 0 disables them
+METRICS_TYPE = "metrics"    # the data type level of the summary topics, fe. 'box01/motor/metrics/out/'
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()    # '+=' isn't atomic, and fe. MQTT publishes come from several threads
+
+    def inc(self, amount=1):
+        # acquire/release rather than 'with', about half the cost; adding numbers can't raise in between
+        self.lock.acquire()
+        self.value += amount
+        self.lock.release()
+
+    def get(self):
+        return self.value
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.lock.acquire()
+        self.value += amount
+        self.lock.release()
+
+    def dec(self, amount=1):
+        self.lock.acquire()
+        self.value -= amount
+        self.lock.release()
+
+    def get(self):
+        return self.value
+
+"""
+A counter or gauge whose value is read from 'function' when it's scraped.
+"""
+class FunctionMetric:
+    def __init__(self, kind: str, function):
+        self.kind = kind
+        self.function = function
+
+    def get(self):
+        return self.function()
+
+"""
+Cumulative histogram with fixed buckets, in seconds by default. Unlike RollingHistogram it never forgets samples,
+as Prometheus computes the rates and quantiles from the differences between scrapes.
+"""
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # the last bucket is for values above the largest edge
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    """
+    Returns (upper edge, cumulative count) pairs. The last edge is infinity.
+    """
+    def cumulative(self) -> list:
+        pairs = []
+        total = 0
+        for edge, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append((edge, total))
+        return pairs
+
+"""
+Returns the labels as '{name="value",...}', or an empty string if there are none.
+"""
+def formatLabels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+def formatValue(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+"""
+The metrics of a process. A metric is identified by its name and labels; asking for an existing one returns it,
+so modules can share metrics without passing them around.
+"""
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}    # name -> (kind, help, {labels: metric})
+        self.lock = threading.Lock()
+
+    def register(self, name: str, help: str, labels: dict, create):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = (None, help, {})
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = create()
+                if family[0] is None:
+                    self.families[name] = (metric.kind, help, family[2])
+                elif family[0] != metric.kind:
+                    del family[2][key]
+                    raise ValueError(f"Metric {name} is a {family[0]}, not a {metric.kind}")
+        return metric
+
+    """
+    Returns the counter; with 'function', one that reads its value from it at scrape time.
+    """
+    def counter(self, name: str, help: str, labels: dict = None, function=None):
+        return self.register(name, help, labels, lambda: FunctionMetric("counter", function) if function else Counter())
+
+    def gauge(self, name: str, help: str, labels: dict = None, function=None):
+        return self.register(name, help, labels, lambda: FunctionMetric("gauge", function) if function else Gauge())
+
+    def histogram(self, name: str, help: str, labels: dict = None, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(name, help, labels, lambda: Histogram(buckets))
+
+    """
+    Returns (name, kind, help, [(labels, metric)]) of every metric, sorted by name.
+    """
+    def collect(self) -> list:
+        with self.lock:
+            return [(name, kind, help, [(dict(key), metric) for key, metric in metrics.items()]) for name, (kind, help, metrics) in sorted(self.families.items())]
+
+    """
+    Returns the metrics in the Prometheus text exposition format. A metric whose function fails is left out.
+    """
+    def exposition(self) -> str:
+        lines = []
+        for name, kind, help, metrics in self.collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == "histogram":
+                    for edge, count in metric.cumulative():
+                        lines.append(f"{name}_bucket{formatLabels({**labels, 'le': formatValue(float(edge))})} {count}")
+                    lines.append(f"{name}_sum{formatLabels(labels)} {formatValue(float(metric.sum))}")
+                    lines.append(f"{name}_count{formatLabels(labels)} {metric.count}")
+                else:
+                    try:
+                        value = metric.get()
+                    except Exception as error:
+                        print(f"Something went wrong :: metric {name} :: {error}")
+                        continue
+                    lines.append(f"{name}{formatLabels(labels)} {formatValue(value)}")
+        return "\n".join(lines) + "\n"
+
+    """
+    Returns a one-line summary for MQTT: 'name{labels}=value' separated by ';', histograms as their count and mean.
+    """
+    def summary(self) -> str:
+        fields = []
+        for name, kind, help, metrics in self.collect():
+            for labels, metric in metrics:
+                if kind == "histogram":
+                    mean = metric.sum / metric.count if metric.count else 0.0
+                    fields.append(f"{name}_count{formatLabels(labels)}={metric.count}")
+                    fields.append(f"{name}_mean{formatLabels(labels)}={mean:.6g}")
+                else:
+                    try:
+                        value = metric.get()
+                    except Exception:
+                        continue
+                    fields.append(f"{name}{formatLabels(labels)}={value:.6g}" if isinstance(value, float) else f"{name}{formatLabels(labels)}={value}")
+        return ";".join(fields)
+
+    """
+    Serves the metrics at 'http://host:port/metrics' from a daemon thread. Returns the server, or None if the port is 0
+    or can't be bound; a busy port isn't worth stopping the process for.
+    """
+    def serve(self, port: int, host: str = METRICS_HOST):
+        if port <= 0:
+            return None
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as error:
+            print(f"Something went wrong :: metrics endpoint {host}:{port} :: {error}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Metrics at http://{host}:{port}/metrics")
+        return server
+
+    """
+    Publishes the summary on 'topic' every 'interval' seconds from a daemon thread. Returns the thread, or None if the interval is 0.
+    """
+    def publishEvery(self, client, topic: str, interval: float = METRICS_MQTT_INTERVAL):
+        if interval <= 0:
+            return None
+
+        def publishLoop():
+            deadline = time.monotonic()
+            while True:
+                deadline += interval
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                try:
+                    client.publish(topic, self.summary())
+                except Exception as error:
+                    print(f"Something went wrong :: metrics summary :: {error}")
+
+        thread = threading.Thread(target=publishLoop, name="metrics-summary", daemon=True)
+        thread.start()
+        return thread
+
+# The process' metrics
+registry = MetricsRegistry()
+
+"""
+Returns the length of an object, or 0 if it isn't there; for reading the client's internal queues at scrape time.
+"""
+def lengthOf(owner, attribute: str) -> int:
+    return len(getattr(owner, attribute, None) or ())
+
+"""
+Counts the client's published messages and bytes, and exposes the length of its outbound queues:
+the QoS 1 and 2 messages not yet acknowledged, and the packets not yet written to the socket.
+Replaces the client's publish(), so call it before anything takes a reference to client.publish.
+"""
+def instrumentClient(client, registry: MetricsRegistry = registry):
+    messages = registry.counter("mqtt_published_messages_total", "Messages handed to the MQTT client.")
+    payloadBytes = registry.counter("mqtt_published_bytes_total", "Payload bytes handed to the MQTT client.")
+    registry.gauge("mqtt_outbound_messages", "QoS 1 and 2 messages the MQTT client hasn't had acknowledged.", function=lambda: lengthOf(client, "_out_messages"))
+    registry.gauge("mqtt_outbound_packets", "Packets waiting to be written to the broker's socket.", function=lambda: lengthOf(client, "_out_packet"))
+    publish = client.publish
+
+    def countedPublish(topic, payload=None, qos=0, retain=False, properties=None):
+        messages.inc()
+        if payload is not None:
+            # Counted in bytes as they go out: paho encodes a str as UTF-8, and a number as its ASCII string
+            if isinstance(payload, str):
+                payloadBytes.inc(len(payload.encode()))
+            else:
+                payloadBytes.inc(len(payload) if isinstance(payload, (bytes, bytearray)) else len(str(payload)))
+        return publish(topic, payload, qos, retain, properties)
+
+    client.publish = countedPublish
+    return client
+
+"""
+Starts the endpoint on 'port' and, with METRICS_MQTT_INTERVAL, the summary on 'box/process/metrics/out/'.
+"""
+def startMetrics(client, box: str, process: str, port: int, registry: MetricsRegistry = registry):
+    registry.serve(port)
+    registry.publishEvery(client, f"{box}/{process}/{METRICS_TYPE}/out/")
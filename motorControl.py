@@ -0,0 +1,539 @@
+import os
+from dotenv import load_dotenv
+import paho.mqtt.client as mqtt
+import time
+from enum import Enum
+from loopScheduler import LoopScheduler, RollingHistogram
+from waveform import waveformFor
+from trajectory import TrajectoryPlayer
+from changePublisher import ChangePublisher
+from speedFrames import SpeedFrameBatcher
+from wireCodec import encode, encodeSpeed, binaryTopic, TYPE_CONFIG
+from configSnapshot import Snapshot, ConfigEvents
+from tracing import TRACE_ENABLED, TraceStamper
+from metrics import registry, instrumentClient, startMetrics
+import profiling
+from consoleLog import console
+
+load_dotenv()
+
+'''
+The motor's control loop, shared by motorController.py and motorControllerVentilator.py: the config and command
+topics, the loop's scheduling and statistics, computing the speed, publishing the speed, config and status, and the
+metrics and profiling sections. What the speed drives is a Drive, passed to controlLoop(); the base Drive drives
+nothing, so motorController.py only publishes, and the ventilator's writes the speed to the ESC.
+'''
+
+# Constants for the motor's operation
+BOX_ID = os.getenv("BOX_ID")
+LOOP_INTERVAL = float(os.getenv("MOTOR_LOOP_INTERVAL"))		# seconds
+MIN_SPEED = int(os.getenv("MOTOR_MIN_SPEED"))
+MAX_SPEED = int(os.getenv("MOTOR_MAX_SPEED"))
+MAX_ACCELERATION = int(os.getenv("MOTOR_MAX_ACCELERATION"))	# maximum change of the motor speed in one control loop
+LOOP_POLICY = os.getenv("MOTOR_LOOP_POLICY", "skip")		# what to do with missed ticks: 'skip' or 'catchup'
+LOOP_STATS_INTERVAL = float(os.getenv("MOTOR_LOOP_STATS_INTERVAL", "10.0"))	# seconds between loop timing reports, 0 disables them
+TRAJECTORY_PLAYBACK = os.getenv("MOTOR_TRAJECTORY_PLAYBACK", "0") == "1"	# play precomputed trajectories instead of computing each tick
+PUBLISH_MODE = os.getenv("MOTOR_PUBLISH_MODE", "always")		# 'always' publishes config and status every tick, 'onchange' retained on change
+STATUS_HEARTBEAT = float(os.getenv("MOTOR_STATUS_HEARTBEAT", "5.0"))	# seconds between repeats of unchanged config and status
+SPEED_FRAME_SAMPLES = int(os.getenv("MOTOR_SPEED_FRAME_SAMPLES", "0"))	# samples per speed frame, 0 for no limit
+SPEED_FRAME_MILLIS = float(os.getenv("MOTOR_SPEED_FRAME_MILLIS", "0"))	# milliseconds per speed frame, 0 for no limit; both 0 disables frames
+SPEED_FRAMES = SPEED_FRAME_SAMPLES > 0 or SPEED_FRAME_MILLIS > 0
+SPEED_PER_SAMPLE = (os.getenv("MOTOR_SPEED_PER_SAMPLE") or ("0" if SPEED_FRAMES else "1")) == "1"	# publish every speed sample on its own to speed/out; unset, only without frames
+WIRE_BINARY = os.getenv("MQTT_WIRE_FORMAT", "csv") == "binary"		# publish speed and config in the binary wire format
+METRICS_PORT = int(os.getenv("MOTOR_METRICS_PORT", "9101"))		# port of the metrics endpoint, see metrics.py; 0 disables it
+
+class Mode(Enum):
+	CONTINUOUS = 0
+	DIFFERENTIAL = 1
+	SAFE = 99
+
+class MotorStatus:
+	def __init__(self):
+		self.running: bool = False
+		self.speed: int = 0
+
+class ContinuousSettings(Snapshot):
+	__slots__ = ("level",)
+
+	def __init__(self, level: int = MIN_SPEED):
+		super().__init__(level=level)
+
+"""
+Without arguments, the safe mode's settings from the environment.
+"""
+class DifferentialSettings(Snapshot):
+	__slots__ = ("min", "max", "period", "ratio")
+
+	def __init__(self, min: int = None, max: int = None, period: float = None, ratio: float = None):
+		super().__init__(
+			min=int(os.getenv("MOTOR_SAFE_MIN")) if min is None else min,
+			max=int(os.getenv("MOTOR_SAFE_MAX")) if max is None else max,
+			period=float(os.getenv("MOTOR_SAFE_PERIOD")) if period is None else period,
+			ratio=float(os.getenv("MOTOR_SAFE_RATIO")) if ratio is None else ratio)
+
+"""
+The motor's config. Immutable: a new config is a new MotorConfig, swapped in whole; see configSnapshot.py.
+"""
+class MotorConfig(Snapshot):
+	__slots__ = ("mode", "continuous", "differential", "safe")
+
+	def __init__(self, mode: Mode = Mode.DIFFERENTIAL, continuous: ContinuousSettings = None, differential: DifferentialSettings = None, safe: DifferentialSettings = None):
+		super().__init__(
+			mode=mode,
+			continuous=continuous or ContinuousSettings(),
+			differential=differential or DifferentialSettings(),
+			safe=safe or DifferentialSettings())	# same as the differential mode but with default settings
+
+# Parameters for the motor
+status = MotorStatus()
+config = MotorConfig()
+previousSpeed = MIN_SPEED
+scheduler = LoopScheduler(LOOP_INTERVAL, LOOP_POLICY)
+player = None
+playerConfig = None		# the config the player was built for
+configEvents = ConfigEvents()
+commandReceived = None		# monotonic time of the last start or stop command
+commandLatency = RollingHistogram(window=100)	# from a command's receipt to the tick applying it
+
+# Constants for the MQTT broker
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT"))
+MQTT_TOPIC_MOTOR_SPEED_OUT = BOX_ID + "/motor/speed/out/"
+MQTT_TOPIC_MOTOR_CONFIG_IN = BOX_ID + "/motor/config/in/"
+MQTT_TOPIC_MOTOR_CONFIG_OUT = BOX_ID + "/motor/config/out/"
+MQTT_TOPIC_MOTOR_COMMAND_IN = BOX_ID + "/motor/command/in/"
+MQTT_TOPIC_MOTOR_COMMAND_OUT = BOX_ID + "/motor/command/out/"
+MQTT_TOPIC_MOTOR_SPEED_FRAME = BOX_ID + "/motor/speed/frame/"
+MQTT_TOPIC_MOTOR_SPEED_BIN = binaryTopic(MQTT_TOPIC_MOTOR_SPEED_OUT)
+MQTT_TOPIC_MOTOR_CONFIG_BIN = binaryTopic(MQTT_TOPIC_MOTOR_CONFIG_OUT)
+MQTT_TOPIC_MOTOR_DIAGNOSTICS_OUT = BOX_ID + "/motor/diagnostics/out/"
+
+client = instrumentClient(mqtt.Client())
+changePublisher = ChangePublisher(client, STATUS_HEARTBEAT)
+configMQTTString = None		# (config, string) cached by getMotorConfigMQTTString
+configBinary = None			# (config, bytes) cached by getMotorConfigBinary
+configSpeed = None			# (config, function of time returning its speed) resolved by resolveSpeed
+stamper = TraceStamper() if TRACE_ENABLED else None	# latency tracing of the speed samples, see tracing.py
+speedBatcher = SpeedFrameBatcher(LOOP_INTERVAL, SPEED_FRAME_SAMPLES, SPEED_FRAME_MILLIS) if SPEED_FRAMES else None
+
+# Runtime metrics, see metrics.py. The loop's timing is fed by the scheduler's onTick, set in main
+LOOP_PERIOD_BUCKETS = tuple(round(LOOP_INTERVAL * factor, 6) for factor in (0.5, 0.9, 0.99, 1.01, 1.1, 1.5, 2.0, 4.0))
+loopPeriod = registry.histogram("motor_loop_period_seconds", "Time between the starts of consecutive control loop ticks.", buckets=LOOP_PERIOD_BUCKETS)
+loopLateness = registry.histogram("motor_loop_lateness_seconds", "How late the control loop ticks start after their deadline.")
+loopBody = registry.histogram("motor_loop_body_seconds", "Time the control loop spends working in a tick.")
+commandMetric = registry.histogram("motor_command_latency_seconds", "Time from a start or stop command's receipt to the tick applying it.")
+registry.counter("motor_loop_ticks_total", "Control loop ticks.", function=lambda: scheduler.ticks)
+registry.counter("motor_loop_skipped_ticks_total", "Control loop ticks skipped after an overrun.", function=lambda: scheduler.skipped)
+registry.counter("motor_loop_woken_total", "Control loop waits cut short by a command.", function=lambda: scheduler.woken)
+registry.counter("motor_configs_received_total", "Valid configs received.", function=lambda: configEvents.received)
+registry.gauge("motor_running", "1 if the motor is running.", function=lambda: int(status.running))
+registry.gauge("motor_speed", "The motor's current speed.", function=lambda: status.speed)
+
+# Hot-path sections, see profiling.py
+WAVEFORM_SECTION = profiling.section("waveform")
+PUBLISH_SECTION = profiling.section("publish")
+
+"""
+What the control loop drives with the speed. This one drives nothing; motorControllerVentilator.py's drives the ESC.
+"""
+class Drive:
+	"""
+	Called on every tick the motor runs, with the speed just computed, before it's published.
+	"""
+	def apply(self, speed: int):
+		pass
+
+	"""
+	Called on every tick the motor doesn't run; 'stopped' is True on the first one after it ran.
+	"""
+	def idle(self, stopped: bool):
+		pass
+
+	"""
+	Returns how long the last write to the hardware took, in seconds, for the console's speed line; None if there's none.
+	"""
+	def writeLatency(self):
+		return None
+
+	"""
+	Returns the lines the drive adds to the loop's final report.
+	"""
+	def report(self) -> list:
+		return []
+
+"""
+Callback function called when the connection to the MQTT broker is established.
+"""
+def onConnect(client, userdata, flags, rc):
+    if rc == 0:
+        print(f"Connected to MQTT Broker at: {MQTT_BROKER_HOST}")
+        changePublisher.reset()
+    else:
+        print("Connection to MQTT Broker failed")
+
+"""
+Called when an MQTT message is received on the motor command topic.
+Parses the message and starts or stops the motor accordingly.
+"""
+def onMotorCommand(client, userdata, msg):
+	fields = msg.payload.decode().split(",")
+	if fields[0] == "1":
+		setMotorRunning(1)
+	elif fields[0] == "0":
+		setMotorRunning(0)
+
+"""
+Called when an MQTT message is received on the motor config topic.
+The message is validated, and if validation passes, a new config is built and replaces the motor's config in one assignment,
+so the control loop never sees a config that's only partly updated.
+"""
+def onMotorConfig(client, userdata, msg):
+	try:
+		newConfig = validateConfig(msg.payload.decode())
+	except ValueError as e:
+		print("Invalid configuration values: " + str(e))
+		return
+	except Exception as e:
+		print("An unexpected error occurred: " + str(e))
+		return
+	
+	global config
+	snapshot = configFromValues(newConfig, config.safe)
+	configEvents.receive(snapshot)
+	config = snapshot
+	print("New motor config stored")
+
+"""
+Builds a MotorConfig from the values returned by validateConfig.
+"""
+def configFromValues(values: list, safe: DifferentialSettings = None) -> MotorConfig:
+	return MotorConfig(values[0], ContinuousSettings(values[1]), DifferentialSettings(*values[2:6]), safe)
+
+"""
+Takes a string and checks if it's a correctly formatted list of comma separated values for the motor's config.
+If the string and the values it contains are valid, it returns an array of those values cast into correct data types.
+Otherwise an exception is thrown.
+"""
+def validateConfig(commaSeparatedValues) -> list:
+	try:
+		fields = commaSeparatedValues.split(",")
+		config = [
+			Mode(int(fields[0])),
+			int(fields[1]),
+			int(fields[2]),
+			int(fields[3]),
+			round(float(fields[4]), 2),
+			round(float(fields[5]), 2)
+		]
+	except ValueError as e:
+		raise ValueError(e)
+	except Exception as e:
+		raise Exception(e)
+	
+	#if not (config[0] == 0 or config[0] == 1 or config[0] == 99):
+		#raise ValueError(f"Invalid mode: {config[0]}")
+	if config[1] < MIN_SPEED or config[1] > MAX_SPEED:
+		raise ValueError(f"Invalid continuous level: {config[0]}")
+	elif config[2] < MIN_SPEED or config[2] > MAX_SPEED:
+		raise ValueError(f"Invalid minimum differential level: {config[0]}")
+	elif config[3] < MIN_SPEED or config[3] > MAX_SPEED:
+		raise ValueError(f"Invalid maximum differential level: {config[0]}")
+	elif config[4] <= 0.0:
+		raise ValueError(f"Non-positive differential period: {config[0]}")
+	elif config[5] < 0.0 or config[5] > 1.0:
+		raise ValueError(f"Invalid differential ratio: {config[0]}")
+	
+	return config
+
+"""
+Sets the motor active or inactive, and wakes the control loop to apply it right away instead of at the next tick.
+"""
+def setMotorRunning(run):
+	global status
+	global commandReceived
+	if run == 1 and not status.running:
+		print("Motor started")
+		commandReceived = time.monotonic()
+		status.running = True
+		scheduler.wake()
+	elif run == 0 and status.running:
+		print("Motor stopped")
+		commandReceived = time.monotonic()
+		status.running = False
+		scheduler.wake()
+
+"""
+Stays in a loop, and while the motor is running, drives 'drive' with the speed and sends it to the MQTT broker.
+"""
+def controlLoop(drive: Drive = Drive()):
+	global status
+	global previousSpeed
+	global player
+	statsEvery = round(LOOP_STATS_INTERVAL / LOOP_INTERVAL)
+	missed = 0
+	appliedConfig = None
+	appliedRunning = status.running
+	try:
+		while True:
+			# One config for the whole tick; onMotorConfig may swap in a new one at any time
+			cfg = config
+			if cfg is not appliedConfig:
+				appliedConfig = cfg
+				resolveSpeed(cfg)
+				reportConfigApplied(cfg)
+
+			running = status.running
+			if running:
+				with WAVEFORM_SECTION:
+					status.speed = getNextSpeed(cfg, missed)
+				captured = time.monotonic()
+				previousSpeed = status.speed
+				drive.apply(status.speed)
+				printMotorSpeed(drive.writeLatency())
+
+				with PUBLISH_SECTION:
+					if SPEED_PER_SAMPLE:
+						publishSpeed(captured)
+					if speedBatcher is not None:
+						publishSpeedFrame(missed)
+					if PUBLISH_MODE == "always":
+						publishConfig(client.publish, cfg)
+						client.publish(MQTT_TOPIC_MOTOR_COMMAND_OUT, getMotorStatusMQTTString())
+			else:
+				# Playback restarts from the motor's current speed and phase the next time it runs
+				player = None
+				if speedBatcher is not None:
+					publishFrame(speedBatcher.flush())
+				drive.idle(running != appliedRunning)
+
+			if running != appliedRunning:
+				appliedRunning = running
+				reportCommandApplied(running)
+
+			if PUBLISH_MODE == "onchange":
+				# Retained, and only when changed or the heartbeat is due; this also reports the motor stopping.
+				# Publishing every tick sends nothing while stopped, so only running ticks count as avoided messages
+				changePublisher.counting = running
+				publishConfig(changePublisher.publish, cfg)
+				changePublisher.publish(MQTT_TOPIC_MOTOR_COMMAND_OUT, getMotorStatusMQTTString, key=running)
+
+			if statsEvery > 0 and scheduler.ticks % statsEvery == statsEvery - 1:
+				print(f"Loop {scheduler.summary()}")
+				if PUBLISH_MODE == "onchange":
+					print(f"Config/status publishing {changePublisher.counters.summary()}")
+
+			# The value is sent once every interval, sleep until the next deadline
+			missed = scheduler.wait()
+	except KeyboardInterrupt:
+		client.disconnect()
+	except Exception as e:
+		print("An unexpected error occurred: " + str(e))
+	finally:
+		print(f"Loop {scheduler.summary()}")
+		print(f"Config {configEvents.summary()}")
+		print(f"Command to actuation {commandLatency.summary()}")
+		print(f"Console {console.summary()}")
+		if PUBLISH_MODE == "onchange":
+			print(f"Config/status publishing {changePublisher.counters.summary()}")
+		for line in drive.report():
+			print(line)
+
+"""
+Records the time from a start or stop command's receipt to the tick that applied it,
+and publishes it on the diagnostics topic as 'running,milliseconds'.
+"""
+def reportCommandApplied(running: bool):
+	if commandReceived is None:
+		return
+	latency = time.monotonic() - commandReceived
+	commandLatency.add(latency)
+	commandMetric.observe(latency)
+	client.publish(MQTT_TOPIC_MOTOR_DIAGNOSTICS_OUT, f"{int(running)},{latency * 1e3:.3f}")
+
+"""
+Feeds a control loop tick's timing to the metrics; the scheduler's onTick.
+"""
+def observeTick(period: float, lateness: float, body: float):
+	loopPeriod.observe(period)
+	loopLateness.observe(lateness)
+	loopBody.observe(body)
+
+"""
+Records the first tick using a config, and prints how long after its receipt that was.
+"""
+def reportConfigApplied(cfg: MotorConfig):
+	latency = configEvents.apply(cfg)
+	if latency is not None:
+		print(f"Motor config applied {latency * 1e3:.1f} ms after it was received")
+
+"""
+Returns the motor's speed for this tick. Normally computed from the config and limited against the previous speed;
+with MOTOR_TRAJECTORY_PLAYBACK the same values are played from a precomputed trajectory, rebuilt when the config changes.
+"""
+def getNextSpeed(cfg: MotorConfig, missed: int) -> int:
+	global player
+	global playerConfig
+	if not TRAJECTORY_PLAYBACK:
+		return limitAcceleration(getMotorSpeed(cfg), previousSpeed)
+
+	if player is None or cfg is not playerConfig:
+		player = TrajectoryPlayer(cfg, 1.0 / LOOP_INTERVAL, MAX_ACCELERATION, previousSpeed)
+		playerConfig = cfg
+		return player.next()
+	return player.next(missed)
+
+"""
+Publishes the current speed on its own, in the configured wire format.
+With MQTT_TRACE its trace follows, 'captured' being when the speed was computed.
+"""
+def publishSpeed(captured: float = None):
+	topic = MQTT_TOPIC_MOTOR_SPEED_BIN if WIRE_BINARY else MQTT_TOPIC_MOTOR_SPEED_OUT
+	client.publish(topic, encodeSpeed(status.speed) if WIRE_BINARY else str(status.speed))
+	if stamper is not None:
+		stamper.publish(client, topic, captured)
+
+"""
+Publishes the config in the configured wire format, through the given publish function.
+"""
+def publishConfig(publish, cfg: MotorConfig):
+	if WIRE_BINARY:
+		publish(MQTT_TOPIC_MOTOR_CONFIG_BIN, getMotorConfigBinary(cfg))
+	else:
+		publish(MQTT_TOPIC_MOTOR_CONFIG_OUT, getMotorConfigMQTTString(cfg))
+
+"""
+Adds the current speed to the speed frame, and publishes the frame when it's complete.
+A frame's samples are evenly spaced, so missed ticks complete the frame before the new sample.
+"""
+def publishSpeedFrame(missed: int):
+	if missed:
+		publishFrame(speedBatcher.flush())
+	publishFrame(speedBatcher.add(status.speed, time.time()))
+
+"""
+Publishes a speed frame payload, if there is one.
+"""
+def publishFrame(frame):
+	if frame is not None:
+		client.publish(MQTT_TOPIC_MOTOR_SPEED_FRAME, frame)
+
+"""
+Limits the amount of change in the given input speed.
+The returned value can differ from the input at most by MAX_ACCELERATION.
+"""
+def limitAcceleration(speed: int, previousSpeed: int) -> int:
+	if speed > previousSpeed + MAX_ACCELERATION:
+		return previousSpeed + MAX_ACCELERATION
+	elif speed < previousSpeed - MAX_ACCELERATION:
+		return previousSpeed - MAX_ACCELERATION
+	else:
+		return speed
+
+"""
+Returns the motor's speed at this moment, following the config's operating mode.
+"""
+def getMotorSpeed(cfg: MotorConfig):
+	cached = configSpeed
+	if cached is None or cached[0] is not cfg:
+		cached = resolveSpeed(cfg)
+	return cached[1](time.time())
+
+"""
+Resolves the config's operating mode, and for the differential and safe modes its precomputed waveform, into a function
+of time returning the speed; cached as (config, function). The control loop does this when it applies a config,
+so a tick only compares the config's identity and looks up its position within the waveform's period.
+"""
+def resolveSpeed(cfg: MotorConfig) -> tuple:
+	global configSpeed
+	mode = cfg.mode
+	if mode is Mode.CONTINUOUS:
+		level = getContinuousSpeed(cfg.continuous)
+		speed = lambda now: level
+	elif mode is Mode.DIFFERENTIAL:
+		speed = waveformFor(cfg.differential).speedAt
+	elif mode is Mode.SAFE:
+		speed = waveformFor(cfg.safe).speedAt
+	configSpeed = (cfg, speed)
+	return configSpeed
+
+"""
+Visualizes the motor's speed on the command line by drawing a graph, with min, max and speed values visible.
+The line is built and written by the console's thread, at most CONSOLE_SAMPLE_HZ times a second; see consoleLog.py.
+"""
+def printMotorSpeed(writeLatency: float = None):
+	console.sample("speed", formatMotorSpeed, status.speed, writeLatency)
+
+"""
+Returns the line printMotorSpeed shows; with the duration of the drive's last write, if it has one.
+"""
+def formatMotorSpeed(speed: int, writeLatency: float = None) -> str:
+	TOTAL_WIDTH = 40
+	
+	positionPercentage = (speed - MIN_SPEED) / (MAX_SPEED - MIN_SPEED)
+	lowerPadding = round(TOTAL_WIDTH * positionPercentage)
+	upperPadding = TOTAL_WIDTH - lowerPadding
+
+	line = f"{MIN_SPEED} |{' ' * lowerPadding}+{' ' * upperPadding}| {MAX_SPEED} [{speed}]"
+	return line if writeLatency is None else f"{line} pwm {writeLatency * 1e6:.0f}us"
+
+"""
+Returns the motor's speed in continuous mode.
+"""
+def getContinuousSpeed(settings: ContinuousSettings) -> int:
+	return settings.level
+
+"""
+Returns the motor's status as a string formatted for MQTT channel.
+"""
+def getMotorStatusMQTTString() -> str:
+	global status
+	return str(int(status.running)) + "," + str(status.speed)
+
+"""
+Returns the config as a string formatted for MQTT channel.
+The string is only rebuilt when the config is a different one than last time.
+"""
+def getMotorConfigMQTTString(cfg: MotorConfig) -> str:
+	global configMQTTString
+	cached = configMQTTString
+	if cached is None or cached[0] is not cfg:
+		cached = (cfg, formatMotorConfig(cfg))
+		configMQTTString = cached
+	return cached[1]
+
+"""
+Returns the config in the binary wire format. Like the string, it's only rebuilt for a different config.
+"""
+def getMotorConfigBinary(cfg: MotorConfig) -> bytes:
+	global configBinary
+	cached = configBinary
+	if cached is None or cached[0] is not cfg:
+		cached = (cfg, encode(TYPE_CONFIG, (cfg.mode.value, cfg.continuous.level, cfg.differential.min, cfg.differential.max, cfg.differential.period, cfg.differential.ratio), True))
+		configBinary = cached
+	return cached[1]
+
+"""
+Formats a motor config as a comma separated string, in the same format as the config topics.
+"""
+def formatMotorConfig(config: MotorConfig) -> str:
+	return str(int(config.mode.value)) + "," + str(config.continuous.level) + "," + str(config.differential.min) + "," + str(config.differential.max) + "," + str(config.differential.period) + "," + str(config.differential.ratio)
+
+"""
+Establishes connection to the MQTT broker, subscribes to the motor config and command topics
+and goes to the control loop, driving 'drive'. 'keepalive' is the MQTT keepalive, in seconds.
+"""
+def run(drive: Drive = Drive(), keepalive: int = 0):
+	client.on_connect = onConnect
+	client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, keepalive)
+
+	client.subscribe([
+		(MQTT_TOPIC_MOTOR_CONFIG_IN, 1),
+		(MQTT_TOPIC_MOTOR_COMMAND_IN, 1)
+	])
+	client.message_callback_add(MQTT_TOPIC_MOTOR_CONFIG_IN, onMotorConfig)
+	client.message_callback_add(MQTT_TOPIC_MOTOR_COMMAND_IN, onMotorCommand)
+
+	client.loop_start()
+	scheduler.onTick = observeTick
+	startMetrics(client, BOX_ID, "motor", METRICS_PORT)
+	controlLoop(drive)
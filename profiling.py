@@ -0,0 +1,266 @@
+import io
+import os
+import sys
+import time
+import atexit
+import signal
+import cProfile
+import pstats
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+'''
+Opt-in profiling of the real processes, without editing code.
+
+The mode comes from PROFILE_MODE, or from '--profile MODE' on the command line, which overrides it:
+- 'off':      the default; sections cost one no-op 'with' and nothing else runs
+- 'sections': only the wall time of the named hot-path sections, fe. 'pwm write' or 'render'
+- 'cprofile': the sections and cProfile of the main thread, where every process' loop runs
+- 'sample':   the sections and a sampling profiler of all the threads, MQTT's included, every PROFILE_SAMPLE_INTERVAL seconds
+The profilers stop after PROFILE_SECONDS (0 for no limit); the sections keep counting. Everything is written to PROFILE_DIR
+as '<process>-<pid>.*' when the process exits, is terminated, or gets SIGUSR1, which dumps without stopping:
+- '.txt':     the sections' summary, and the top functions of the profile
+- '.prof':    the cProfile stats, for 'python -m pstats' or snakeviz
+- '.folded':  the sampled stacks in the folded format of flamegraph.pl and speedscope
+
+A section is created once per module and entered on the hot path:
+
+    PWM_WRITE = profiling.section("pwm write")
+    with PWM_WRITE:
+        actuator.write(pulse)
+
+A section measures one thing at a time, so enter each section object from one thread only.
+'''
+
+MODES = ("off", "sections", "cprofile", "sample")
+
+"""
+Returns the mode of '--profile MODE' or '--profile=MODE' in the arguments, or None if there's none.
+The arguments are only read; scripts with argparse accept the option through addArguments().
+"""
+def modeFromArguments(arguments: list):
+    for index, argument in enumerate(arguments):
+        if argument.startswith("--profile="):
+            return argument.partition("=")[2]
+        if argument == "--profile" and index + 1 < len(arguments):
+            return arguments[index + 1]
+    return None
+
+PROFILE_MODE = modeFromArguments(sys.argv[1:]) or os.getenv("PROFILE_MODE", "off")
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "60"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+if PROFILE_MODE not in MODES:
+    raise ValueError(f"Unknown profiling mode: {PROFILE_MODE}, expected one of {', '.join(MODES)}")
+ENABLED = PROFILE_MODE != "off"
+
+"""
+Wall time of a named section: count, total and max in seconds.
+"""
+class Section:
+    __slots__ = ("name", "count", "total", "max", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.add(time.perf_counter() - self.start)
+        return False
+
+    """
+    Adds a duration measured elsewhere, fe. by a stats class already timing the same code.
+    """
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+"""
+What section() returns when profiling is off.
+"""
+class NullSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def add(self, elapsed: float):
+        pass
+
+NULL_SECTION = NullSection()
+sections = {}
+
+"""
+Returns the section of the name, the same object for the same name. A no-op when profiling is off.
+"""
+def section(name: str):
+    if not ENABLED:
+        return NULL_SECTION
+    existing = sections.get(name)
+    if existing is None:
+        existing = sections[name] = Section(name)
+    return existing
+
+"""
+Adds '--profile MODE' to a script's argparse parser, so that it accepts the option; its value is already in PROFILE_MODE.
+"""
+def addArguments(parser):
+    parser.add_argument("--profile", choices=MODES, default=PROFILE_MODE, help="Profile this process, see profiling.py. Overrides PROFILE_MODE.")
+
+"""
+Samples the stacks of every thread but its own, counting each distinct stack.
+"""
+class StackSampler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="profiling-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while self.running:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                name = names.get(ident)
+                if name is None:
+                    name = names[ident] = next((thread.name for thread in threading.enumerate() if thread.ident == ident), str(ident))
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    """
+    Returns the functions with the most samples on top of the stack, as (function, samples) pairs.
+    """
+    def top(self, count: int = 20) -> list:
+        own = Counter()
+        for stack, samples in list(self.stacks.items()):
+            own[stack.rpartition(";")[2]] += samples
+        return own.most_common(count)
+
+"""
+The process' profiling session, started by start().
+"""
+class Session:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stopped = None
+        self.profiler = None
+        self.sampler = None
+        self.path = os.path.join(PROFILE_DIR, f"{name}-{os.getpid()}")
+
+    def start(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if PROFILE_MODE == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif PROFILE_MODE == "sample":
+            self.sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+            self.sampler.start()
+
+        atexit.register(self.dump)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+        if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+            # Terminated by stop.py: dump on the way out instead of dying on the spot
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if PROFILE_SECONDS > 0 and (self.profiler is not None or self.sampler is not None):
+            # A signal, as cProfile can only be stopped from the thread it profiles; the handler runs on the main thread
+            signal.signal(signal.SIGALRM, lambda signum, frame: self.stopProfilers())
+            signal.setitimer(signal.ITIMER_REAL, PROFILE_SECONDS)
+        print(f"Profiling {self.name} :: {PROFILE_MODE}, writing to {self.path}.*")
+
+    """
+    Stops the profilers at the end of the window; the sections keep counting.
+    """
+    def stopProfilers(self):
+        if self.stopped is not None:
+            return
+        self.stopped = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        print(f"Profiling {self.name} :: the profile's {PROFILE_SECONDS:g} s window is over")
+
+    """
+    Writes the sections' summary and the profiles. Doesn't stop anything, so it can be called again.
+    """
+    def dump(self):
+        try:
+            lines = [self.sectionSummary()]
+            if self.profiler is not None:
+                if self.stopped is None:
+                    self.profiler.disable()
+                self.profiler.dump_stats(self.path + ".prof")
+                text = io.StringIO()
+                pstats.Stats(self.path + ".prof", stream=text).sort_stats("cumulative").print_stats(30)
+                lines.append(text.getvalue())
+                if self.stopped is None:
+                    self.profiler.enable()
+            if self.sampler is not None:
+                with open(self.path + ".folded", "w") as file:
+                    for stack, samples in list(self.sampler.stacks.items()):
+                        file.write(f"{stack} {samples}\n")
+                lines.append(f"\n{self.sampler.samples} samples every {PROFILE_SAMPLE_INTERVAL * 1e3:g} ms, most on top of the stack:")
+                for function, samples in self.sampler.top():
+                    lines.append(f"{samples:8d}  {function}")
+            with open(self.path + ".txt", "w") as file:
+                file.write("\n".join(lines) + "\n")
+            print(f"Profiling {self.name} :: written to {self.path}.*")
+        except Exception as error:
+            print(f"Something went wrong :: profiling dump :: {error}")
+
+    def sectionSummary(self) -> str:
+        wall = time.perf_counter() - self.started
+        lines = [f"{self.name} :: {PROFILE_MODE}, {wall:.1f} s", f"{'section':<16} {'count':>9} {'total ms':>10} {'mean us':>9} {'max us':>9} {'% wall':>7}"]
+        for entry in sorted(sections.values(), key=lambda entry: entry.total, reverse=True):
+            mean = entry.total / entry.count if entry.count else 0.0
+            lines.append(f"{entry.name:<16} {entry.count:>9} {entry.total * 1e3:>10.1f} {mean * 1e6:>9.1f} {entry.max * 1e6:>9.1f} {100.0 * entry.total / wall:>7.2f}")
+        return "\n".join(lines)
+
+session = None
+
+"""
+Starts profiling the process under the given name, if it's enabled. Call it first thing, from the main thread.
+"""
+def start(name: str):
+    global session
+    if not ENABLED or session is not None:
+        return session
+    session = Session(name)
+    session.start()
+    return session
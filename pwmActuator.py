@@ -0,0 +1,152 @@
+import time
+
+'''
+Long-lived PWM actuator for the ESC.
+
+The pigpio connection is opened once and reused for every pulse write, instead of
+opening a new socket to the pigpio daemon on every control loop tick. If a write fails,
+the connection is dropped and reopened on the next write.
+
+Select the backend with MOTOR_PWM_BACKEND: 'pigpio' (default) talks to the pigpio daemon,
+'fake' uses FakePigpio so the controller can be run and tested without the hardware.
+'''
+
+PWM_STOP_PULSE = 1000
+
+"""
+Stand-in for pigpio.pi() that records the pulses written to it instead of driving GPIO pins.
+Set 'failWrites' to make the next writes raise, to exercise the reconnect logic.
+"""
+class FakePigpio:
+	OUTPUT = 1
+
+	def __init__(self, writeDelay=0.0):
+		self.connected = True
+		self.writeDelay = writeDelay
+		self.failWrites = 0
+		self.modes = {}
+		self.pulses = {}
+		self.history = []
+
+	def set_mode(self, pin, mode):
+		self.modes[pin] = mode
+
+	def set_servo_pulsewidth(self, pin, pulse):
+		if not self.connected:
+			raise ConnectionError("fake pigpio connection is closed")
+		if self.failWrites > 0:
+			self.failWrites -= 1
+			raise ConnectionError("fake pigpio write failure")
+		if self.writeDelay:
+			time.sleep(self.writeDelay)
+		self.pulses[pin] = pulse
+		self.history.append((pin, pulse))
+
+	def get_servo_pulsewidth(self, pin):
+		return self.pulses.get(pin, 0)
+
+	def stop(self):
+		self.connected = False
+
+"""
+Running statistics of the PWM write latency, in seconds.
+"""
+class WriteLatency:
+	def __init__(self):
+		self.count: int = 0
+		self.failures: int = 0
+		self.reconnects: int = 0
+		self.last: float = 0.0
+		self.max: float = 0.0
+		self.total: float = 0.0
+
+	def record(self, latency: float):
+		self.count += 1
+		self.last = latency
+		self.total += latency
+		if latency > self.max:
+			self.max = latency
+
+	def mean(self) -> float:
+		return self.total / self.count if self.count else 0.0
+
+	def summary(self) -> str:
+		return f"writes={self.count} failures={self.failures} reconnects={self.reconnects} last={self.last * 1e6:.0f}us mean={self.mean() * 1e6:.0f}us max={self.max * 1e6:.0f}us"
+
+"""
+Drives one GPIO pin with servo pulses over a single, persistent pigpio connection.
+'connect' is a factory returning a pigpio.pi()-like object; it's called again only after a failure.
+"""
+class PWMActuator:
+	def __init__(self, pin=13, connect=None, retries=1):
+		self.pin = int(pin)
+		self.connect = connect or pigpioConnection
+		self.retries = retries
+		self.pi = None
+		self.pulse = None
+		self.latency = WriteLatency()
+
+	"""
+	Opens the connection if there isn't a working one already. Raises ConnectionError if pigpio can't be reached.
+	"""
+	def open(self):
+		if self.pi is not None and self.pi.connected:
+			return self.pi
+		pi = self.connect()
+		if not pi.connected:
+			raise ConnectionError(f"Could not connect to pigpio for GPIO {self.pin}")
+		pi.set_mode(self.pin, getattr(pi, "OUTPUT", 1))
+		self.pi = pi
+		return pi
+
+	def close(self):
+		if self.pi is not None:
+			try:
+				self.pi.stop()
+			except Exception as e:
+				print(f"Error closing pigpio connection: {e}")
+			self.pi = None
+
+	"""
+	Writes a pulse width to the pin, reconnecting and retrying if the write fails.
+	Returns the latency of the successful write in seconds.
+	"""
+	def write(self, pulse) -> float:
+		pulse = int(pulse)
+		attempt = 0
+		while True:
+			start = time.perf_counter()
+			try:
+				self.open().set_servo_pulsewidth(self.pin, pulse)
+			except Exception:
+				self.latency.failures += 1
+				self.close()
+				if attempt >= self.retries:
+					raise
+				attempt += 1
+				self.latency.reconnects += 1
+				continue
+			latency = time.perf_counter() - start
+			self.latency.record(latency)
+			self.pulse = pulse
+			return latency
+
+	def run(self, pulse):
+		return self.write(pulse)
+
+"""
+Connects to the local pigpio daemon. pigpio is imported here so that the fake backend works without it.
+"""
+def pigpioConnection():
+	import pigpio
+	return pigpio.pi()
+
+"""
+Returns the connection factory for a backend name.
+"""
+def getConnectionFactory(backend: str = "pigpio"):
+	if backend == "fake":
+		return FakePigpio
+	elif backend == "pigpio":
+		return pigpioConnection
+	raise ValueError(f"Unknown PWM backend: {backend}")
@@ -1,48 +1,341 @@
 import os
+import math
+import time
+import random
+import socket
+import struct
+import argparse
+import multiprocessing
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
-from random import randint
-import time
-
-"""
-Used to publish random data. Mainly to demo 'displayManager.py' functionality. 
-"""
+from loopScheduler import LoopScheduler, RollingHistogram, LAG_BUCKETS
+from waveform import DifferentialWaveform
+from wireCodec import binaryTopic, encodeSpeed, encodeFlow, encodeDPTemp
 
 load_dotenv()
 
+'''
+Publishes synthetic data of one or many boxes: to demo 'displayManager.py', and to size the broker and check the display
+and the recorder under load.
+
+Every simulated box publishes what a real one does, on the same topics: the motor's speed, status and config, and the
+inflow, outflow, pressure and temperature of its sensors. The motor follows a differential waveform of its own, see
+waveform.py, with a random breath period, ratio and speed range; the inflow rises and falls with each breath's
+inspiration and the outflow with its expiration, the pressure follows their difference and the temperature drifts slowly.
+With '--binary' the samples are in the binary wire format, the pressure and temperature in one message.
+
+The boxes are split across '--workers' processes with one connection each. The workers don't use paho: publish()
+per message costs more than formatting the message, and paho has no public way to send packets built elsewhere.
+Instead a worker opens its own socket to the broker, see PacketWriter, and every tick encodes the QoS 0 PUBLISH packets
+of all its boxes into one buffer and writes it as a single send, so the cost per message is formatting its payload.
+The send blocks while the broker doesn't keep up with reading; the worker reports that time as stalled, and the ticks
+it misses show up as a rate below the target.
+
+Every LOAD_PROBE_INTERVAL seconds each worker adds a probe with its send time to the buffer, on 'loadProbe/<worker>'.
+The probe is behind all the samples queued before it, so its delay until it comes back from the broker is how far
+the broker, and the worker's socket, are behind.
+'''
+
 BOX_ID = os.getenv("BOX_ID")
 LOOP_INTERVAL = float(os.getenv("MOTOR_LOOP_INTERVAL"))		# seconds
 
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST")
 MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT"))
-TOPIC = f"{BOX_ID}/sensor/flow/out/"
+MQTT_TOPIC_MOTOR_SPEED_OUT = os.getenv("MQTT_TOPIC_MOTOR_SPEED_OUT")
+MQTT_TOPIC_MOTOR_CONFIG_OUT = os.getenv("MQTT_TOPIC_MOTOR_CONFIG_OUT")
+MQTT_TOPIC_MOTOR_COMMAND_OUT = os.getenv("MQTT_TOPIC_MOTOR_COMMAND_OUT")
+MQTT_TOPIC_SENSOR_OUTFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_OUTFLOW_OUT")
+MQTT_TOPIC_SENSOR_INFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_INFLOW_OUT")
+MQTT_TOPIC_SENSOR_DP_OUT = os.getenv("MQTT_TOPIC_SENSOR_DP_OUT")
+MQTT_TOPIC_SENSOR_TEMP_OUT = os.getenv("MQTT_TOPIC_SENSOR_TEMP_OUT")
 
-client = mqtt.Client()
+REPORT_INTERVAL = float(os.getenv("LOAD_REPORT_INTERVAL", "5.0"))     # seconds between the rate reports
+PROBE_INTERVAL = float(os.getenv("LOAD_PROBE_INTERVAL", "0.5"))       # seconds between a worker's lag probes
 
-def onConnect(client, userdata, flags, rc):
-    if rc == 0:
-        print(f"Connected to MQTT Broker at: {MQTT_BROKER_HOST}")
-    else:
-        print("Connection to MQTT Broker failed")
+PROBE_TOPIC = "loadProbe"
+STATUS_INTERVAL = 1.0     # seconds between a box's motor status messages
+CONFIG_INTERVAL = 10.0    # seconds between a box's motor config messages
+PRESSURE_PER_FLOW = 0.05  # pressure difference of a unit of net flow
 
-def controlLoop():
-    try:
-        while True:
-            publishingData = randint(1, 40)
-            print(publishingData)
+# The sensors of a simulated box
+INFLOW_SENSOR = "flowIn01"
+OUTFLOW_SENSOR = "flowOut01"
+DP_SENSOR = "diffPressure01"
+
+# The workers' counters, each worker has COUNTERS of them in the shared array
+MESSAGES, BYTES, SKIPPED, STALLED_MS = range(4)
+COUNTERS = 4
+
+TOPIC_LENGTH = struct.Struct("!H")
+PUBLISH_QOS0 = 0x30
+CONNECT = 0x10
+CONNACK = 0x20
+DISCONNECT = b"\xe0\x00"
+# Protocol name and level of MQTT 3.1.1, a clean session and no keepalive: the worker only writes, so it sends no pings
+CONNECT_HEADER = b"\x00\x04MQTT\x04\x02\x00\x00"
+
+parser = argparse.ArgumentParser(description="Publishes synthetic data of many boxes, and reports the rate and how far the broker falls behind.")
+parser.add_argument("-n", "--boxes", type=int, default=1, help="Number of boxes. One box is BOX_ID, more are '<prefix>01', '<prefix>02' . . .")
+parser.add_argument("-p", "--prefix", default="box", help="Prefix of the boxes' IDs. Defaults to 'box'.")
+parser.add_argument("-r", "--rate", type=float, default=1.0 / LOOP_INTERVAL, help="Samples a second of every series. Defaults to 1 / MOTOR_LOOP_INTERVAL.")
+parser.add_argument("-w", "--workers", type=int, default=1, help="Number of publishing processes, each with its own connection.")
+parser.add_argument("-t", "--duration", type=float, default=0.0, help="Seconds to run, 0 until interrupted.")
+parser.add_argument("--binary", action="store_true", help="Publishes the samples in the binary wire format.")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the boxes' random waveforms.")
+
+"""
+Returns the topic of a PUBLISH packet, its length first.
+"""
+def topicField(topic: str) -> bytes:
+    encoded = topic.encode()
+    return TOPIC_LENGTH.pack(len(encoded)) + encoded
+
+"""
+Appends the fixed header of a packet, its type and its remaining length, to 'buffer'.
+"""
+def appendHeader(buffer: bytearray, packetType: int, length: int):
+    if length < 0x80:
+        buffer += bytes((packetType, length))
+        return
+    buffer.append(packetType)
+    while length >= 0x80:
+        buffer.append((length & 0x7F) | 0x80)
+        length >>= 7
+    buffer.append(length)
+
+"""
+Appends a QoS 0 PUBLISH packet to 'buffer'.
+"""
+def appendPublish(buffer: bytearray, topic: bytes, payload: bytes):
+    appendHeader(buffer, PUBLISH_QOS0, len(topic) + len(payload))
+    buffer += topic
+    buffer += payload
+
+"""
+A connection to the broker of its own, that only publishes at QoS 0: send() writes packets encoded with appendPublish
+as they are. It speaks just enough MQTT 3.1.1 to connect and disconnect, so it's for the load workers, not a client.
+"""
+class PacketWriter:
+    def __init__(self, host: str, port: int, clientID: str):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        encodedID = clientID.encode()
+        packet = bytearray()
+        appendHeader(packet, CONNECT, len(CONNECT_HEADER) + TOPIC_LENGTH.size + len(encodedID))
+        packet += CONNECT_HEADER + TOPIC_LENGTH.pack(len(encodedID)) + encodedID
+        self.socket.sendall(packet)
+        # CONNACK: type, length 2, session present, return code
+        acknowledgement = b""
+        while len(acknowledgement) < 4:
+            received = self.socket.recv(4 - len(acknowledgement))
+            if not received:
+                raise ConnectionError("The broker closed the connection instead of acknowledging it")
+            acknowledgement += received
+        if acknowledgement[0] != CONNACK or acknowledgement[3] != 0:
+            raise ConnectionError(f"The broker refused the connection: {acknowledgement.hex()}")
+
+    """
+    Writes packets to the broker, blocking until the socket has taken all of them.
+    """
+    def send(self, packets: bytes):
+        self.socket.sendall(packets)
 
-            client.publish(TOPIC, str(publishingData))
+    def close(self):
+        try:
+            self.socket.sendall(DISCONNECT)
+        except OSError:
+            pass
+        self.socket.close()
 
-			# The value is sent once every interval, sleep in between
-            time.sleep(LOOP_INTERVAL)
+class SimulatedBox:
+    def __init__(self, boxID: str, rng: random.Random, binary: bool = False):
+        self.random = rng
+        self.binary = binary
+        self.period = round(rng.uniform(2.0, 6.0), 1)
+        self.ratio = round(rng.uniform(0.3, 0.5), 2)
+        low = rng.randint(20, 40)
+        high = rng.randint(60, 100)
+        self.waveform = DifferentialWaveform(low, high, self.period, self.ratio)
+        self.rise = self.period * self.ratio
+        self.fall = self.period - self.rise
+        self.offset = rng.uniform(0.0, self.period)
+        self.peakFlow = rng.uniform(40.0, 80.0)
+        self.temperature = rng.uniform(20.0, 23.0)
+        self.config = f"1,0,{low},{high},{self.period},{self.ratio}".encode()
+
+        sensorTopics = (f"{boxID}{MQTT_TOPIC_MOTOR_SPEED_OUT}", f"{boxID}/{INFLOW_SENSOR}{MQTT_TOPIC_SENSOR_INFLOW_OUT}",
+            f"{boxID}/{OUTFLOW_SENSOR}{MQTT_TOPIC_SENSOR_OUTFLOW_OUT}", f"{boxID}/{DP_SENSOR}{MQTT_TOPIC_SENSOR_DP_OUT}")
+        if binary:
+            sensorTopics = tuple(binaryTopic(topic) for topic in sensorTopics)
+        self.speedTopic, self.inflowTopic, self.outflowTopic, self.dpTopic = (topicField(topic) for topic in sensorTopics)
+        self.tempTopic = topicField(f"{boxID}/{DP_SENSOR}{MQTT_TOPIC_SENSOR_TEMP_OUT}")
+        self.statusTopic = topicField(f"{boxID}{MQTT_TOPIC_MOTOR_COMMAND_OUT}")
+        self.configTopic = topicField(f"{boxID}{MQTT_TOPIC_MOTOR_CONFIG_OUT}")
+
+    """
+    Appends the box's messages at time 'now' to 'buffer', with its status and config if they're due. Returns their number.
+    """
+    def write(self, buffer: bytearray, now: float, status: bool = False, config: bool = False) -> int:
+        t = now + self.offset
+        position = t % self.period
+        speed = self.waveform.speedAt(t)
+        if position < self.rise:
+            inflow, outflow = self.peakFlow * math.sin(math.pi * position / self.rise), 0.0
+        else:
+            inflow, outflow = 0.0, self.peakFlow * math.sin(math.pi * (position - self.rise) / self.fall)
+        pressure = (inflow - outflow) * PRESSURE_PER_FLOW + (self.random.random() - 0.5) * 0.02
+        temperature = self.temperature + 0.5 * math.sin(now / 600.0 + self.offset)
+
+        if self.binary:
+            appendPublish(buffer, self.speedTopic, encodeSpeed(speed))
+            appendPublish(buffer, self.inflowTopic, encodeFlow(inflow))
+            appendPublish(buffer, self.outflowTopic, encodeFlow(outflow))
+            appendPublish(buffer, self.dpTopic, encodeDPTemp(pressure, temperature))
+            count = 4
+        else:
+            appendPublish(buffer, self.speedTopic, str(speed).encode())
+            appendPublish(buffer, self.inflowTopic, f"{inflow:.2f}".encode())
+            appendPublish(buffer, self.outflowTopic, f"{outflow:.2f}".encode())
+            appendPublish(buffer, self.dpTopic, f"{pressure:.3f}".encode())
+            appendPublish(buffer, self.tempTopic, f"{temperature:.2f}".encode())
+            count = 5
+        if status:
+            appendPublish(buffer, self.statusTopic, f"1,{speed}".encode())
+            count += 1
+        if config:
+            appendPublish(buffer, self.configTopic, self.config)
+            count += 1
+        return count
+
+"""
+Returns the IDs of 'count' boxes; a single box is BOX_ID.
+"""
+def boxIDs(count: int, prefix: str) -> list:
+    if count == 1:
+        return [BOX_ID]
+    width = max(2, len(str(count)))
+    return [f"{prefix}{i:0{width}d}" for i in range(1, count + 1)]
+
+"""
+Splits the boxes into 'workers' groups of about the same size.
+"""
+def shardBoxes(boxes: list, workers: int) -> list:
+    return [shard for shard in (boxes[i::workers] for i in range(workers)) if shard]
+
+"""
+A worker process: publishes its boxes every 1 / rate seconds until 'stop' is set, counting into its part of 'counters'.
+"""
+def runWorker(index: int, boxes: list, rate: float, binary: bool, seed: int, counters, stop):
+    simulated = [SimulatedBox(boxID, random.Random(f"{seed}/{boxID}"), binary) for boxID in boxes]
+    writer = PacketWriter(MQTT_BROKER_HOST, MQTT_BROKER_PORT, f"loadWorker-{os.getpid()}-{index}")
+    scheduler = LoopScheduler(1.0 / rate, sleep=time.sleep)
+    probeTopic = topicField(f"{PROBE_TOPIC}/{index}")
+    base = index * COUNTERS
+    nextStatus = nextConfig = nextProbe = 0.0
+    stalled = 0.0
+    try:
+        while not stop.is_set():
+            now = time.time()
+            status, config = now >= nextStatus, now >= nextConfig
+            if status:
+                nextStatus = now + STATUS_INTERVAL
+            if config:
+                nextConfig = now + CONFIG_INTERVAL
+            buffer = bytearray()
+            count = 0
+            for box in simulated:
+                count += box.write(buffer, now, status, config)
+            if now >= nextProbe:
+                appendPublish(buffer, probeTopic, repr(time.time()).encode())
+                nextProbe = now + PROBE_INTERVAL
+
+            sendStart = time.perf_counter()
+            writer.send(buffer)
+            stalled += time.perf_counter() - sendStart
+            counters[base + STALLED_MS] = int(stalled * 1000)
+            counters[base + MESSAGES] += count
+            counters[base + BYTES] += len(buffer)
+            counters[base + SKIPPED] += scheduler.wait()
     except KeyboardInterrupt:
-        client.disconnect()
-    except Exception as e:
-        print("An unexpected error occurred: " + str(e))
+        pass
+    except ConnectionError as e:
+        print(f"Worker {index} lost the broker: {e}")
+    writer.close()
+
+"""
+Subscribes to the workers' probes and collects their delay, in seconds.
+"""
+class LagProbe:
+    def __init__(self):
+        self.lag = RollingHistogram(LAG_BUCKETS, window=1000)
+        self.worst = 0.0
+        self.received = 0
+        self.client = mqtt.Client()
+        self.client.on_message = self.onMessage
+        self.client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+        self.client.subscribe(f"{PROBE_TOPIC}/#", 0)
+        self.client.loop_start()
+
+    def onMessage(self, client, userdata, message):
+        try:
+            lag = time.time() - float(message.payload)
+        except ValueError:
+            # Not a probe, fe. a retained message of something else
+            return
+        self.lag.add(lag)
+        self.worst = max(self.worst, lag)
+        self.received += 1
+
+    def summary(self) -> str:
+        if not self.received:
+            return "broker lag: no probes back yet"
+        return f"broker lag {self.lag.summary()} worst={self.worst * 1e3:.2f}ms"
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+"""
+Returns the sum of one of the workers' counters.
+"""
+def total(counters, workers: int, counter: int) -> int:
+    return sum(counters[i * COUNTERS + counter] for i in range(workers))
 
 if __name__ == "__main__":
-    client.on_connect = onConnect
-    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 0)
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error(f"Non-positive rate: {args.rate}")
+    boxes = boxIDs(args.boxes, args.prefix)
+    shards = shardBoxes(boxes, max(args.workers, 1))
+    perTick = 4 if args.binary else 5
+    target = len(boxes) * args.rate * perTick + len(boxes) * (1.0 / STATUS_INTERVAL + 1.0 / CONFIG_INTERVAL)
 
-    client.loop_start()
-    controlLoop()
+    probe = LagProbe()
+    context = multiprocessing.get_context("fork")
+    counters = context.Array("Q", len(shards) * COUNTERS, lock=False)
+    stop = context.Event()
+    workers = [context.Process(target=runWorker, args=(i, shard, args.rate, args.binary, args.seed, counters, stop), daemon=True) for i, shard in enumerate(shards)]
+    for worker in workers:
+        worker.start()
+    print(f"Publishing {len(boxes)} boxes at {args.rate:g} Hz with {len(workers)} workers, {target:.0f} msgs/s . . . ")
+
+    start = lastReport = time.monotonic()
+    lastMessages = lastBytes = 0
+    try:
+        while args.duration <= 0 or time.monotonic() - start < args.duration:
+            time.sleep(min(REPORT_INTERVAL, args.duration - (time.monotonic() - start)) if args.duration > 0 else REPORT_INTERVAL)
+            now = time.monotonic()
+            messages, sent = total(counters, len(shards), MESSAGES), total(counters, len(shards), BYTES)
+            elapsed = max(now - lastReport, 1e-9)
+            print(f"Load :: {(messages - lastMessages) / elapsed:.0f} msgs/s of {target:.0f}, {(sent - lastBytes) / elapsed / 1e6:.2f} MB/s, "
+                f"skipped ticks={total(counters, len(shards), SKIPPED)} stalled={total(counters, len(shards), STALLED_MS)}ms, {probe.summary()}")
+            lastReport, lastMessages, lastBytes = now, messages, sent
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for worker in workers:
+        worker.join(5.0)
+    elapsed = time.monotonic() - start
+    messages = total(counters, len(shards), MESSAGES)
+    print(f"Load :: {messages} messages in {elapsed:.1f} s, {messages / elapsed:.0f} msgs/s of {target:.0f}, {probe.summary()}")
+    probe.close()
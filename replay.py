@@ -0,0 +1,213 @@
+import os
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+import paho.mqtt.client as mqtt
+from loopScheduler import RollingHistogram, LAG_BUCKETS
+from telemetryQuery import TelemetryStore, TELEMETRY_DIR
+from metrics import lengthOf
+
+load_dotenv()
+
+'''
+Replays a recorded session, see telemetryRecorder.py, onto the broker: to reproduce an incident, or to load the
+display, the fleet dashboard and the recorder with real data. Only what the sensors and the motor published is recorded,
+not the configs and commands sent to the motor, so a replay loads the subscribers of the 'out' topics, not the motor controllers.
+
+Every recorded sample is published as text on its series' 'out' topic, the way the sensors and the motor publish
+them; fe. 'box01/inflow01/inflowRate/out' or 'box01/motor/speed/out/'. Samples recorded from speed frames or binary
+messages come out as single text messages too. The samples of all the series are merged in time order, so the
+timing between the sensors is kept:
+- at '--speed 1' a sample is published as long after the first one as it was recorded, at 'N' N times sooner
+- at '--speed max' as fast as the client takes them
+The recording is read CHUNK_SECONDS at a time through telemetryQuery.py, so its length doesn't matter.
+
+'--rewrite box01=box07,box08' publishes box01's samples as box07 and as box08, and '--copies N' every box as
+'<box>-1' to '<box>-N', so that one recording simulates many boxes.
+
+Every REPLAY_REPORT_INTERVAL seconds the replay prints its publish rate and its lag: how late each sample went out
+compared to its schedule. When the client holds more than REPLAY_MAX_QUEUED unsent packets, the replay waits for it.
+'''
+
+# Parameters for the MQTT broker
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT"))
+
+CHUNK_SECONDS = 10.0 # recorded seconds read and merged at a time
+REPORT_INTERVAL = float(os.getenv("REPLAY_REPORT_INTERVAL", "5.0"))     # seconds between the rate reports
+MAX_QUEUED = int(os.getenv("REPLAY_MAX_QUEUED", "10000"))               # unsent packets the client may hold before the replay waits
+
+parser = argparse.ArgumentParser(description="Publishes a recorded session onto the broker with its original timing.")
+parser.add_argument("-d", "--directory", default=TELEMETRY_DIR, help="The recording. Defaults to TELEMETRY_DIR.")
+parser.add_argument("-b", "--boxes", nargs="+", help="The recorded boxes to replay. Defaults to all of them.")
+parser.add_argument("-s", "--speed", default="1", help="How many times faster than recorded, or 'max'. Defaults to 1.")
+parser.add_argument("--start", type=float, default=0.0, help="Seconds into the recording to start from.")
+parser.add_argument("--duration", type=float, default=0.0, help="Recorded seconds to replay, 0 for the rest of the recording.")
+parser.add_argument("-r", "--rewrite", action="append", default=[], help="'box01=box07,box08' publishes box01 as box07 and box08. Can be repeated.")
+parser.add_argument("-c", "--copies", type=int, default=0, help="Publishes every box as '<box>-1' to '<box>-N' instead.")
+parser.add_argument("-q", "--qos", type=int, default=0, choices=(0, 1), help="QoS of the messages. Defaults to 0.")
+
+"""
+Returns the speed-up of a '--speed' argument; infinite for 'max'.
+"""
+def parseSpeed(text: str) -> float:
+    if text == "max":
+        return float("inf")
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError(f"Non-positive replay speed: {text}")
+    return speed
+
+"""
+Returns the boxes each recorded box is published as, from the '--rewrite' and '--copies' arguments.
+"""
+def targetBoxes(boxes: list, rewrites: list, copies: int) -> dict:
+    targets = {box: [f"{box}-{i}" for i in range(1, copies + 1)] if copies > 0 else [box] for box in boxes}
+    for rewrite in rewrites:
+        source, _, names = rewrite.partition("=")
+        if source not in targets or not names:
+            raise ValueError(f"Invalid rewrite, or a box that isn't replayed: {rewrite}")
+        targets[source] = names.split(",")
+    return targets
+
+"""
+Returns the topic a series' samples are published on as the given box; the motor's topics end with a '/'.
+"""
+def topicOf(series: str, box: str) -> str:
+    _, sensor, dataType = series.split("/")
+    return f"{box}/{sensor}/{dataType}/out{'/' if sensor == 'motor' else ''}"
+
+class Replay:
+    def __init__(self, store: TelemetryStore, targets: dict, client, speed: float = 1.0, qos: int = 0):
+        self.store = store
+        self.client = client
+        self.speed = speed
+        self.qos = qos
+        self.series = []
+        for box in sorted(targets):
+            self.series.extend(store.find(box))
+        self.topics = [[topicOf(series, box) for box in targets[series.split("/")[0]]] for series in self.series]
+        self.published = 0
+        self.waits = 0          # times the replay waited for the client to catch up
+        self.lag = RollingHistogram(LAG_BUCKETS, window=10000)
+        self.maxLag = 0.0
+        self.elapsed = 0.0      # wall-clock seconds run() has been publishing, so far if it was interrupted
+        self.replayed = 0.0     # recorded seconds it has published
+
+    """
+    Returns the times of the first and the last sample of the replayed series.
+    """
+    def span(self) -> tuple:
+        spans = [span for span in map(self.store.span, self.series) if span is not None]
+        if not spans:
+            raise ValueError("Nothing recorded of the boxes")
+        return min(first for first, _ in spans), max(last for _, last in spans)
+
+    """
+    Returns the samples of every series from 'start' up to 'end', merged in time order, as times, series indexes and values.
+    """
+    def chunk(self, start: float, end: float) -> tuple:
+        samples = [self.store.raw(series, start, end) for series in self.series]
+        times = np.concatenate([chunk["time"] for chunk in samples])
+        indexes = np.concatenate([np.full(len(chunk), i, dtype=np.int32) for i, chunk in enumerate(samples)])
+        values = np.concatenate([chunk["value"] for chunk in samples])
+        order = np.argsort(times, kind="stable")
+        return times[order], indexes[order], values[order]
+
+    """
+    Publishes the samples recorded from 'start' up to 'end', on the schedule. Returns the wall-clock seconds it took;
+    'elapsed' and 'replayed' hold how far it got also when it's interrupted, fe. by Ctrl-C.
+    """
+    def run(self, start: float, end: float) -> float:
+        publish = self.client.publish
+        wallStart = time.monotonic()
+        lastReport = wallStart
+        lastPublished = 0
+        nextCheck = self.published
+        timestamp = start
+        try:
+            for chunkStart in np.arange(start, end, CHUNK_SECONDS):
+                times, indexes, values = self.chunk(chunkStart, min(chunkStart + CHUNK_SECONDS, end))
+                for timestamp, index, value in zip(times.tolist(), indexes.tolist(), values.tolist()):
+                    now = time.monotonic()
+                    if self.speed != float("inf"):
+                        due = wallStart + (timestamp - start) / self.speed
+                        if due > now:
+                            time.sleep(due - now)
+                            now = time.monotonic()
+                        self.lag.add(now - due)
+                        self.maxLag = max(self.maxLag, now - due)
+                    payload = str(value)
+                    for topic in self.topics[index]:
+                        publish(topic, payload, self.qos)
+                    self.published += len(self.topics[index])
+                    if self.published >= nextCheck:
+                        self.throttle()
+                        nextCheck = self.published + 1000
+                    if now - lastReport >= REPORT_INTERVAL:
+                        print(f"Replay :: {(self.published - lastPublished) / (now - lastReport):.0f} msgs/s at {timestamp - start:.1f} s of {end - start:.1f} s, {self.summary()}")
+                        lastReport, lastPublished = now, self.published
+        finally:
+            self.elapsed = time.monotonic() - wallStart
+            self.replayed = timestamp - start
+        return self.elapsed
+
+    """
+    Waits while the client holds more than MAX_QUEUED unsent packets.
+    """
+    def throttle(self):
+        while lengthOf(self.client, "_out_packet") > MAX_QUEUED:
+            self.waits += 1
+            time.sleep(0.001)
+
+    """
+    Waits up to 'timeout' seconds for the client to send everything. Returns True if it did.
+    """
+    def drain(self, timeout: float = 10.0) -> bool:
+        end = time.monotonic() + timeout
+        while lengthOf(self.client, "_out_packet") + lengthOf(self.client, "_out_messages") > 0:
+            if time.monotonic() >= end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def summary(self) -> str:
+        lag = f"lag {self.lag.summary()} worst={self.maxLag * 1e3:.2f}ms" if self.speed != float("inf") else "no schedule"
+        return f"published={self.published} {lag} waits={self.waits} queued={lengthOf(self.client, '_out_packet')}"
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    store = TelemetryStore(args.directory)
+    boxes = args.boxes or sorted({series.split("/")[0] for series in store.find()})
+    try:
+        speed = parseSpeed(args.speed)
+        targets = targetBoxes(boxes, args.rewrite, args.copies)
+    except ValueError as e:
+        parser.error(str(e))
+
+    client = mqtt.Client()
+    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+    client.loop_start()
+    replay = Replay(store, targets, client, speed, args.qos)
+    try:
+        first, last = replay.span()
+    except ValueError as e:
+        parser.error(str(e))
+    start = first + args.start
+    end = min(start + args.duration, last) if args.duration > 0 else last
+    # The last sample is at 'last'; the range excludes its end
+    end = np.nextafter(end, np.inf)
+    print(f"Replaying {len(replay.series)} series of {', '.join(boxes)}, {end - start:.1f} s {'as fast as possible' if speed == float('inf') else f'at {speed:g}x'}, as {sum(len(names) for names in targets.values())} boxes . . . ")
+
+    try:
+        replay.run(start, end)
+    except KeyboardInterrupt:
+        pass
+    drained = replay.drain()
+    client.disconnect()
+    client.loop_stop()
+    store.close()
+    elapsed = replay.elapsed
+    rate = replay.published / elapsed if elapsed > 0 else 0.0
+    print(f"Replay :: {rate:.0f} msgs/s over {elapsed:.1f} s, {replay.replayed:.1f} s of {end - start:.1f} s at {replay.replayed / elapsed if elapsed > 0 else 0.0:.1f}x, {replay.summary()}{'' if drained else ', not all sent'}")
@@ -0,0 +1,66 @@
+import numpy as np
+
+'''
+Fixed size history of samples for the graphs.
+
+Every value is written twice, at i and i + capacity, so the samples in order from oldest to newest
+are always one contiguous slice of the array. Appending is O(1) and view() is a slice, not a copy.
+'''
+
+"""
+A ring buffer of the last 'capacity' values, backed by a NumPy array.
+"""
+class RingBuffer:
+    def __init__(self, capacity: int, dtype=np.float64):
+        if capacity <= 0:
+            raise ValueError(f"Non-positive ring buffer capacity: {capacity}")
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.index = 0      # where the next value goes, 0..capacity-1
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, value):
+        index = self.index
+        self.data[index] = value
+        self.data[index + self.capacity] = value
+        self.index = index + 1 if index + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    """
+    Appends many values at once. Only the last 'capacity' of them are kept.
+    """
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)[-self.capacity:]
+        count = len(values)
+        if count == 0:
+            return
+        # Up to the end of the ring, then the rest from its beginning
+        first = min(count, self.capacity - self.index)
+        for start, chunk in ((self.index, values[:first]), (0, values[first:])):
+            self.data[start:start + len(chunk)] = chunk
+            self.data[start + self.capacity:start + self.capacity + len(chunk)] = chunk
+        self.index = (self.index + count) % self.capacity
+        self.count = min(self.capacity, self.count + count)
+
+    """
+    Returns the values from oldest to newest. The result shares memory with the buffer, so it changes with the next append.
+    """
+    def view(self) -> np.ndarray:
+        end = self.index + self.capacity
+        return self.data[end - self.count:end]
+
+    """
+    Returns the newest value, or None if the buffer is empty.
+    """
+    def last(self):
+        if self.count == 0:
+            return None
+        return self.data[self.index + self.capacity - 1]
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
@@ -0,0 +1,167 @@
+import os
+import time
+import argparse
+import selectors
+import serial
+import psutil
+import paho.mqtt.client as mqtt
+
+from flowDPSensors import publishFlow, publishDP, getOperatingMode, onConnect, monotonicTime, stamper, SERIAL_READ_SECTION, MQTT_BROKER_HOST, MQTT_BROKER_PORT, SAMPLE_RATE, STATS_INTERVAL
+from serialStream import SerialLineReader, StreamStats, registerStreamMetrics
+from metrics import instrumentClient, startMetrics
+import profiling
+
+"""
+Services all the flow and differential pressure sensors of a box from one process.
+
+Instead of one 'flowDPSensors.py' process per serial port, each with its own interpreter, MQTT client and network thread,
+every port is opened non-blocking and read from a single selector loop, and everything is published through one MQTT connection.
+Sensors stream by default; with '--poll' each one is sent a request every MQTT_SENSOR_SAMPLERATE seconds and the replies
+are read whenever they arrive, so a slow sensor never holds up the others.
+"""
+
+parser = argparse.ArgumentParser(description="Runs all the flow and differential pressure sensors of a box in one process.")
+parser.add_argument("-bi", type=str, required=True, help="The box's ID. Name this based on the box; fe: 'box01'")
+parser.add_argument("-s", "--sensor", action="append", required=True, metavar="ID:PORT:MODE", help="A sensor as 'sensorID:port:mode', mode being 'fi', 'fo' or 'dp'; fe: 'inflow01:/dev/ttyUSB0:fi'. Repeat for every sensor.")
+parser.add_argument("--poll", action="store_true", help="Request every sample instead of letting the sensors stream.")
+profiling.addArguments(parser)
+parser.add_argument("-mp", "--metrics-port", type=int, default=int(os.getenv("SENSOR_METRICS_PORT", "9103")), help="Port of the metrics endpoint, see metrics.py; 0 disables it.")
+
+"""
+One serial port and what's needed to publish its samples.
+"""
+class Sensor:
+   def __init__(self, sensorID, port, mode, boxID):
+      self.sensorID = sensorID
+      self.port = port
+      self.operatingMode, self.channel = getOperatingMode(boxID, sensorID, mode)
+      self.diffMode = self.operatingMode == "diffMode"
+      self.publish = publishDP if self.diffMode else publishFlow
+      self.stats = StreamStats()
+      registerStreamMetrics(self.stats, sensorID)
+      self.serial = None
+      self.reader = None
+
+   def open(self):
+      # timeout=0 makes reads return immediately with whatever has arrived
+      self.serial = serial.Serial(self.port, 115200, timeout=0)
+      self.reader = SerialLineReader(self.serial, self.stats)
+
+   """
+   Puts the sensor into continuous mode: 1 for the flow sensor, 3 for the differential pressure sensor.
+   """
+   def start(self):
+      self.serial.flushInput()
+      self.serial.write(("3" if self.diffMode else "1").encode())
+      self.serial.flush()
+      self.serial.flushInput()
+
+   def request(self):
+      self.serial.write(("d" if self.diffMode else "f").encode())
+
+   """
+   Reads what has arrived and publishes the complete lines.
+   """
+   def service(self, client):
+      with SERIAL_READ_SECTION:
+         chunk = self.serial.read(self.serial.in_waiting or 1)
+      if not chunk:
+         return
+      self.stats.bytesRead += len(chunk)
+      for line, readTime in self.reader.feed(chunk, time.perf_counter()):
+         if self.publish(client, self.channel, line, monotonicTime(readTime) if stamper is not None else None):
+            self.stats.samples += 1
+            self.stats.latency.add(time.perf_counter() - readTime)
+         else:
+            self.stats.garbled += 1
+
+"""
+Parses the '-s' arguments into Sensors.
+"""
+def parseSensors(entries, boxID) -> list:
+   sensors = []
+   for entry in entries:
+      # The port may contain ':' (fe. on Windows), so split the ID from the front and the mode from the back
+      sensorID, _, rest = entry.partition(":")
+      port, _, mode = rest.rpartition(":")
+      if not sensorID or not port or mode not in ("fi", "fo", "dp"):
+         raise ValueError(f"Invalid sensor '{entry}', expected 'sensorID:port:mode'")
+      sensors.append(Sensor(sensorID, port, mode, boxID))
+   return sensors
+
+"""
+Memory use of this process compared with running every sensor in its own process.
+'baseline' is this process' resident memory before any port was opened, which is about what each separate process would use.
+"""
+def memoryReport(baseline: int, sensorCount: int) -> str:
+   current = psutil.Process().memory_info().rss
+   separate = baseline * sensorCount
+   return f"RSS {current / 2**20:.1f} MiB for {sensorCount} sensors, about {separate / 2**20:.1f} MiB as separate processes, {(separate - current) / 2**20:.1f} MiB saved"
+
+"""
+The event loop: waits on all the ports at once and services those with data.
+In poll mode the wait is cut short whenever it's time to send the next round of requests.
+"""
+def run(sensors, client, poll: bool, baseline: int):
+   selector = selectors.DefaultSelector()
+   for sensor in sensors:
+      selector.register(sensor.serial.fileno(), selectors.EVENT_READ, sensor)
+
+   nextRequest = time.monotonic()
+   nextReport = time.monotonic() + STATS_INTERVAL
+   while True:
+      now = time.monotonic()
+      if poll and now >= nextRequest:
+         for sensor in sensors:
+            sensor.request()
+         nextRequest += SAMPLE_RATE
+         if nextRequest < now:
+            nextRequest = now + SAMPLE_RATE
+
+      timeout = 1.0
+      if poll:
+         timeout = min(timeout, max(0.0, nextRequest - now))
+      for key, _ in selector.select(timeout):
+         key.data.service(client)
+
+      if STATS_INTERVAL > 0 and time.monotonic() >= nextReport:
+         nextReport += STATS_INTERVAL
+         for sensor in sensors:
+            print(f"{sensor.sensorID} :: {sensor.stats.report()}")
+         print(memoryReport(baseline, len(sensors)))
+
+if __name__ == "__main__":
+   args = parser.parse_args()
+   profiling.start("acquisitionDaemon")
+   sensors = parseSensors(args.sensor, args.bi)
+   baseline = psutil.Process().memory_info().rss
+
+   client = instrumentClient(mqtt.Client())
+   client.on_connect = onConnect
+   client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, keepalive=60, bind_address="")
+   client.loop_start()
+   startMetrics(client, args.bi, "sensors", args.metrics_port)
+
+   for sensor in sensors:
+      print(f"Connecting to {sensor.sensorID} on {sensor.port}, publishing to {sensor.channel}")
+      sensor.open()
+
+   # Give them a few seconds to set themselves up, all at once
+   time.sleep(2)
+
+   for sensor in sensors:
+      sensor.start()
+
+   print("Running . . . ")
+   try:
+      run(sensors, client, args.poll, baseline)
+   except KeyboardInterrupt:
+      client.disconnect()
+   except Exception as error:
+      print(f"Something went wrong :: {error}")
+
+   print("Shutting down")
+   for sensor in sensors:
+      print(f"{sensor.sensorID} :: {sensor.stats.report()}")
+      sensor.serial.close()
+   print(memoryReport(baseline, len(sensors)))
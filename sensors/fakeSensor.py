@@ -0,0 +1,78 @@
+import os
+import tty
+import math
+import time
+import random
+import select
+import fcntl
+import argparse
+
+"""
+A fake flow or differential pressure sensor on a pseudo terminal, for running 'flowDPSensors.py' without an Arduino.
+Prints the path of the terminal; give that to 'flowDPSensors.py' as the port ('-cp').
+
+In request mode the fake answers every 'f' or 'd' it receives with one sample, like the real sensor.
+With '--stream' it pushes samples at the given rate after it has been put into continuous mode ('1' or '3').
+"""
+
+parser = argparse.ArgumentParser(description="A fake flow or differential pressure sensor on a pseudo terminal.")
+parser.add_argument("-m", choices=["flow", "dp"], default="flow", help="Which sensor to fake: 'flow' for a flow sensor, 'dp' for a differential pressure sensor.")
+parser.add_argument("-s", "--stream", action="store_true", help="Push samples continuously instead of answering requests.")
+parser.add_argument("-r", "--rate", type=float, default=100.0, help="Samples per second in streaming mode.")
+parser.add_argument("-g", "--garble", type=float, default=0.0, help="Fraction of samples replaced with garbage, 0..1.")
+parser.add_argument("-p", "--period", type=float, default=4.0, help="Period of the simulated breathing, in seconds.")
+
+"""
+Returns one sample line of the sensor at time t, in the format the Arduinos send.
+"""
+def sampleLine(mode: str, t: float, garble: float) -> bytes:
+   if garble > 0 and random.random() < garble:
+      return random.choice([b"E(): checksum\r\n", b"#\xff\x00garbage\r\n", b"1.2.3,\r\n"])
+   breath = math.sin(2 * math.pi * t / args.period)
+   if mode == "flow":
+      return f"{breath * 120.0:.2f},\r\n".encode()
+   return f"{breath * 60.0:.2f},{22.5 + breath * 0.5:.2f}\r\n".encode()
+
+if __name__ == "__main__":
+   args = parser.parse_args()
+
+   master, slave = os.openpty()
+   tty.setraw(slave)
+   # Like the real serial line, samples are lost rather than held back when nobody reads them
+   fcntl.fcntl(master, fcntl.F_SETFL, fcntl.fcntl(master, fcntl.F_GETFL) | os.O_NONBLOCK)
+   print(f"Fake {args.m} sensor on :: {os.ttyname(slave)}", flush=True)
+
+   streaming = False
+   interval = 1.0 / args.rate
+   nextSample = time.monotonic()
+   sent = 0
+   lost = 0
+   try:
+      while True:
+         timeout = max(0.0, nextSample - time.monotonic()) if streaming else None
+         readable, _, _ = select.select([master], [], [], timeout)
+         if readable:
+            try:
+               requests = os.read(master, 64)
+            except BlockingIOError:
+               requests = b""
+            for request in requests:
+               request = chr(request)
+               if request in "13" and args.stream:
+                  streaming = True
+                  nextSample = time.monotonic()
+               elif request in "fd" and not streaming:
+                  os.write(master, sampleLine(args.m, time.monotonic(), args.garble))
+                  sent += 1
+
+         if streaming and time.monotonic() >= nextSample:
+            try:
+               os.write(master, sampleLine(args.m, time.monotonic(), args.garble))
+               sent += 1
+            except BlockingIOError:
+               lost += 1
+            nextSample += interval
+   except KeyboardInterrupt:
+      print(f"Sent {sent} samples, {lost} lost")
+   except OSError as error:
+      print(f"Terminal closed :: {error}")
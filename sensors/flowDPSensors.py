@@ -6,6 +6,15 @@ import argparse
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
 
+# The shared modules are in the project's root directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wireCodec import encodeFlow, encodeDPTemp, binaryTopic
+from serialStream import SerialLineReader, StreamStats, registerStreamMetrics
+from tracing import TRACE_ENABLED, TraceStamper
+from metrics import instrumentClient, startMetrics
+import profiling
+from consoleLog import console
+
 load_dotenv()
 
 # Parameters for the MQTT broker
@@ -16,6 +25,16 @@ MQTT_TOPIC_SENSOR_OUTFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_OUTFLOW_OUT")
 MQTT_TOPIC_SENSOR_DP_OUT = os.getenv("MQTT_TOPIC_SENSOR_DP_OUT")
 MQTT_TOPIC_SENSOR_TEMP_OUT =os.getenv("MQTT_TOPIC_SENSOR_TEMP_OUT")
 SAMPLE_RATE = float(os.getenv("MQTT_SENSOR_SAMPLERATE"))
+WIRE_BINARY = os.getenv("MQTT_WIRE_FORMAT", "csv") == "binary"
+STATS_INTERVAL = float(os.getenv("SENSOR_STATS_INTERVAL", "10.0"))
+
+# Latency tracing of the samples, see tracing.py
+stamper = TraceStamper() if TRACE_ENABLED else None
+
+# Hot-path sections, see profiling.py
+SERIAL_READ_SECTION = profiling.section("serial read")
+PARSE_SECTION = profiling.section("parse")
+PUBLISH_SECTION = profiling.section("publish")
 
 # These likely should be parameters given when the program is run. Otherwise maybe assume a default value?
 #boxID = os.getenv("BOX_ID")
@@ -26,27 +45,36 @@ parser.add_argument("-si", type=str, required=True, help="The sensor's ID. The c
 parser.add_argument("-bi", type=str, required=True, help="The box's ID. The channel this sensor posts on will depend on this name. Name this based on the box; fe: 'box01'")
 parser.add_argument("-cp", type=str, required=True, help="The USB port. Check which port this sensor is attached to, so that it knows where to get the right data from; fe: '/dev/ttyUSB0'. Note that it may be 'ACM0' as well. Check using 'dmesg -w' before use.")
 parser.add_argument("-m", choices=["fi", "fo", "dp"], required=True, help="Specify an operating mode for the sensor: 'fi' for inflow; 'fo' for outflow; 'dp' for indicating a differential pressure sensor.")
+parser.add_argument("-s", "--stream", action="store_true", help="Streaming mode: the sensor pushes samples continuously and they're read as they arrive, instead of requesting each sample. Requires firmware that streams in continuous mode.")
+profiling.addArguments(parser)
+parser.add_argument("-mp", "--metrics-port", type=int, default=0, help="Port of the metrics endpoint, see metrics.py. Every sensor process needs its own; 0, the default, disables it.")
 #parser.add_argument("-i", type=int, default=1, help="Something very helpful regarding integers, for sure.")
 
+"""
+Returns the operating mode and the channel the sensor publishes on, for a mode given as 'fi', 'fo' or 'dp'.
+"""
+def getOperatingMode(boxID, sensorID, mode):
+   if mode == "fo":
+      return "outflowMode", boxID+"/"+sensorID+MQTT_TOPIC_SENSOR_OUTFLOW_OUT
+   elif mode == "fi":
+      return "inflowMode", boxID+"/"+sensorID+MQTT_TOPIC_SENSOR_INFLOW_OUT
+   elif mode == "dp": 
+      return "diffMode", boxID+"/"+sensorID
+   raise ValueError(f"Unknown operating mode: {mode}")
+
 """
 Configures the sensor to run as indicated by the arguments given.
 """
 def setup():
-   global boxID, sensorID, channel, sensorSerialPort, operatingMode
+   global boxID, sensorID, channel, sensorSerialPort, operatingMode, streaming, metricsPort
    
    args = parser.parse_args()
+   streaming = args.stream
+   metricsPort = args.metrics_port
    boxID = args.bi
    sensorID = args.si
    print("Configuring operating modes . . .")
-   if args.m == "fo":
-      operatingMode = "outflowMode"
-      channel = boxID+"/"+sensorID+MQTT_TOPIC_SENSOR_OUTFLOW_OUT
-   elif args.m == "fi":
-      operatingMode = "inflowMode"
-      channel = boxID+"/"+sensorID+MQTT_TOPIC_SENSOR_INFLOW_OUT
-   elif args.m == "dp": 
-      operatingMode = "diffMode"
-      channel = boxID+"/"+sensorID
+   operatingMode, channel = getOperatingMode(boxID, sensorID, args.m)
    
    print(f"{operatingMode} set.")
    
@@ -58,7 +86,7 @@ def setup():
    sensorSerialPort = args.cp
 
    # Print configuration
-   print(f"Box ID :: {boxID}\nSensor ID :: {sensorID}\nSensor Port :: {sensorSerialPort}\nOperating mode :: {operatingMode}\nPublishing to channel :: {channel}")
+   print(f"Box ID :: {boxID}\nSensor ID :: {sensorID}\nSensor Port :: {sensorSerialPort}\nOperating mode :: {operatingMode}\nPublishing to channel :: {channel}\nStreaming :: {streaming}")
 
 # Process Messages
 def onConnect(client, metadata, flags, rc):
@@ -74,99 +102,192 @@ def onDisconnect(client, metadata, flags, rc):
 def publishError(message):
    client.publish(f"ERROR :: {message}")
 
-def publishFlow(client, channel, value):
+"""
+Converts a time.perf_counter() timestamp, like the read times of SerialLineReader, to time.monotonic() for the trace.
+"""
+def monotonicTime(perfCounterTime: float) -> float:
+   return time.monotonic() - (time.perf_counter() - perfCounterTime)
+
+"""
+Publishes a flow sensor line. Returns True if it was published, False if it was an error or couldn't be parsed.
+The lines about it go through the console, rate-limited per topic; see consoleLog.py.
+With MQTT_TRACE the sample's trace follows it, 'captured' being the time.monotonic() when the line was read.
+"""
+def publishFlow(client, channel, value, captured=None):
    try:
-      data = value.decode("UTF-8").strip()
-      if "Error" in data or "E():" in data:
-         print(f"Data contains an error. Ignoring it. {data}")    
+      with PARSE_SECTION:
+         data = value.decode("UTF-8").strip()
+         error = "Error" in data or "E():" in data
+         flowrate = data[0:-1]
+         if not error:
+            # Has to be a number, a line cut in half or scrambled on the wire isn't published
+            rate = float(flowrate)
+      if error:
+         console.sample(channel + " error", "Data contains an error. Ignoring it. {}", data)    
+         return False
       else:
-         flowrate = data[0:-1]  
-         print(f"Publishing '{flowrate}' to '{channel}'")
-         client.publish(channel, flowrate)
+         with PUBLISH_SECTION:
+            if WIRE_BINARY:
+               topic = binaryTopic(channel)
+               console.sample(topic, "Publishing '{}' to '{}'", flowrate, topic)
+               client.publish(topic, encodeFlow(rate))
+            else:
+               topic = channel
+               console.sample(topic, "Publishing '{}' to '{}'", flowrate, topic)
+               client.publish(topic, flowrate)
+            if stamper is not None:
+               stamper.publish(client, topic, captured)
+         return True
    except Exception as error:
-      print(f"Something went wrong :: {error}")
+      console.sample(channel + " error", "Something went wrong :: {}", error)
+      return False
 
-def publishDP(client, channel, value):
+"""
+Publishes a differential pressure sensor line of pressure and temperature. Returns True if it was published.
+The trace, with MQTT_TRACE, is on the pressure's topic.
+"""
+def publishDP(client, channel, value, captured=None):
    dpChannel = channel+MQTT_TOPIC_SENSOR_DP_OUT
    tempChannel = channel+MQTT_TOPIC_SENSOR_TEMP_OUT
 
    try:
-      data = value.decode("UTF-8").split(",")
+      with PARSE_SECTION:
+         data = value.decode("UTF-8").split(",")
+         if len(data) >= 2:
+            pressure = str(data[0]).strip()
+            temp = str(data[1]).strip()
+            # Both have to be numbers, a line cut in half or scrambled on the wire isn't published
+            float(pressure), float(temp)
       
       if len(data) >= 2:
-         pressure = str(data[0]).strip()
-         temp = str(data[1]).strip()
-         
-         print(f"Publishing '{pressure}' to '{dpChannel}'")
-         client.publish(dpChannel, pressure)
-         print(f"Publishing '{temp}' to '{tempChannel}'")
-         client.publish(tempChannel, temp)
-   except Exception as error:
-      print(f"Something went wrong :: {error}")
+         with PUBLISH_SECTION:
+            if WIRE_BINARY:
+               # Pressure and temperature travel together in one binary message
+               console.sample(dpChannel, "Publishing '{},{}' to '{}'", pressure, temp, binaryTopic(dpChannel))
+               client.publish(binaryTopic(dpChannel), encodeDPTemp(float(pressure), float(temp)))
+               if stamper is not None:
+                  stamper.publish(client, binaryTopic(dpChannel), captured)
+               return True
 
-# Run starts here
-setup()
+            console.sample(dpChannel, "Publishing '{}' to '{}'", pressure, dpChannel)
+            client.publish(dpChannel, pressure)
+            console.sample(tempChannel, "Publishing '{}' to '{}'", temp, tempChannel)
+            client.publish(tempChannel, temp)
+            if stamper is not None:
+               stamper.publish(client, dpChannel, captured)
+         return True
+   except Exception as error:
+      console.sample(channel + " error", "Something went wrong :: {}", error)
+   return False
 
 """
-===Ventilator Test Code===
-Flow rate in SLM (standard litre per minute)
-Differential pressure in Pascals,  1atm = 101Pa. 1cmH20 = 98 Pa, typical CPAP range 4-20
-Temperature in Celcius
+Streaming mode: publishes every line the sensor pushes, as soon as it has been read.
+No requests are written and the port is never flushed, so samples that have already arrived aren't lost.
 """
-client = mqtt.Client()
-client.on_connect = onConnect
-client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, keepalive=60, bind_address="")
-client.loop_start()
+def streamSamples(sensor, client, channel, publish, stats=None):
+   stats = stats or StreamStats()
+   reader = SerialLineReader(sensor, stats)
+   while True:
+      with SERIAL_READ_SECTION:
+         lines = reader.readLines()
+      for line, readTime in lines:
+         if publish(client, channel, line, monotonicTime(readTime) if stamper is not None else None):
+            stats.samples += 1
+            stats.latency.add(time.perf_counter() - readTime)
+         else:
+            stats.garbled += 1
+      if STATS_INTERVAL > 0 and time.monotonic() - stats.lastReport >= STATS_INTERVAL:
+         print(f"Stream :: {stats.report()}")
 
+# Run starts here; importing this module (fe. from acquisitionDaemon.py) only defines the functions
+if __name__ == "__main__":
+   setup()
+   profiling.start(f"flowDPSensors-{sensorID}")
 
-print("Connecting to sensor")
-sensor = serial.Serial(sensorSerialPort,115200,timeout=1)
-print(f"Serial connected \nPort :: {sensorSerialPort}, sensor :: {sensor}")
+   """
+   ===Ventilator Test Code===
+   Flow rate in SLM (standard litre per minute)
+   Differential pressure in Pascals,  1atm = 101Pa. 1cmH20 = 98 Pa, typical CPAP range 4-20
+   Temperature in Celcius
+   """
+   client = instrumentClient(mqtt.Client())
+   client.on_connect = onConnect
+   client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, keepalive=60, bind_address="")
+   client.loop_start()
 
-# Give it a few seconds to set itself up. No-wait results in consistent failures, as does a single second. 
-time.sleep(2)
+   stats = StreamStats()
+   registerStreamMetrics(stats, sensorID)
+   startMetrics(client, boxID, sensorID, metricsPort)
 
-sensor.flushInput()
-sensor.flushOutput()
 
-"""
-Flow rate into continuous mode, then DP into continuous mode.
-1 is for setting the flow sensor, 3 is for the differential pressure sensor
-"""
-print("Setting the sensors into continuous mode")
+   print("Connecting to sensor")
+   sensor = serial.Serial(sensorSerialPort,115200,timeout=1)
+   print(f"Serial connected \nPort :: {sensorSerialPort}, sensor :: {sensor}")
 
-if operatingMode == "inflowMode" or operatingMode == "outflowMode":
-   sensor.write("1".encode())
-elif operatingMode == "diffMode":
-   sensor.write("3".encode())
+   # Give it a few seconds to set itself up. No-wait results in consistent failures, as does a single second. 
+   time.sleep(2)
 
-print("Running . . . ")
+   sensor.flushInput()
+   sensor.flushOutput()
 
-sensor.flushInput()
-sensor.flushOutput()
-try: 
-   while True:
-      if operatingMode == "inflowMode" or operatingMode == "outflowMode":
-         # Requests the Flow sensor's data
-         sensor.write("f".encode())
-         publishFlow(client,channel,sensor.readline())
-
-         sensor.flushInput()
-         sensor.flushOutput()
-      elif operatingMode == "diffMode":
-         # Requests the DP sensor's data
-         sensor.write("d".encode())
-         publishDP(client,channel,sensor.readline())
-
-         sensor.flushInput()
-         sensor.flushOutput()
-      time.sleep(SAMPLE_RATE)
-except KeyboardInterrupt:
-   client.disconnect()
-except Exception as error:
-   print(f"Something went wrong :: {error}")
-
-print("Shutting down")
-
-sensor.flushInput()
-sensor.flushOutput()
\ No newline at end of file
+   """
+   Flow rate into continuous mode, then DP into continuous mode.
+   1 is for setting the flow sensor, 3 is for the differential pressure sensor
+   """
+   print("Setting the sensors into continuous mode")
+
+   if operatingMode == "inflowMode" or operatingMode == "outflowMode":
+      sensor.write("1".encode())
+   elif operatingMode == "diffMode":
+      sensor.write("3".encode())
+
+   print("Running . . . ")
+
+   if streaming:
+      # Let the mode command go out instead of discarding it, only drop what arrived before it
+      sensor.flush()
+      sensor.flushInput()
+   else:
+      sensor.flushInput()
+      sensor.flushOutput()
+   try: 
+      if streaming:
+         publish = publishDP if operatingMode == "diffMode" else publishFlow
+         streamSamples(sensor, client, channel, publish, stats)
+      while True:
+         if operatingMode == "inflowMode" or operatingMode == "outflowMode":
+            # Requests the Flow sensor's data
+            sensor.write("f".encode())
+            with SERIAL_READ_SECTION:
+               line = sensor.readline()
+            stats.bytesRead += len(line)
+            if publishFlow(client,channel,line,time.monotonic()):
+               stats.samples += 1
+            else:
+               stats.garbled += 1
+
+            sensor.flushInput()
+            sensor.flushOutput()
+         elif operatingMode == "diffMode":
+            # Requests the DP sensor's data
+            sensor.write("d".encode())
+            with SERIAL_READ_SECTION:
+               line = sensor.readline()
+            stats.bytesRead += len(line)
+            if publishDP(client,channel,line,time.monotonic()):
+               stats.samples += 1
+            else:
+               stats.garbled += 1
+
+            sensor.flushInput()
+            sensor.flushOutput()
+         time.sleep(SAMPLE_RATE)
+   except KeyboardInterrupt:
+      client.disconnect()
+   except Exception as error:
+      print(f"Something went wrong :: {error}")
+
+   print("Shutting down")
+
+   sensor.flushInput()
+   sensor.flushOutput()
\ No newline at end of file
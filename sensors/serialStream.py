@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+
+# The shared modules are in the project's root directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from loopScheduler import RollingHistogram
+from metrics import registry
+
+"""
+Counters of a streaming sensor: samples read, lines that couldn't be parsed, lines that were lost,
+and the time from reading a line to publishing it.
+"""
+class StreamStats:
+   def __init__(self, window=1000):
+      self.started = time.monotonic()
+      self.samples = 0
+      self.garbled = 0
+      self.dropped = 0
+      self.bytesRead = 0
+      self.latency = RollingHistogram(window=window)
+      self.lastReport = self.started
+      self.lastSamples = 0
+
+   def rate(self) -> float:
+      elapsed = time.monotonic() - self.started
+      return self.samples / elapsed if elapsed > 0 else 0.0
+
+   """
+   Returns the summary since the last call, with the sample rate over that interval.
+   """
+   def report(self) -> str:
+      now = time.monotonic()
+      interval = now - self.lastReport
+      rate = (self.samples - self.lastSamples) / interval if interval > 0 else 0.0
+      self.lastReport = now
+      self.lastSamples = self.samples
+      return f"{rate:.1f} samples/s, samples={self.samples} garbled={self.garbled} dropped={self.dropped} read-to-publish {self.latency.summary()}"
+
+"""
+Exposes a sensor's counters as metrics labelled with its ID, read from the stats when scraped; see metrics.py.
+Garbled and dropped lines are the serial read errors: a sensor error, a line cut short, or noise on the wire.
+"""
+def registerStreamMetrics(stats: StreamStats, sensorID: str, registry=registry):
+   labels = {"sensor": sensorID}
+   registry.counter("sensor_samples_total", "Samples read and published.", labels, function=lambda: stats.samples)
+   registry.counter("sensor_garbled_lines_total", "Lines that were errors or couldn't be parsed.", labels, function=lambda: stats.garbled)
+   registry.counter("sensor_dropped_lines_total", "Lines discarded as too long to be samples.", labels, function=lambda: stats.dropped)
+   registry.counter("sensor_read_bytes_total", "Bytes read from the serial port.", labels, function=lambda: stats.bytesRead)
+
+"""
+Reads the lines a sensor pushes continuously, without writing requests or flushing the port.
+Bytes are read in whatever chunks are available and split into lines incrementally,
+so nothing that has already arrived is thrown away.
+A line longer than 'maxLineLength' can't be a sample, it's discarded and counted as dropped.
+"""
+class SerialLineReader:
+   def __init__(self, port, stats: StreamStats = None, maxLineLength: int = 128):
+      self.port = port
+      self.stats = stats or StreamStats()
+      self.maxLineLength = maxLineLength
+      self.buffer = bytearray()
+      self.synced = False      # the first line is usually cut in half by the start of reading
+
+   """
+   Returns the complete lines read so far as (line, read time) pairs, the time being time.perf_counter() when the line's
+   last byte was read. Waits for at most the port's timeout if nothing is available.
+   """
+   def readLines(self) -> list:
+      chunk = self.port.read(max(1, self.port.in_waiting))
+      readTime = time.perf_counter()
+      if not chunk:
+         return []
+      self.stats.bytesRead += len(chunk)
+      return self.feed(chunk, readTime)
+
+   """
+   Adds bytes to the buffer and returns the lines they complete. Used directly when the bytes come from elsewhere, fe. a selector.
+   """
+   def feed(self, chunk: bytes, readTime: float) -> list:
+      self.buffer += chunk
+      lines = []
+      start = 0
+      while True:
+         end = self.buffer.find(b"\n", start)
+         if end < 0:
+            break
+         line = bytes(self.buffer[start:end + 1])
+         start = end + 1
+         if not self.synced:
+            self.synced = True
+            continue
+         if len(line) > self.maxLineLength:
+            self.stats.dropped += 1
+            continue
+         lines.append((line, readTime))
+      del self.buffer[:start]
+
+      if len(self.buffer) > self.maxLineLength:
+         # No line end in sight, the rest of this line is garbage
+         self.stats.dropped += 1
+         self.buffer.clear()
+         self.synced = False
+      return lines
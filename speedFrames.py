@@ -0,0 +1,90 @@
+import struct
+import sys
+from array import array
+
+'''
+Batched motor speed telemetry.
+
+Instead of one MQTT message per control loop tick, speed samples are collected into frames of
+N samples (or T milliseconds worth) and published as one binary payload:
+
+	version (uint8), start timestamp (float64, unix seconds), sample period (float32, seconds), sample count (uint16),
+	followed by the samples as uint16, all little-endian.
+
+The frame's samples are evenly spaced: sample i was taken at start + i * period.
+'''
+
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<BdfH")
+MAX_FRAME_SAMPLES = 0xFFFF
+
+"""
+Encodes speed samples into a frame payload.
+"""
+def encodeSpeedFrame(start: float, period: float, speeds) -> bytes:
+	samples = array("H", speeds)
+	if len(samples) > MAX_FRAME_SAMPLES:
+		raise ValueError(f"Too many samples for one frame: {len(samples)}")
+	if sys.byteorder != "little":
+		samples.byteswap()
+	return FRAME_HEADER.pack(FRAME_VERSION, start, period, len(samples)) + samples.tobytes()
+
+"""
+Decodes a frame payload. Returns (start timestamp, sample period, samples as an array of ints).
+Raises ValueError if the payload isn't a valid frame.
+"""
+def decodeSpeedFrame(payload: bytes) -> tuple:
+	if len(payload) < FRAME_HEADER.size:
+		raise ValueError(f"Speed frame too short: {len(payload)} bytes")
+	version, start, period, count = FRAME_HEADER.unpack_from(payload)
+	if version != FRAME_VERSION:
+		raise ValueError(f"Unsupported speed frame version: {version}")
+	if len(payload) != FRAME_HEADER.size + 2 * count:
+		raise ValueError(f"Speed frame length {len(payload)} doesn't match its {count} samples")
+	samples = array("H")
+	samples.frombytes(payload[FRAME_HEADER.size:])
+	if sys.byteorder != "little":
+		samples.byteswap()
+	return start, period, samples
+
+"""
+Collects speed samples taken every 'period' seconds into frames.
+A frame is completed when it holds 'maxSamples' samples or spans 'maxMillis' milliseconds, whichever comes first;
+either limit can be disabled with 0.
+"""
+class SpeedFrameBatcher:
+	def __init__(self, period: float, maxSamples: int = 0, maxMillis: float = 0):
+		if maxSamples <= 0 and maxMillis <= 0:
+			raise ValueError("A speed frame needs a sample or a time limit")
+		limits = [MAX_FRAME_SAMPLES]
+		if maxSamples > 0:
+			limits.append(maxSamples)
+		if maxMillis > 0:
+			limits.append(max(1, int(round(maxMillis / 1000.0 / period))))
+		self.period = period
+		self.frameSize = min(limits)
+		self.start = None
+		self.samples = []
+
+	"""
+	Adds a sample taken at 'timestamp'. Returns the payload of a completed frame, or None.
+	"""
+	def add(self, speed: int, timestamp: float):
+		if self.start is None:
+			self.start = timestamp
+		self.samples.append(speed)
+		if len(self.samples) >= self.frameSize:
+			return self.flush()
+		return None
+
+	"""
+	Completes the current frame early, fe. when the samples stop being evenly spaced.
+	Returns its payload, or None if there are no samples.
+	"""
+	def flush(self):
+		if not self.samples:
+			return None
+		payload = encodeSpeedFrame(self.start, self.period, self.samples)
+		self.start = None
+		self.samples = []
+		return payload
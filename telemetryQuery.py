@@ -0,0 +1,218 @@
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from telemetrySegments import SeriesIndex, SegmentReader, listSegments
+
+load_dotenv()
+
+'''
+Time-range queries over the recorded telemetry, fe. "inflow of box07 over the last 6 hours at 1 s resolution".
+
+Besides its raw samples, the recorder keeps rollups of every series: the min, max, mean and count of each bucket of
+1 s, 10 s and 1 min, written as a bucket closes. Each tier is built from the one below it, so a raw sample only ever
+touches the 1 s bucket. The tiers are segments too, see telemetrySegments.py.
+
+TelemetryStore.query() reads the coarsest tier that is at most the asked resolution, and merges its buckets into
+buckets of the asked resolution; below 1 s it reads the raw samples. Segments are picked by a binary search over
+their first times, and the records within them by a binary search reading single times out of the map, so a query
+reads only what it returns. Results are NumPy structured arrays.
+
+Records are in arrival order, which is time order unless the clock jumps back. The open bucket of each tier is
+written only when it closes, so a tier's data ends up to its resolution behind the raw samples. A bucket of a
+resolution that isn't a multiple of the tier's takes whole tier buckets, so its edges are off by up to the tier's resolution.
+'''
+
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "telemetry")
+
+# The rollup tiers, in seconds, finest first
+ROLLUP_TIERS = (1.0, 10.0, 60.0)
+
+QUERY_DTYPE = np.dtype([("time", "<f8"), ("min", "<f8"), ("max", "<f8"), ("mean", "<f8"), ("count", "<u8")])
+RAW_DTYPE = np.dtype([("time", "<f8"), ("value", "<f8")])
+
+"""
+Returns the directory name of a rollup tier, fe. '10s'.
+"""
+def tierName(resolution: float) -> str:
+    return f"{resolution:g}s"
+
+"""
+The open bucket of one rollup tier, written to 'writer' when a sample past its end arrives, and merged into the next
+tier's. 'writer' is anything with appendRollup(start, min, max, mean, count); the recorder's SeriesWriter.
+"""
+class Rollup:
+    def __init__(self, resolution: float, writer, next=None):
+        self.resolution = resolution
+        self.writer = writer
+        self.next = next
+        self.start = 0.0
+        self.end = float("-inf")
+        self.low = 0.0
+        self.high = 0.0
+        self.total = 0.0
+        self.count = 0
+
+    """
+    Adds a raw sample. A sample older than the open bucket, fe. one of a late speed frame, goes into the open bucket.
+    """
+    def add(self, timestamp: float, value: float):
+        if timestamp >= self.end:
+            self.open(timestamp)
+            self.low = self.high = self.total = value
+            self.count = 1
+            return
+        if value < self.low:
+            self.low = value
+        elif value > self.high:
+            self.high = value
+        self.total += value
+        self.count += 1
+
+    """
+    Adds a closed bucket of the tier below.
+    """
+    def merge(self, timestamp: float, low: float, high: float, total: float, count: int):
+        if timestamp >= self.end:
+            self.open(timestamp)
+            self.low, self.high, self.total, self.count = low, high, total, count
+            return
+        if low < self.low:
+            self.low = low
+        if high > self.high:
+            self.high = high
+        self.total += total
+        self.count += count
+
+    def open(self, timestamp: float):
+        if self.count:
+            self.emit()
+        self.start = timestamp - timestamp % self.resolution
+        self.end = self.start + self.resolution
+
+    def emit(self):
+        self.writer.appendRollup(self.start, self.low, self.high, self.total / self.count, self.count)
+        if self.next is not None:
+            self.next.merge(self.start, self.low, self.high, self.total, self.count)
+        self.count = 0
+
+    """
+    Writes the open buckets of this tier and the ones above it, fe. when the recorder stops.
+    """
+    def flush(self):
+        if self.count:
+            self.emit()
+        if self.next is not None:
+            self.next.flush()
+
+    def close(self):
+        self.flush()
+        rollup = self
+        while rollup is not None:
+            rollup.writer.close()
+            rollup = rollup.next
+
+"""
+Merges rows of 'time', 'min', 'max', 'mean' and 'count', in time order, into buckets of 'resolution' seconds.
+"""
+def downsample(times: np.ndarray, low: np.ndarray, high: np.ndarray, mean: np.ndarray, count: np.ndarray, resolution: float) -> np.ndarray:
+    if len(times) == 0:
+        return np.empty(0, dtype=QUERY_DTYPE)
+    buckets = times - times % resolution
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    counts = np.add.reduceat(count.astype(np.uint64), starts)
+    result = np.empty(len(starts), dtype=QUERY_DTYPE)
+    result["time"] = buckets[starts]
+    result["min"] = np.minimum.reduceat(low, starts)
+    result["max"] = np.maximum.reduceat(high, starts)
+    result["mean"] = np.add.reduceat(mean * count, starts) / counts
+    result["count"] = counts
+    return result
+
+"""
+Reads a recording directory; see telemetryRecorder.py. Segment maps are kept open between queries.
+"""
+class TelemetryStore:
+    def __init__(self, directory: str = TELEMETRY_DIR):
+        self.directory = directory
+        self.index = SeriesIndex(directory)
+        self.readers = {}     # path -> SegmentReader
+
+    """
+    Returns the recorded series of a box's data type, fe. 'inflowRate', sorted. None matches any box or data type.
+    """
+    def find(self, box: str = None, dataType: str = None) -> list:
+        self.index.reload()
+        return sorted(series for series in self.index.ids
+            if (box is None or series.startswith(f"{box}/")) and (dataType is None or series.endswith(f"/{dataType}")))
+
+    def reader(self, path: str) -> SegmentReader:
+        reader = self.readers.get(path)
+        if reader is None:
+            reader = self.readers[path] = SegmentReader(path)
+        return reader
+
+    """
+    Returns the records of a series, or of one of its tiers, from 'start' up to 'end', as a list of views into the maps.
+    """
+    def select(self, series: str, start: float, end: float, tier: str = "") -> list:
+        readers = [self.reader(path) for path in listSegments(self.directory, series, tier)]
+        firsts = np.array([reader.first() for reader in readers])
+        # A segment holds the records from its first time up to the next segment's
+        low = max(int(np.searchsorted(firsts, start, "right")) - 1, 0)
+        high = int(np.searchsorted(firsts, end, "left"))
+        selected = []
+        for reader in readers[low:high]:
+            records = reader.records()
+            selected.append(records[reader.search(start, len(records)):reader.search(end, len(records))])
+        return selected
+
+    """
+    Returns the raw samples of a series from 'start' up to 'end', as an array of 'time' and 'value'.
+    """
+    def raw(self, series: str, start: float, end: float) -> np.ndarray:
+        selected = self.select(series, start, end)
+        result = np.empty(sum(len(records) for records in selected), dtype=RAW_DTYPE)
+        offset = 0
+        for records in selected:
+            result["time"][offset:offset + len(records)] = records["time"]
+            result["value"][offset:offset + len(records)] = records["value"]
+            offset += len(records)
+        return result
+
+    """
+    Returns a series from 'start' up to 'end' in buckets of 'resolution' seconds, as an array of 'time' (the bucket's start),
+    'min', 'max', 'mean' and 'count'. Buckets without samples are left out.
+    """
+    def query(self, series: str, start: float, end: float, resolution: float) -> np.ndarray:
+        if resolution <= 0:
+            raise ValueError(f"Non-positive resolution: {resolution}")
+        tiers = [tier for tier in ROLLUP_TIERS if tier <= resolution]
+        if not tiers:
+            samples = self.raw(series, start, end)
+            values = samples["value"]
+            return downsample(samples["time"], values, values, values, np.ones(len(samples), dtype=np.uint64), resolution)
+        selected = self.select(series, start, end, tierName(tiers[-1]))
+        rows = np.concatenate(selected) if selected else np.empty(0, dtype=QUERY_DTYPE)
+        return downsample(rows["time"], rows["min"], rows["max"], rows["mean"], rows["count"], resolution)
+
+    """
+    Returns the times of the first and the last raw sample of a series, or None if it has none.
+    """
+    def span(self, series: str):
+        readers = [reader for reader in map(self.reader, listSegments(self.directory, series)) if reader.count() > 0]
+        if not readers:
+            return None
+        return readers[0].first(), float(readers[-1].records()["time"][-1])
+
+    """
+    Returns the last 'seconds' of a series in about 'points' buckets; see query().
+    """
+    def history(self, series: str, seconds: float, points: int) -> np.ndarray:
+        end = time.time()
+        return self.query(series, end - seconds, end, seconds / points)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
@@ -0,0 +1,230 @@
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+import paho.mqtt.client as mqtt
+from speedFrames import decodeSpeedFrame
+from wireCodec import decodeBinary, decodeFlow, decodeSpeed, TYPE_DP_TEMP
+from topicDispatcher import TopicDispatcher
+from telemetrySegments import SeriesIndex, SegmentWriter, listSegments, seriesDirectory, SEGMENT_SUFFIX, RECORD, ROLLUP
+from telemetryQuery import Rollup, ROLLUP_TIERS, tierName
+from metrics import registry, instrumentClient, startMetrics
+
+load_dotenv()
+
+'''
+Records every sample of the boxes to disk, for as long as it runs.
+
+Subscribes to '<box>/#' and appends each decoded sample to its series' segment files; see telemetrySegments.py for the format.
+A series gets a new segment when the current one is full (TELEMETRY_SEGMENT_RECORDS) or older than TELEMETRY_SEGMENT_SECONDS.
+Samples are stamped with time.time() when they arrive, except the motor's speed frames, which carry their own times.
+Binary pressure messages carry the temperature too, which goes to the sensor's temperature series like the CSV one does.
+Messages that aren't a single sample, fe. the motor's config and commands, aren't recorded.
+Every series also gets its 1 s, 10 s and 1 min rollups, for telemetryQuery.py; a rollup segment covers TELEMETRY_ROLLUP_SECONDS.
+
+Nothing is ever deleted; old segments can be removed by hand, oldest first.
+'''
+
+# Parameters for the MQTT broker
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT"))
+MQTT_TOPIC_SENSOR_OUTFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_OUTFLOW_OUT")
+MQTT_TOPIC_SENSOR_INFLOW_OUT = os.getenv("MQTT_TOPIC_SENSOR_INFLOW_OUT")
+MQTT_TOPIC_SENSOR_DP_OUT = os.getenv("MQTT_TOPIC_SENSOR_DP_OUT")
+MQTT_TOPIC_SENSOR_TEMP_OUT = os.getenv("MQTT_TOPIC_SENSOR_TEMP_OUT")
+
+# The data type level of each sensor's topics; fe. 'inflowRate' of '/inflowRate/out'
+INFLOW_TYPE = MQTT_TOPIC_SENSOR_INFLOW_OUT.strip("/").split("/")[0]
+OUTFLOW_TYPE = MQTT_TOPIC_SENSOR_OUTFLOW_OUT.strip("/").split("/")[0]
+DP_TYPE = MQTT_TOPIC_SENSOR_DP_OUT.strip("/").split("/")[0]
+TEMP_TYPE = MQTT_TOPIC_SENSOR_TEMP_OUT.strip("/").split("/")[0]
+SPEED_TYPE = "speed"
+
+# The binary message type of each data type with one value; pressure carries two and is handled on its own
+BINARY_DECODERS = {INFLOW_TYPE: decodeFlow, OUTFLOW_TYPE: decodeFlow, SPEED_TYPE: decodeSpeed}
+RECORDED_DIRECTIONS = ("out", "bin", "frame")
+
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "telemetry")
+SEGMENT_RECORDS = int(os.getenv("TELEMETRY_SEGMENT_RECORDS", "262144"))      # records per segment, 5 MiB
+SEGMENT_SECONDS = float(os.getenv("TELEMETRY_SEGMENT_SECONDS", "3600"))      # seconds before a new segment is started, 0 for no limit
+STATS_INTERVAL = float(os.getenv("TELEMETRY_STATS_INTERVAL", "10.0"))        # seconds between the rate reports, 0 disables them
+METRICS_PORT = int(os.getenv("TELEMETRY_METRICS_PORT", "9104"))              # port of the metrics endpoint, see metrics.py; 0 disables it
+ROLLUP_SECONDS = float(os.getenv("TELEMETRY_ROLLUP_SECONDS", "86400"))       # seconds of buckets per rollup segment, 3.3 MiB of the 1 s tier
+
+parser = argparse.ArgumentParser(description="Records the samples of the boxes into memory-mapped segment files.")
+parser.add_argument("-b", "--boxes", nargs="+", default=[os.getenv("BOX_ID", "box01")], help="The IDs of the boxes to record; fe. 'box01 box02'. Defaults to BOX_ID.")
+parser.add_argument("-d", "--directory", default=TELEMETRY_DIR, help="Where the segments go. Defaults to TELEMETRY_DIR.")
+
+"""
+The segment being written of one series, or of one of its rollup tiers, and starting the next one.
+"""
+class SeriesWriter:
+    def __init__(self, directory: str, series: str, seriesID: int, capacity: int, maxAge: float, tier: str = "", record=RECORD):
+        self.path = os.path.join(seriesDirectory(directory, series), tier)
+        self.seriesID = seriesID
+        self.capacity = capacity
+        self.maxAge = maxAge
+        self.record = record
+        self.segment = None
+        self.rotateAt = 0.0
+        self.segments = 0
+        os.makedirs(self.path, exist_ok=True)
+        existing = listSegments(directory, series, tier)
+        self.sequence = int(os.path.basename(existing[-1])[:-len(SEGMENT_SUFFIX)]) if existing else 0
+
+    def append(self, timestamp: float, value: float):
+        segment = self.segment
+        if segment is None or segment.count >= segment.capacity or timestamp >= self.rotateAt:
+            segment = self.rotate()
+        segment.append(timestamp, value)
+
+    def appendRollup(self, timestamp: float, low: float, high: float, mean: float, count: int):
+        segment = self.segment
+        if segment is None or segment.count >= segment.capacity or timestamp >= self.rotateAt:
+            segment = self.rotate()
+        segment.appendRollup(timestamp, low, high, mean, count)
+
+    """
+    Closes the current segment and starts the next one.
+    """
+    def rotate(self) -> SegmentWriter:
+        if self.segment is not None:
+            self.segment.close()
+        self.sequence += 1
+        self.segment = SegmentWriter(os.path.join(self.path, f"{self.sequence:08d}{SEGMENT_SUFFIX}"), self.seriesID, self.capacity, self.record)
+        self.rotateAt = self.segment.created + self.maxAge if self.maxAge > 0 else float("inf")
+        self.segments += 1
+        return self.segment
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+class TelemetryRecorder:
+    def __init__(self, directory: str = TELEMETRY_DIR, segmentRecords: int = SEGMENT_RECORDS, segmentSeconds: float = SEGMENT_SECONDS, rollupSeconds: float = ROLLUP_SECONDS):
+        self.directory = directory
+        self.segmentRecords = segmentRecords
+        self.segmentSeconds = segmentSeconds
+        self.rollupSeconds = rollupSeconds
+        os.makedirs(directory, exist_ok=True)
+        self.index = SeriesIndex(directory)
+        self.writers = {}     # series -> SeriesWriter
+        self.rollups = {}     # series -> Rollup of its finest tier
+        self.samples = 0
+        self.skipped = 0      # messages that aren't samples
+        self.invalid = 0      # samples that couldn't be decoded
+
+    """
+    Appends one sample to its series, fe. 'box01/inflow01/inflowRate'.
+    """
+    def record(self, series: str, timestamp: float, value: float):
+        writer = self.writers.get(series)
+        if writer is None:
+            writer = self.addSeries(series)
+        writer.append(timestamp, value)
+        self.rollups[series].add(timestamp, value)
+        self.samples += 1
+
+    def addSeries(self, series: str) -> SeriesWriter:
+        seriesID = self.index.idOf(series)
+        rollup = None
+        for resolution in reversed(ROLLUP_TIERS):
+            tier = SeriesWriter(self.directory, series, seriesID, max(int(self.rollupSeconds / resolution), 1), 0, tierName(resolution), ROLLUP)
+            rollup = Rollup(resolution, tier, rollup)
+        self.rollups[series] = rollup
+        writer = self.writers[series] = SeriesWriter(self.directory, series, seriesID, self.segmentRecords, self.segmentSeconds)
+        return writer
+
+    """
+    Decodes a message and records its samples, given the fields of its topic; see topicDispatcher.py.
+    """
+    def recordMessage(self, fields, payload):
+        if fields.direction not in RECORDED_DIRECTIONS:
+            self.skipped += 1
+            return
+        dataType = fields.dataType
+        series = f"{fields.box}/{fields.sensor}/{dataType}"
+        now = time.time()
+        try:
+            if fields.direction == "frame":
+                start, period, samples = decodeSpeedFrame(payload)
+                for i, sample in enumerate(samples):
+                    self.record(series, start + i * period, sample)
+            elif fields.binary:
+                if dataType == DP_TYPE:
+                    pressure, temperature = decodeBinary(payload, TYPE_DP_TEMP)
+                    self.record(series, now, pressure)
+                    self.record(f"{fields.box}/{fields.sensor}/{TEMP_TYPE}", now, temperature)
+                elif dataType in BINARY_DECODERS:
+                    self.record(series, now, BINARY_DECODERS[dataType](payload))
+                else:
+                    self.skipped += 1
+            else:
+                try:
+                    value = float(payload)
+                except ValueError:
+                    # Several values, fe. the motor's status or config
+                    self.skipped += 1
+                    return
+                self.record(series, now, value)
+        except ValueError as e:
+            self.invalid += 1
+            print(f"Invalid message on {series} :: {e}")
+
+    def segments(self) -> int:
+        return sum(writer.segments for writer in self.writers.values())
+
+    """
+    Writes the open rollup buckets and closes every segment.
+    """
+    def close(self):
+        for rollup in self.rollups.values():
+            rollup.close()
+        for writer in self.writers.values():
+            writer.close()
+
+    def summary(self) -> str:
+        return f"samples={self.samples} series={len(self.writers)} segments={self.segments()} skipped={self.skipped} invalid={self.invalid}"
+
+"""
+Connects to the broker and records everything of the given boxes.
+"""
+def createClient(recorder: TelemetryRecorder, boxIDs: list):
+    dispatcher = TopicDispatcher()
+    dispatcher.add(recorder.recordMessage)
+    client = instrumentClient(mqtt.Client())
+    client.on_message = dispatcher.onMessage
+    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+    client.subscribe([(f"{boxID}/#", 1) for boxID in boxIDs])
+    return client
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    recorder = TelemetryRecorder(args.directory)
+    registry.counter("recorder_samples_total", "Samples recorded.", function=lambda: recorder.samples)
+    registry.counter("recorder_skipped_messages_total", "Messages that weren't samples.", function=lambda: recorder.skipped)
+    registry.counter("recorder_invalid_messages_total", "Samples that couldn't be decoded.", function=lambda: recorder.invalid)
+    registry.gauge("recorder_series", "Series being recorded.", function=lambda: len(recorder.writers))
+
+    client = createClient(recorder, args.boxes)
+    client.loop_start()
+    startMetrics(client, args.boxes[0], "recorder", METRICS_PORT)
+    print(f"Recording {', '.join(args.boxes)} to {args.directory} . . . ")
+
+    lastSamples = 0
+    lastReport = time.monotonic()
+    try:
+        while True:
+            time.sleep(STATS_INTERVAL if STATS_INTERVAL > 0 else 1.0)
+            if STATS_INTERVAL > 0:
+                now = time.monotonic()
+                samples = recorder.samples
+                print(f"Recorder :: {(samples - lastSamples) / (now - lastReport):.0f} samples/s, {recorder.summary()}")
+                lastSamples, lastReport = samples, now
+    except KeyboardInterrupt:
+        pass
+    client.disconnect()
+    client.loop_stop()
+    recorder.close()
+    print(f"Recorder :: {recorder.summary()}")
@@ -0,0 +1,228 @@
+import os
+import mmap
+import time
+import struct
+import numpy as np
+
+'''
+The on-disk format of the recorded telemetry: append-only segment files of fixed-size records, one series per file.
+
+A series is a box's sensor's data type, fe. 'box01/inflow01/inflowRate', and its segments are the files
+'<directory>/box01/inflow01/inflowRate/<sequence>.seg', numbered from 1 in the order they were started.
+The series' rollups, see telemetryQuery.py, are segments too, in a directory per tier: '.../inflowRate/10s/<sequence>.seg'.
+A segment is pre-allocated to its full size and memory-mapped; appending a sample is writing its record into the map
+and then the new record count into the header. Nothing is ever moved or rewritten, so a reader can map the same file
+while it's being written and look at the records with numpy, without copying them.
+
+Header, HEADER_SIZE bytes, little-endian:
+    magic       8s  'TLMSEG01'
+    recordSize  u4  RECORD.size, or ROLLUP.size for a rollup
+    seriesID    u4  the series' ID, from the directory's 'series.csv'
+    capacity    u8  records the file has room for
+    created     f8  time.time() when the segment was started
+    count       u8  records written so far, at COUNT_OFFSET
+    closed      u8  1 once the writer has moved on to the next segment, at CLOSED_OFFSET
+Record, RECORD.size bytes: time (f8, time.time() of the sample), series ID (u4), value (f8).
+Rollup, ROLLUP.size bytes: time (f8, start of the bucket), series ID (u4), min (f8), max (f8), mean (f8), count (u4).
+
+The count is written after the record, but another core may see the two stores in either order. Series IDs start from 1,
+so a record still reading as series 0 hasn't landed yet; readers leave it out until it has.
+'''
+
+MAGIC = b"TLMSEG01"
+HEADER = struct.Struct("<8sIIQd")
+COUNT = struct.Struct("<Q")
+TIME = struct.Struct("<d")     # the time at the start of every record
+COUNT_OFFSET = HEADER.size
+CLOSED_OFFSET = COUNT_OFFSET + COUNT.size
+HEADER_SIZE = 64
+RECORD = struct.Struct("<dId")
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("series", "<u4"), ("value", "<f8")])
+ROLLUP = struct.Struct("<dIdddI")
+ROLLUP_DTYPE = np.dtype([("time", "<f8"), ("series", "<u4"), ("min", "<f8"), ("max", "<f8"), ("mean", "<f8"), ("count", "<u4")])
+# The record layout of a segment, by its header's record size
+RECORD_DTYPES = {RECORD.size: RECORD_DTYPE, ROLLUP.size: ROLLUP_DTYPE}
+SEGMENT_SUFFIX = ".seg"
+INDEX_FILE = "series.csv"
+
+"""
+Returns the directory of a series' segments.
+"""
+def seriesDirectory(directory: str, series: str) -> str:
+    return os.path.join(directory, *series.split("/"))
+
+"""
+Returns the paths of a series' segments, oldest first; of one of its rollup tiers, fe. '10s', if given.
+"""
+def listSegments(directory: str, series: str, tier: str = "") -> list:
+    path = os.path.join(seriesDirectory(directory, series), tier)
+    if not os.path.isdir(path):
+        return []
+    names = sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(path, name) for name in names]
+
+"""
+The series of a recording directory and their IDs, kept in 'series.csv' as 'id,series' lines.
+A new series is appended to the file when it's first seen, so the IDs stay the same between runs.
+"""
+class SeriesIndex:
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, INDEX_FILE)
+        self.ids = {}
+        self.names = {}
+        self.reload()
+
+    def reload(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as file:
+            for line in file:
+                identifier, _, series = line.strip().partition(",")
+                if series:
+                    self.ids[series] = int(identifier)
+                    self.names[int(identifier)] = series
+
+    """
+    Returns the ID of the series, adding it if it's new. IDs start from 1; 0 marks a record that isn't there yet.
+    """
+    def idOf(self, series: str) -> int:
+        identifier = self.ids.get(series)
+        if identifier is None:
+            identifier = len(self.ids) + 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(f"{identifier},{series}\n")
+            self.ids[series] = identifier
+            self.names[identifier] = series
+        return identifier
+
+"""
+Appends records to one pre-allocated, memory-mapped segment file.
+"""
+class SegmentWriter:
+    def __init__(self, path: str, seriesID: int, capacity: int, record: struct.Struct = RECORD):
+        if capacity <= 0:
+            raise ValueError(f"Non-positive segment capacity: {capacity}")
+        self.path = path
+        self.seriesID = seriesID
+        self.capacity = capacity
+        self.record = record
+        self.created = time.time()
+        self.count = 0
+        size = HEADER_SIZE + capacity * record.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            # Allocate the blocks now: a sparse file could run out of disk mid-segment, and a write into the map would crash
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.map, 0, MAGIC, record.size, seriesID, capacity, self.created)
+        COUNT.pack_into(self.map, COUNT_OFFSET, 0)
+        COUNT.pack_into(self.map, CLOSED_OFFSET, 0)
+
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    """
+    Appends a record. The caller checks full() first.
+    """
+    def append(self, timestamp: float, value: float):
+        RECORD.pack_into(self.map, HEADER_SIZE + self.count * RECORD.size, timestamp, self.seriesID, value)
+        self.count += 1
+        COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+
+    """
+    Appends a rollup record, to a segment created with record=ROLLUP. The caller checks full() first.
+    """
+    def appendRollup(self, timestamp: float, low: float, high: float, mean: float, count: int):
+        ROLLUP.pack_into(self.map, HEADER_SIZE + self.count * ROLLUP.size, timestamp, self.seriesID, low, high, mean, count)
+        self.count += 1
+        COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+
+    """
+    Marks the segment closed and unmaps it. The file keeps its full size, so readers that have it mapped aren't cut short.
+    """
+    def close(self, sync: bool = True):
+        if self.map is None:
+            return
+        COUNT.pack_into(self.map, CLOSED_OFFSET, 1)
+        if sync:
+            self.map.flush()
+        self.map.close()
+        self.map = None
+
+"""
+A read-only map of a segment, possibly one still being written. records() is a view into the map, not a copy;
+the map can only be closed once no view of it is left. The first time, and the count of a closed segment, are cached.
+"""
+class SegmentReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, recordSize, self.seriesID, self.capacity, self.created = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or recordSize not in RECORD_DTYPES:
+            self.map.close()
+            raise ValueError(f"Not a telemetry segment: {path}")
+        self.recordSize = recordSize
+        self.all = np.frombuffer(self.map, dtype=RECORD_DTYPES[recordSize], count=self.capacity, offset=HEADER_SIZE)
+        self.firstTime = None
+        self.finalCount = None
+
+    """
+    Returns the number of records written so far, leaving out the last ones if they haven't fully landed.
+    """
+    def count(self) -> int:
+        if self.finalCount is not None:
+            return self.finalCount
+        closed = self.closed()
+        written = min(COUNT.unpack_from(self.map, COUNT_OFFSET)[0], self.capacity)
+        count = written
+        while count > 0 and self.all["series"][count - 1] == 0:
+            count -= 1
+        if closed and count == written:
+            self.finalCount = count
+        return count
+
+    """
+    Returns the time of the first record, or infinity if there's none yet.
+    """
+    def first(self) -> float:
+        if self.firstTime is None:
+            if self.count() == 0:
+                return float("inf")
+            self.firstTime = TIME.unpack_from(self.map, HEADER_SIZE)[0]
+        return self.firstTime
+
+    """
+    Returns the index of the first of the first 'count' records with a time at or after 'timestamp', or 'count'.
+    A binary search reading one time at a time out of the map: numpy's searchsorted() on the strided time field
+    would copy the whole column first.
+    """
+    def search(self, timestamp: float, count: int) -> int:
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if TIME.unpack_from(self.map, HEADER_SIZE + middle * self.recordSize)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def closed(self) -> bool:
+        return COUNT.unpack_from(self.map, CLOSED_OFFSET)[0] == 1
+
+    """
+    Returns the records written so far as a structured array over the map, with 'time', 'series' and 'value' fields;
+    a rollup's have 'min', 'max', 'mean' and 'count' instead of 'value'.
+    """
+    def records(self) -> np.ndarray:
+        return self.all[:self.count()]
+
+    def close(self):
+        self.all = None
+        self.map.close()
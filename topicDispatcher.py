@@ -0,0 +1,90 @@
+from functools import lru_cache
+from collections import namedtuple
+from wireCodec import BINARY_LEVEL
+
+'''
+Dispatching MQTT messages by topic.
+
+The box's topics all have four levels, 'box/sensor/dataType/direction' with an optional trailing '/';
+fe. 'box01/inflow01/inflowRate/out/' or 'box01/motor/speed/frame/'. Instead of letting the client match every message
+against every callback filter and then splitting the topic again in the callback, the dispatcher parses each distinct
+topic once and remembers its fields and handler in a bounded LRU cache. A message on a known topic costs one dictionary lookup.
+
+Handlers are called as handler(fields, payload).
+'''
+
+"""
+The levels of a topic. 'binary' is True when the payload is in the binary wire format, ie. the direction is 'bin'.
+"""
+TopicFields = namedtuple("TopicFields", ["box", "sensor", "dataType", "direction", "binary"])
+
+"""
+Splits a topic into its fields. Returns None if it doesn't have the four levels.
+"""
+def parseTopic(topic: str):
+    levels = topic.split("/")
+    if levels[-1] == "":
+        levels.pop()
+    if len(levels) != 4 or "" in levels:
+        return None
+    box, sensor, dataType, direction = levels
+    return TopicFields(box, sensor, dataType, direction, direction == BINARY_LEVEL)
+
+"""
+Returns the subscriptions to every topic of a box. The sensors' topics have no trailing '/' and the motor's do,
+so both forms are needed.
+"""
+def boxSubscriptions(box: str, qos: int = 1) -> list:
+    return [(f"{box}/+/+/+", qos), (f"{box}/+/+/+/", qos)]
+
+"""
+Routes messages to handlers by their topic's fields. A route matches a field when it's None or equal;
+the first matching route, in the order they were added, gets the message.
+"""
+class TopicDispatcher:
+    def __init__(self, maxTopics: int = 4096):
+        self.routes = []
+        self.maxTopics = maxTopics
+        self.unhandled = 0
+        self.resolve = lru_cache(maxsize=maxTopics)(self.resolveTopic)
+
+    """
+    Adds a route. The cache is cleared, as the topics already seen may now have another handler.
+    """
+    def add(self, handler, box: str = None, sensor: str = None, dataType: str = None, direction: str = None):
+        self.routes.append(((box, sensor, dataType, direction), handler))
+        self.resolve.cache_clear()
+
+    """
+    Returns (fields, handler) of a topic, either of them None if the topic can't be parsed or no route matches.
+    Called through 'resolve', which caches the results.
+    """
+    def resolveTopic(self, topic: str) -> tuple:
+        fields = parseTopic(topic)
+        if fields is None:
+            return None, None
+        for route, handler in self.routes:
+            if all(expected is None or expected == value for expected, value in zip(route, fields)):
+                return fields, handler
+        return fields, None
+
+    """
+    Passes a message to its handler. Returns False if no route matched.
+    """
+    def dispatch(self, topic: str, payload) -> bool:
+        fields, handler = self.resolve(topic)
+        if handler is None:
+            self.unhandled += 1
+            return False
+        handler(fields, payload)
+        return True
+
+    """
+    For the MQTT client's 'on_message'.
+    """
+    def onMessage(self, client, userdata, message):
+        self.dispatch(message.topic, message.payload)
+
+    def summary(self) -> str:
+        info = self.resolve.cache_info()
+        return f"topics cached={info.currsize}/{self.maxTopics} hits={info.hits} misses={info.misses} unhandled={self.unhandled}"
@@ -0,0 +1,87 @@
+import csv
+import argparse
+import numpy as np
+from tracing import TRACE_COLUMNS
+
+'''
+Reports where the latency of the traced samples comes from, from the trace files the display writes with MQTT_TRACE="1";
+see tracing.py. Every sample's path is split into hops:
+- capture -> publish: inside the sensor or motor process, fe. parsing the serial line
+- publish -> receive: the MQTT client, the network and the broker
+- receive -> render:  waiting for the next frame and drawing it in the display
+and the total, capture -> render. Gaps in the sequence numbers are samples that never made it to the screen.
+'''
+
+parser = argparse.ArgumentParser(description="Reports the per-hop latency and the lost samples of latency trace files.")
+parser.add_argument("files", nargs="+", help="Trace files written by the display; fe. 'trace.csv'.")
+parser.add_argument("-s", "--series", action="store_true", help="Report every series on its own as well as all of them together.")
+
+HOPS = (
+    ("capture -> publish", "capture", "publish"),
+    ("publish -> receive", "publish", "receive"),
+    ("receive -> render", "receive", "render"),
+    ("capture -> render", "capture", "render"),
+)
+
+"""
+Reads trace files into a dict of series -> dict of column -> array, in the order the rows were written.
+"""
+def readTraces(paths: list) -> dict:
+    rows = {}
+    for path in paths:
+        with open(path, newline="") as file:
+            for row in csv.DictReader(file):
+                if row.get("series") in (None, "series"):
+                    continue
+                rows.setdefault(row["series"], []).append(row)
+
+    traces = {}
+    for series, seriesRows in rows.items():
+        columns = {"sequence": np.array([int(row["sequence"]) for row in seriesRows], dtype=np.int64)}
+        for column in TRACE_COLUMNS[2:]:
+            columns[column] = np.array([float(row[column]) for row in seriesRows])
+        traces[series] = columns
+    return traces
+
+"""
+Returns "p50=.. p90=.. p99=.. max=.." of the latencies in milliseconds.
+"""
+def latencySummary(latencies: np.ndarray) -> str:
+    if len(latencies) == 0:
+        return "no samples"
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+    return f"p50={p50:.2f}ms p90={p90:.2f}ms p99={p99:.2f}ms max={latencies.max() * 1e3:.2f}ms"
+
+"""
+Counts the gaps in a series' sequence numbers: (missing samples, out of order samples, publisher restarts).
+A sequence starting again from 0 is the publisher restarting, not a gap.
+"""
+def sequenceGaps(sequences: np.ndarray) -> tuple:
+    steps = np.diff(sequences)
+    restarts = np.count_nonzero((steps <= 0) & (sequences[1:] == 0))
+    outOfOrder = np.count_nonzero(steps <= 0) - restarts
+    missing = int(np.sum(steps[steps > 1] - 1))
+    return missing, int(outOfOrder), int(restarts)
+
+"""
+Prints the hops' latencies and the gaps of one or more series.
+"""
+def report(name: str, traces: list):
+    count = sum(len(trace["sequence"]) for trace in traces)
+    missing, outOfOrder, restarts = (sum(values) for values in zip(*(sequenceGaps(trace["sequence"]) for trace in traces)))
+    lost = 100.0 * missing / (count + missing) if count + missing else 0.0
+    print(f"{name}: {count} samples, {missing} missing ({lost:.2f}%), {outOfOrder} out of order, {restarts} restarts")
+    for hop, start, end in HOPS:
+        latencies = np.concatenate([trace[end] - trace[start] for trace in traces])
+        print(f"  {hop:<20} {latencySummary(latencies)}")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    traces = readTraces(args.files)
+    if not traces:
+        print("No traces found")
+    else:
+        report("All series", list(traces.values()))
+        if args.series:
+            for series in sorted(traces):
+                report(series, [traces[series]])
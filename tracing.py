@@ -0,0 +1,117 @@
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+'''
+End-to-end latency tracing of the sensor and motor samples, from capture to the display's screen.
+
+With MQTT_TRACE="1" every traced sample is followed by a trace message on the same topic with 'trace' as the last level
+instead of 'out' or 'bin' (fe. 'box01/inflow01/inflowRate/trace'). The samples' own payloads don't change, so
+subscribers that don't trace see nothing new. A trace payload is "SEQUENCE,CAPTURE,PUBLISH":
+- SEQUENCE: a counter per topic, starting from 0 when the publisher starts; a gap means lost samples
+- CAPTURE: when the sample was taken, fe. when its line was read from the serial port
+- PUBLISH: when it was handed to the MQTT client
+The display adds when the sample was received and when a frame with it was rendered, and writes each sample's
+timestamps as a row of DISPLAY_TRACE_FILE; 'traceAnalysis.py' reports the latency of every hop from those.
+
+All timestamps are time.monotonic() in seconds. The monotonic clock is shared by the processes of one machine but not
+between machines, so the hops only make sense when the sensors, the motor and the display run on the same box.
+'''
+
+TRACE_ENABLED = os.getenv("MQTT_TRACE", "0") == "1"
+TRACE_LEVEL = "trace"
+
+# Columns of the trace file
+TRACE_COLUMNS = ("series", "sequence", "capture", "publish", "receive", "render")
+
+"""
+Returns the trace topic of a sample topic: the last level replaced with 'trace', a trailing '/' is kept.
+"""
+def traceTopic(topic: str) -> str:
+    stripped = topic.rstrip("/")
+    base, _, last = stripped.rpartition("/")
+    if not base:
+        raise ValueError(f"Not a sample topic: {topic}")
+    return base + "/" + TRACE_LEVEL + topic[len(stripped):]
+
+"""
+Decodes a trace payload into (sequence, capture, publish). Raises ValueError if it isn't one.
+"""
+def decodeTrace(payload) -> tuple:
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    fields = payload.split(",")
+    if len(fields) != 3:
+        raise ValueError(f"Expected 3 trace fields, got {len(fields)}")
+    return int(fields[0]), float(fields[1]), float(fields[2])
+
+"""
+Publisher side: numbers the samples of each topic and publishes their trace messages.
+"""
+class TraceStamper:
+    def __init__(self):
+        self.sequences = {}
+        self.topics = {}     # sample topic -> trace topic
+
+    """
+    Publishes the trace of a sample just published on 'topic'. 'capture' defaults to now.
+    """
+    def publish(self, client, topic: str, capture: float = None):
+        now = time.monotonic()
+        sequence = self.sequences.get(topic, 0)
+        self.sequences[topic] = sequence + 1
+        trace = self.topics.get(topic)
+        if trace is None:
+            trace = self.topics[topic] = traceTopic(topic)
+        client.publish(trace, f"{sequence},{(now if capture is None else capture):.6f},{now:.6f}")
+
+"""
+Subscriber side: pairs each trace message with the receipt of its sample, and stamps them with the next rendered frame.
+A sample's trace is published right after it on the same connection, so it arrives right after it too; the receipt of the
+latest sample of the series is used. Rows are written to 'path' when their frame has been rendered.
+"""
+class TraceRecorder:
+    def __init__(self, path: str, maxPending: int = 10000):
+        self.file = open(path, "a")
+        if self.file.tell() == 0:
+            self.file.write(",".join(TRACE_COLUMNS) + "\n")
+        self.received = {}    # series -> monotonic time its latest sample was received
+        self.pending = []
+        self.maxPending = maxPending
+        self.rows = 0
+
+    """
+    Called when a sample of the series is received.
+    """
+    def sample(self, series: str):
+        self.received[series] = time.monotonic()
+
+    """
+    Called with the payload of the series' trace message.
+    """
+    def trace(self, series: str, payload):
+        try:
+            sequence, capture, publish = decodeTrace(payload)
+        except ValueError as e:
+            print(f"Invalid trace of {series} :: {e}")
+            return
+        receive = self.received.get(series, time.monotonic())
+        if len(self.pending) < self.maxPending:
+            self.pending.append((series, sequence, capture, publish, receive))
+
+    """
+    Called after a frame has been rendered: every sample received so far is on the screen now.
+    """
+    def rendered(self):
+        if not self.pending:
+            return
+        render = time.monotonic()
+        pending, self.pending = self.pending, []
+        for series, sequence, capture, publish, receive in pending:
+            self.file.write(f"{series},{sequence},{capture:.6f},{publish:.6f},{receive:.6f},{render:.6f}\n")
+        self.rows += len(pending)
+
+    def close(self):
+        self.file.close()
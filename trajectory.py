@@ -0,0 +1,162 @@
+import time
+import numpy as np
+from waveform import waveformFor
+
+'''
+Ahead-of-time motor speed trajectories.
+
+generateTrajectory() computes the acceleration limited speed the motor follows for a config,
+for any number of cycles, without running the control loop. TrajectoryPlayer plays the same
+trajectory back in the live loop, so the preview and the real motor behave identically.
+'''
+
+# Values of motorControl.Mode, compared by value so this module doesn't need the motor's environment
+MODE_CONTINUOUS = 0
+MODE_DIFFERENTIAL = 1
+MODE_SAFE = 99
+
+CONTINUOUS_CYCLE = 1.0	# seconds; continuous mode has no period of its own
+
+"""
+Returns the settings that drive the waveform of the config's mode, or None in continuous mode.
+"""
+def activeSettings(config):
+	mode = config.mode.value
+	if mode == MODE_DIFFERENTIAL:
+		return config.differential
+	elif mode == MODE_SAFE:
+		return config.safe
+	return None
+
+"""
+Returns the length of one cycle of the config, in seconds.
+"""
+def cycleDuration(config) -> float:
+	settings = activeSettings(config)
+	return CONTINUOUS_CYCLE if settings is None else settings.period
+
+"""
+Returns the speed the config asks for at each of the given times, before acceleration limiting.
+"""
+def targetSpeeds(config, times: np.ndarray) -> np.ndarray:
+	settings = activeSettings(config)
+	if settings is None:
+		return np.full(len(times), int(config.continuous.level), dtype=np.int32)
+	return waveformFor(settings).sample(times)
+
+"""
+Applies the control loop's acceleration limit to a whole array of target speeds:
+every sample differs from the previous one by at most 'maxAcceleration', starting from 'startSpeed'.
+
+The limiter is a recurrence, but once the output has caught up with the target it follows it exactly until
+the target itself changes faster than the limit. Those stretches are copied as slices; only the
+samples where the motor lags behind are stepped one at a time.
+"""
+def limitAccelerationArray(targets: np.ndarray, startSpeed: int, maxAcceleration: int) -> np.ndarray:
+	targets = np.asarray(targets, dtype=np.int32)
+	count = len(targets)
+	speeds = np.empty(count, dtype=np.int32)
+	if count == 0:
+		return speeds
+
+	# Indices where the target moves more than the limit allows from the previous sample
+	steep = np.flatnonzero(np.abs(np.diff(targets)) > maxAcceleration) + 1
+	targetList = targets.tolist()
+
+	previous = int(startSpeed)
+	index = 0
+	while index < count:
+		target = targetList[index]
+		if target > previous + maxAcceleration:
+			previous += maxAcceleration
+		elif target < previous - maxAcceleration:
+			previous -= maxAcceleration
+		else:
+			previous = target
+		speeds[index] = previous
+		index += 1
+
+		if previous == target:
+			# Tracking the target: copy it up to the next step that is too steep to follow
+			nextSteep = steep[np.searchsorted(steep, index)] if len(steep) and steep[-1] >= index else count
+			if nextSteep > index:
+				speeds[index:nextSteep] = targets[index:nextSteep]
+				index = nextSteep
+				previous = targetList[index - 1]
+	return speeds
+
+"""
+Returns the acceleration limited speed trajectory of 'cycles' cycles of the config, sampled at 'sampleRate' Hz.
+'start' is the time of the first sample, 'startSpeed' the speed the motor is at before it (defaults to the first target).
+The result is an int32 array; sample n is the speed written n / sampleRate seconds after 'start'.
+"""
+def generateTrajectory(config, sampleRate: float, cycles: float = 1, maxAcceleration: int = None, startSpeed: int = None, start: float = 0.0) -> np.ndarray:
+	if sampleRate <= 0:
+		raise ValueError(f"Non-positive sample rate: {sampleRate}")
+	count = max(1, int(round(cycleDuration(config) * cycles * sampleRate)))
+	times = start + np.arange(count, dtype=np.float64) / sampleRate
+	targets = targetSpeeds(config, times)
+	if maxAcceleration is None:
+		return targets
+	if startSpeed is None:
+		startSpeed = int(targets[0])
+	return limitAccelerationArray(targets, startSpeed, maxAcceleration)
+
+"""
+Plays a precomputed trajectory back one loop tick at a time. When the precomputed cycles run out,
+the next ones are generated from where the previous ones ended, so a long playback is identical to one long trajectory.
+"""
+class TrajectoryPlayer:
+	def __init__(self, config, sampleRate: float, maxAcceleration: int, startSpeed: int, start: float = None, cycles: float = 2):
+		self.config = config
+		self.sampleRate = sampleRate
+		self.maxAcceleration = maxAcceleration
+		self.cycles = cycles
+		self.start = time.time() if start is None else start
+		self.generated = 0		# samples generated before the current chunk
+		self.position = 0
+		self.chunk = generateTrajectory(config, sampleRate, cycles, maxAcceleration, startSpeed, self.start)
+
+	"""
+	Returns the speed for the next loop tick. 'skipped' is the number of ticks the loop missed since the last call,
+	those samples are skipped so the playback stays in step with the clock.
+	"""
+	def next(self, skipped: int = 0) -> int:
+		self.position += skipped
+		while self.position >= len(self.chunk):
+			self.position -= len(self.chunk)
+			self.generated += len(self.chunk)
+			start = self.start + self.generated / self.sampleRate
+			self.chunk = generateTrajectory(self.config, self.sampleRate, self.cycles, self.maxAcceleration, int(self.chunk[-1]), start)
+		speed = int(self.chunk[self.position])
+		self.position += 1
+		return speed
+
+"""
+Previews a config given in the motor/config/in format: prints the trajectory's range and how long it takes to compute.
+"""
+if __name__ == "__main__":
+	import argparse
+	from motorControl import configFromValues, validateConfig, MAX_ACCELERATION, LOOP_INTERVAL, MIN_SPEED
+
+	parser = argparse.ArgumentParser(description="Preview the acceleration limited speed trajectory of a motor config.")
+	parser.add_argument("config", type=str, help="The config in the motor/config/in format; fe: '1,1500,1300,1999,8.0,0.4'")
+	parser.add_argument("-r", "--rate", type=float, default=1.0 / LOOP_INTERVAL, help="Sample rate in Hz. Defaults to the control loop's rate.")
+	parser.add_argument("-c", "--cycles", type=float, default=3, help="Number of cycles to generate.")
+	parser.add_argument("-o", "--output", type=str, default=None, help="Save the trajectory as a .npy file.")
+	args = parser.parse_args()
+
+	config = configFromValues(validateConfig(args.config))
+
+	# The acceleration limit is per control loop tick, scale it to the preview's sample rate
+	maxAcceleration = max(1, int(MAX_ACCELERATION * (1.0 / LOOP_INTERVAL) / args.rate))
+	begin = time.perf_counter()
+	speeds = generateTrajectory(config, args.rate, args.cycles, maxAcceleration, MIN_SPEED)
+	elapsed = time.perf_counter() - begin
+	targets = generateTrajectory(config, args.rate, args.cycles)
+
+	print(f"{len(speeds)} samples at {args.rate:g} Hz in {elapsed * 1e3:.2f} ms")
+	print(f"Speed range {speeds.min()}..{speeds.max()}, target range {targets.min()}..{targets.max()}")
+	print(f"Largest lag behind the target: {np.abs(targets - speeds).max()}")
+	if args.output:
+		np.save(args.output, speeds)
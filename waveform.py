@@ -0,0 +1,95 @@
+import math
+from collections import OrderedDict
+import numpy as np
+
+'''
+Precomputed speed curves for the differential and safe modes.
+
+The rise and fall of one period are sampled into a lookup table when a config is first used,
+so a control loop tick is a table lookup and a linear interpolation instead of a sin() call.
+'''
+
+DEFAULT_RESOLUTION = 1024	# table entries per period
+CACHE_SIZE = 8				# number of differently configured waveforms kept around
+
+"""
+Returns the unit curve (0..1) of one period at the given times, using the same shape as the original controller:
+the 1st quarter of the unit circle while rising, and the 3rd quarter while falling.
+"""
+def unitCurve(timeWithinPeriod: np.ndarray, period: float, ratio: float) -> np.ndarray:
+	risingDuration = period * ratio
+	fallingDuration = period - risingDuration
+	rising = timeWithinPeriod < risingDuration
+
+	curve = np.zeros_like(timeWithinPeriod, dtype=np.float64)
+	if risingDuration != 0:
+		curve[rising] = np.sin(np.pi * 0.5 * timeWithinPeriod[rising] / risingDuration)
+	if fallingDuration != 0:
+		falling = ~rising
+		curve[falling] = np.sin(np.pi + np.pi * 0.5 * (timeWithinPeriod[falling] - risingDuration) / fallingDuration) + 1.0
+	return curve
+
+"""
+Lookup table of one differential period, scaled to min..max.
+"""
+class DifferentialWaveform:
+	def __init__(self, minSpeed: int, maxSpeed: int, period: float, ratio: float, resolution: int = DEFAULT_RESOLUTION):
+		if period <= 0.0:
+			raise ValueError(f"Non-positive differential period: {period}")
+		self.min = minSpeed
+		self.max = maxSpeed
+		self.period = period
+		self.ratio = ratio
+		self.resolution = resolution
+
+		times = np.arange(resolution + 1, dtype=np.float64) * (period / resolution)
+		curve = unitCurve(times, period, ratio)
+		# The last entry closes the period from the left, so interpolating into it doesn't smear the wrap-around jump
+		curve[resolution] = 1.0 if ratio >= 1.0 else 0.0
+
+		self.table = (minSpeed + curve * (maxSpeed - minSpeed)).astype(np.float32)
+		self.values = self.table.tolist()	# Python floats are faster than NumPy scalars for single lookups
+		self.indexScale = resolution / period
+
+	"""
+	Returns the speed at the given time, in seconds. Only the position within the period matters.
+	"""
+	def speedAt(self, t: float) -> int:
+		position = (t % self.period) * self.indexScale
+		index = int(position)
+		if index >= self.resolution:
+			index = self.resolution - 1
+		lower = self.values[index]
+		return int(lower + (self.values[index + 1] - lower) * (position - index))
+
+	"""
+	Returns the speed of one whole period sampled at 'sampleRate' Hz, starting at time 'start', as an int32 array.
+	"""
+	def trajectory(self, sampleRate: float, start: float = 0.0) -> np.ndarray:
+		count = max(1, int(math.ceil(self.period * sampleRate)))
+		times = start + np.arange(count, dtype=np.float64) / sampleRate
+		return self.sample(times)
+
+	"""
+	Returns the speeds at an array of times, as an int32 array.
+	"""
+	def sample(self, times: np.ndarray) -> np.ndarray:
+		positions = np.mod(times, self.period) * self.indexScale
+		return np.interp(positions, np.arange(self.resolution + 1), self.table).astype(np.int32)
+
+_cache = OrderedDict()
+
+"""
+Returns the waveform for a DifferentialSettings-like object, building it only when the settings haven't been seen recently.
+"""
+def waveformFor(settings, resolution: int = DEFAULT_RESOLUTION) -> DifferentialWaveform:
+	key = (settings.min, settings.max, settings.period, settings.ratio, resolution)
+	waveform = _cache.get(key)
+	if waveform is None:
+		waveform = DifferentialWaveform(settings.min, settings.max, settings.period, settings.ratio, resolution)
+		_cache[key] = waveform
+		if len(_cache) > CACHE_SIZE:
+			_cache.popitem(last=False)
+	else:
+		_cache.move_to_end(key)
+	return waveform
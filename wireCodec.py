@@ -0,0 +1,146 @@
+import struct
+
+'''
+Wire formats of the sensor and motor payloads.
+
+Every payload has two encodings:
+- CSV, the original human-readable format; fe. "12.5" for a flow rate or "1,1500,1300,1999,8.0,0.4" for a config.
+- Binary, a fixed little-endian layout: version (uint8), message type (uint8), then the values. Speed and flow
+  are bare values without the version and type: they are sent at the sample rate, and the topic already tells
+  what they are, so the header would make them bigger than their CSV.
+
+Which one a message uses is decided by its topic: the binary variant of a topic has 'bin' as its last level
+instead of 'out' (fe. 'box01/inflow01/inflowRate/bin'), everything else is CSV. Publishers pick the format
+with MQTT_WIRE_FORMAT ('csv' or 'binary'), subscribers decode whatever arrives.
+
+Binary layouts:
+- speed:    uint16 speed, no header
+- flow:     float32 flow rate (SLM), no header
+- dpTemp:   float32 differential pressure (Pa), float32 temperature (C)
+- config:   uint8 mode, uint16 continuous level, uint16 min, uint16 max, float32 period, float32 ratio
+'''
+
+WIRE_VERSION = 1
+
+TYPE_SPEED = 1
+TYPE_FLOW = 2
+TYPE_DP_TEMP = 3
+TYPE_CONFIG = 4
+
+LAYOUTS = {
+    TYPE_SPEED: struct.Struct("<H"),
+    TYPE_FLOW: struct.Struct("<f"),
+    TYPE_DP_TEMP: struct.Struct("<BBff"),
+    TYPE_CONFIG: struct.Struct("<BBBHHHff"),
+}
+
+# Message types whose binary payload is the bare values, without version and type
+HEADERLESS = (TYPE_SPEED, TYPE_FLOW)
+
+# Types of the CSV fields of each message type
+CSV_FIELDS = {
+    TYPE_SPEED: (int,),
+    TYPE_FLOW: (float,),
+    TYPE_DP_TEMP: (float, float),
+    TYPE_CONFIG: (int, int, int, int, float, float),
+}
+
+BINARY_LEVEL = "bin"
+OUT_LEVEL = "out"
+
+"""
+Returns True if the topic carries binary payloads.
+"""
+def isBinaryTopic(topic: str) -> bool:
+    return topic.endswith("/bin/") or topic.endswith("/bin")
+
+"""
+Returns the binary variant of an output topic: the last 'out' level is replaced with 'bin', a trailing '/' is kept.
+"""
+def binaryTopic(topic: str) -> str:
+    stripped = topic.rstrip("/")
+    base, _, last = stripped.rpartition("/")
+    if last != OUT_LEVEL:
+        raise ValueError(f"Not an output topic: {topic}")
+    return base + "/" + BINARY_LEVEL + topic[len(stripped):]
+
+"""
+Encodes the values of a message. Returns bytes in the binary format, a string in CSV.
+"""
+def encode(messageType: int, values, binary: bool):
+    if binary:
+        if messageType in HEADERLESS:
+            return LAYOUTS[messageType].pack(*values)
+        return LAYOUTS[messageType].pack(WIRE_VERSION, messageType, *values)
+    return ",".join(str(value) for value in values)
+
+"""
+Decodes a message payload into a tuple of values, using the format the topic calls for.
+Raises ValueError if the payload doesn't match the message type.
+"""
+def decode(topic: str, payload, messageType: int) -> tuple:
+    if isBinaryTopic(topic):
+        return decodeBinary(payload, messageType)
+    return decodeCSV(payload, messageType)
+
+def decodeBinary(payload: bytes, messageType: int) -> tuple:
+    layout = LAYOUTS[messageType]
+    if len(payload) != layout.size:
+        raise ValueError(f"Expected {layout.size} bytes for message type {messageType}, got {len(payload)}")
+    values = layout.unpack(payload)
+    if messageType in HEADERLESS:
+        return values
+    if values[0] != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire format version: {values[0]}")
+    if values[1] != messageType:
+        raise ValueError(f"Expected message type {messageType}, got {values[1]}")
+    return values[2:]
+
+def decodeCSV(payload, messageType: int) -> tuple:
+    if isinstance(payload, str):
+        payload = payload.encode()
+    fields = payload.split(b",")
+    types = CSV_FIELDS[messageType]
+    if len(fields) != len(types):
+        raise ValueError(f"Expected {len(types)} fields for message type {messageType}, got {len(fields)}")
+    return tuple(fieldType(field) for fieldType, field in zip(types, fields))
+
+# Shortcuts for the hot paths, avoiding the generic encode's argument packing
+
+SPEED_LAYOUT = LAYOUTS[TYPE_SPEED]
+FLOW_LAYOUT = LAYOUTS[TYPE_FLOW]
+DP_TEMP_LAYOUT = LAYOUTS[TYPE_DP_TEMP]
+SPEED_UNPACK = SPEED_LAYOUT.unpack
+FLOW_UNPACK = FLOW_LAYOUT.unpack
+
+def encodeSpeed(speed: int) -> bytes:
+    return SPEED_LAYOUT.pack(speed)
+
+def encodeFlow(flowRate: float) -> bytes:
+    return FLOW_LAYOUT.pack(flowRate)
+
+def encodeDPTemp(pressure: float, temperature: float) -> bytes:
+    return DP_TEMP_LAYOUT.pack(WIRE_VERSION, TYPE_DP_TEMP, pressure, temperature)
+
+"""
+Decode binary speed and flow payloads with a bare unpack. Raise ValueError if the payload has the wrong size.
+"""
+def decodeSpeed(payload: bytes) -> int:
+    try:
+        return SPEED_UNPACK(payload)[0]
+    except struct.error:
+        raise ValueError(f"Expected {SPEED_LAYOUT.size} bytes for a speed, got {len(payload)}") from None
+
+def decodeFlow(payload: bytes) -> float:
+    try:
+        return FLOW_UNPACK(payload)[0]
+    except struct.error:
+        raise ValueError(f"Expected {FLOW_LAYOUT.size} bytes for a flow rate, got {len(payload)}") from None
+
+"""
+Decodes a single-value speed or flow message, CSV or binary depending on the topic.
+"""
+def decodeValue(topic: str, payload, messageType: int) -> float:
+    if isBinaryTopic(topic):
+        return decodeSpeed(payload) if messageType == TYPE_SPEED else decodeFlow(payload)
+    return float(payload)